@@ -3,40 +3,71 @@ Main functions for Peptide MSA (Multiple Sequence Alignment)
 """
 
 import os
-import glob
+import re
+import functools
+import hashlib
+import itertools
+import json
+import shlex
+import shutil
+import subprocess
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
-from typing import Dict
+from typing import Dict, List
 
 from alignment.AlignUtils import AlignUtils
 from alignment.PyHELM_simple import HelmObj
 from alignment.scoring.ScoringUtils import Scoring
 
+# Monomer in the extended FASTA: a non-natural amino acid in square brackets, or a single character.
+# A single opening bracket is matched only if it's never closed
+_FASTA_MONOMER_RE = re.compile(r"\[[^\]]*\]|[^\[]|\[")
 
-def align_sub_peptides(*args, gap_opening_penalty, gap_extension_penalty, polymer_to_align,  # pylint: disable=too-many-locals
+# Default directory for cached MAFFT results. PEPSEA_CACHE_DIR environment variable overrides it
+_DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".pepsea_cache")
+# Maximum number of cached MAFFT results. The least recently used results are removed above it. 0 turns the cache off
+_MAFFT_CACHE_SIZE = int(os.environ.get("PEPSEA_CACHE_SIZE", "1000"))
+# Counter of the results written by the process, so the cache directory is not scanned after every write
+_MAFFT_CACHE_WRITES = itertools.count()
+
+
+def align_sub_peptides(*args, gap_opening_penalty, gap_extension_penalty, polymer_to_align,
                        path_to_mafft, path_to_subst_matrix, path_to_monomer_table, mafft_options="",
-                       realign_method="") -> (Dict[str, str], str, Dict[str, float]):
+                       realign_method="", n_parallel=None, chunk_size=None,
+                       use_cache=True, compute_scores=True) -> (Dict[str, str], str, Dict[str, float]):
     """
     Align or realign (depends in input) HELM sequences with non-natural amino acids,
     separately for each sub-peptide (PEPTIDE1, PEPTIDE2, etc.).
+    Sub-peptides are independent of each other, so they are aligned in parallel threads.
+    Most of the time is spent in MAFFT processes, and threads share the caches of parsed files in this process.
 
     :param args: a list of HELM strings
     :param gap_opening_penalty: a penalty for creating a gap on any length in an aligned sequence
     :param gap_extension_penalty: a penalty for extending a gap by one monomer. See https://en.wikipedia.org/wiki/Gap_penalty.
     :param polymer_to_align: name of the subpeptide, used for alignment. If None, then all the subpeptides are aligned
-    :param path_to_mafft: a path to the MAFFT binary
+    :param path_to_mafft: a path to the MAFFT binary, or a tuple of the path and MAFFT arguments
     :param path_to_subst_matrix: name of the file with the alignment substitution matrix
     :param path_to_monomer_table: name of the file wih a list of monomers, providing Unicode characters representing monomers in
                                   the substitution matrix
-    :param mafft_options: extra MAFFT options, copied unchanged to the MAFFT call string
+    :param mafft_options: extra MAFFT options, split into arguments like in a shell
     :param realign_method: method for sequences realignment,
            options: ["add", "addfull", "addlong", "addfragments", "addprofile"]
+    :param n_parallel: maximum number of sub-peptides aligned at the same time.
+                       By default, it is the number of sub-peptides, limited by the number of CPUs
+    :param chunk_size: maximum number of sequences aligned in a single MAFFT call. Bigger sets of sequences of a sub-peptide
+                       are split into chunks, aligned in parallel and merged. By default, sequences are not split
+    :param use_cache: whether to reuse MAFFT results of the previous runs with the same input and parameters.
+                      The results are stored as JSON in the directory set by PEPSEA_CACHE_DIR environment variable
+                      (~/.pepsea_cache by default), up to PEPSEA_CACHE_SIZE results (1000 by default).
+                      PEPSEA_CACHE_SIZE=0 turns the cache off
+    :param compute_scores: whether to calculate alignment scores. If False, all the scores are None
     :return: 1) A dictionary of aligned sub-peptides: keys are sub-peptide names, and values are aligned sub-peptide sequences,
                 one per line.
              2) The stderr output of MAFFT.
     """
 
-    aligner = AlignUtils()
-
     # Unique marker of this task, used for creating temporary file names.
     timestamp = datetime.now().isoformat(timespec='milliseconds')
 
@@ -44,146 +75,443 @@ def align_sub_peptides(*args, gap_opening_penalty, gap_extension_penalty, polyme
     realign = bool(len(args) == 2)
 
     if realign:
-        # Create distinct file names for aligned sequences and new sequences
-        timestamp_aligned = str(timestamp) + "_aligned"
-        timestamp_new = str(timestamp) + "_new"
-
         # Transform aligned sequences into HELM strings
         aligned_seqs_helm = convert2helm(args[0])
-        aligned_seqs_helm = "\n".join(aligned_seqs_helm)
 
         # Split HELM strings of aligned sequences into several sub-peptides
-        aligned_seqs_helm_dict = split_sub_peptides(aligned_seqs_helm, polymer_to_align)
+        aligned_parsed_cache = {}
+        aligned_seqs_helm_dict = _split_sub_peptide_lists(aligned_seqs_helm, polymer_to_align, aligned_parsed_cache)
 
         # Split HELM strings of new sequences into several sub-peptides
-        new_seqs_helm_dict = split_sub_peptides(args[1], polymer_to_align)
+        new_parsed_cache = {}
+        new_seqs_helm_dict = _split_sub_peptide_lists(args[1].split("\n"), polymer_to_align, new_parsed_cache)
 
         # Get the list of subpeptides, which are present in both sets of sequences
         subpeptides = get_common_subpeptides(aligned_seqs_helm_dict.keys(), new_seqs_helm_dict.keys())
     else:
         # Split one HELM string to several sub-peptides
-        helm_aligned_dict = split_sub_peptides(args[0], polymer_to_align)
+        parsed_cache = {}
+        helm_aligned_dict = _split_sub_peptide_lists(args[0].split("\n"), polymer_to_align, parsed_cache)
         subpeptides = helm_aligned_dict.keys()
 
     # This will return error message, in case the specified PolymerID is not in the input
-    if polymer_to_align is not None and polymer_to_align not in subpeptides:
+    if polymer_to_align is not None and polymer_to_align not in set(subpeptides):
         return None, None, None
 
-    # Align all sub-peptides using MAFFT in a loop
+    # Input HELM strings of every sub-peptide: (aligned sequences, new sequences) or (sequences, None),
+    # and the already parsed HELM strings
+    jobs = {}
+    for key in subpeptides:
+        if realign:
+            jobs[key] = (aligned_seqs_helm_dict[key], new_seqs_helm_dict[key],
+                         {**aligned_parsed_cache[key], **new_parsed_cache[key]})
+        else:
+            jobs[key] = (helm_aligned_dict[key], None, parsed_cache[key])
+
+    align_kwargs = {"gap_opening_penalty": gap_opening_penalty, "gap_extension_penalty": gap_extension_penalty,
+                    "path_to_mafft": path_to_mafft, "path_to_subst_matrix": path_to_subst_matrix,
+                    "path_to_monomer_table": path_to_monomer_table, "mafft_options": mafft_options,
+                    "realign_method": realign_method, "chunk_size": chunk_size, "use_cache": use_cache,
+                    "compute_scores": compute_scores}
+
+    if n_parallel is None:
+        n_parallel = min(len(jobs), os.cpu_count() or 1)
+
+    # All temporary files of this task are created in a dedicated directory
+    work_dir = tempfile.mkdtemp(prefix=f"pepsea_{timestamp}_")
+
+    results = {}
+    try:
+        if n_parallel > 1 and len(jobs) > 1:
+            # Align all sub-peptides using MAFFT in a pool of threads. Worker processes would not be safe to fork
+            # from the threads of the API, and would start with empty caches
+            with ThreadPoolExecutor(max_workers=n_parallel) as executor:
+                futures = {executor.submit(_align_one, key, helm_lines, new_helm_lines, timestamp, work_dir=work_dir,
+                                           parsed_cache=parsed, **align_kwargs): key
+                           for key, (helm_lines, new_helm_lines, parsed) in jobs.items()}
+                for future in as_completed(futures):
+                    results[futures[future]] = future.result()
+        else:
+            # Align all sub-peptides using MAFFT in a loop
+            for key, (helm_lines, new_helm_lines, parsed) in jobs.items():
+                results[key] = _align_one(key, helm_lines, new_helm_lines, timestamp, work_dir=work_dir,
+                                          parsed_cache=parsed, **align_kwargs)
+    finally:
+        # Clean-up temporary files for this task
+        cleanup(work_dir)
+
     main_output = {}
     mafft_stderr = ""
 
     # Scores of alignments
     alignment_scores = {}
 
-    for key in subpeptides:
+    # Collect the results in the order of sub-peptides. The stderr of the last MAFFT call is returned
+    for key in jobs:
+        main_output[key], key_stderr, alignment_scores[key] = results[key]
+        if key_stderr is not None:
+            mafft_stderr = key_stderr
 
-        if realign:
-            #  Convert aligned sequences into FASTA
-            aligned_fasta_input_lines = []
-            aligned_helm_input_lines = aligned_seqs_helm_dict[key].split("\n")
-            for line in aligned_helm_input_lines:
-                aligned_fasta_input_lines.append(helm2fasta(line))
-
-            # Convert new sequences into FASTA
-            new_fasta_input_lines = []
-            new_helm_input_lines = new_seqs_helm_dict[key].split("\n")
-            for line in new_helm_input_lines:
-                new_fasta_input_lines.append(helm2fasta(line))
-
-            # Create file with input data of aligned sequences for MAFFT utility
-            # it contains FASTA rows with replaced nn-AA
-            # here we store conversion info inside the aligner
-            aligned_seqs_input_file = aligner.encode_alignment_sequences(aligned_fasta_input_lines,
-                                                                         key,
-                                                                         timestamp_aligned)
-
-            """
-            Create file with input data of new sequences for MAFFT utility
-            It contains FASTA rows with replaced nn-AA
-            Here we store conversion info inside the aligner
-            The conversion info includes encoding of both aligned and new sequences
-            This info is cleaned up at the end of the cycle
-            """
-            new_seqs_input_file = aligner.encode_alignment_sequences(new_fasta_input_lines,
-                                                                     key,
-                                                                     timestamp_new)
+    return main_output, mafft_stderr, alignment_scores
+
+
+def _align_one(key, helm_lines, new_helm_lines, timestamp, *, gap_opening_penalty, gap_extension_penalty,  # pylint: disable=too-many-locals
+               path_to_mafft, path_to_subst_matrix, path_to_monomer_table, mafft_options, realign_method,
+               chunk_size=None, work_dir="", parsed_cache=None, use_cache=True, compute_scores=True):
+    """
+    Align or realign sequences of a single sub-peptide.
+    Runs in a worker thread, so it doesn't modify its arguments, which can be shared by other sub-peptides.
+
+    :param key: name of the sub-peptide (PEPTIDE1, PEPTIDE2,...)
+    :param helm_lines: list of HELM strings of the sub-peptide (already aligned sequences in case of realignment)
+    :param new_helm_lines: list of HELM strings of the new sequences of the sub-peptide. None means alignment
+    :param timestamp: unique marker of the task, used for creating temporary file names
+    :param chunk_size: maximum number of sequences aligned in a single MAFFT call (alignment only)
+    :param work_dir: directory for temporary files
+    :param parsed_cache: optional dictionary of already parsed HELM strings of the sub-peptide {HELM_STR: HelmObj}
+    :param use_cache: whether to reuse MAFFT results of the previous runs with the same input and parameters
+    :param compute_scores: whether to calculate the alignment score
+    :return: 1) Aligned sequences in FASTA format.
+             2) The stderr output of MAFFT, or None if MAFFT was not called.
+             3) The alignment score.
+    """
+    aligner = AlignUtils()
+    realign = new_helm_lines is not None
+
+    # Input files of separately aligned chunks of sequences. Empty, if sequences are aligned in one MAFFT call
+    chunk_files = []
+
+    # Positions of the input sequences in the list of unique sequences. None, if all the sequences are unique
+    expand_map = None
+
+    if realign:
+        #  Convert aligned sequences into FASTA
+        aligned_fasta_input_lines = helm2fasta_many(helm_lines, parsed_cache)
+
+        # Convert new sequences into FASTA
+        new_fasta_input_lines = helm2fasta_many(new_helm_lines, parsed_cache)
+
+        # Create input data of aligned sequences for MAFFT utility, passed through the standard input
+        # it contains FASTA rows with replaced nn-AA
+        # here we store conversion info inside the aligner
+        input_data = aligner.encode_alignment_sequences_to_bytes(aligned_fasta_input_lines, key)
+
+        """
+        Create input data of new sequences for MAFFT utility, passed through a pipe
+        It contains FASTA rows with replaced nn-AA
+        Here we store conversion info inside the aligner
+        The conversion info includes encoding of both aligned and new sequences
+        """
+        new_data = aligner.encode_alignment_sequences_to_bytes(new_fasta_input_lines, key)
+    else:
+        #  Convert to FASTA
+        fasta_input_lines = helm2fasta_many(helm_lines, parsed_cache)
+
+        # Skip, if there is only one sequence of the given sub-peptide
+        if len(fasta_input_lines) == 1:
+            return fasta_input_lines[0], None, None
+
+        # Identical sequences are aligned only once, and expanded back after the alignment
+        unique_lines = list(dict.fromkeys(fasta_input_lines))
+        if 1 < len(unique_lines) < len(fasta_input_lines):
+            unique_index = {line: i for i, line in enumerate(unique_lines)}
+            expand_map = [unique_index[line] for line in fasta_input_lines]
+            fasta_input_lines = unique_lines
+
+        # Big sets of sequences are split into chunks, which are aligned separately and merged after
+        chunks = [fasta_input_lines]
+        if chunk_size and len(fasta_input_lines) > chunk_size:
+            chunks = [fasta_input_lines[i:i + chunk_size] for i in range(0, len(fasta_input_lines), chunk_size)]
+
+        # Create input data for MAFFT utility: passed through the standard input, or files for chunks
+        # it contains FASTA rows with replaced nn-AA
+        # here we store conversion info inside the aligner, so all the chunks share the same encoding
+        if len(chunks) == 1:
+            input_data = aligner.encode_alignment_sequences_to_bytes(fasta_input_lines, key)
         else:
-            #  Convert to FASTA
-            fasta_input_lines = []
-            helm_input_lines = helm_aligned_dict[key].split("\n")
-            for line in helm_input_lines:
-                fasta_input_lines.append(helm2fasta(line))
-
-            # Skip, if there is only one sequence of the given sub-peptide
-            if len(fasta_input_lines) == 1:
-                main_output[key] = fasta_input_lines[0]
-                alignment_scores[key] = None
-                continue
+            chunk_files = [aligner.encode_alignment_sequences(chunk, key, f"{timestamp}_chunk{i}", work_dir)
+                           for i, chunk in enumerate(chunks)]
 
-            # Create file with input data for MAFFT utility
-            # it contains FASTA rows with replaced nn-AA
-            # here we store conversion info inside the aligner
-            input_file_mafft = aligner.encode_alignment_sequences(fasta_input_lines, key, timestamp)
+    # Calculate substitution matrix
+    subst_matrix_file = aligner.create_substitution_matrix(path_to_subst_matrix,
+                                                           path_to_monomer_table,
+                                                           key,
+                                                           timestamp,
+                                                           work_dir)
 
-        # Calculate substitution matrix
-        subst_matrix_file = aligner.create_substitution_matrix(path_to_subst_matrix,
-                                                               path_to_monomer_table,
-                                                               key,
-                                                               timestamp)
+    if realign:
+        mafft_inputs = [input_data, new_data]
+    elif chunk_files:
+        mafft_inputs = chunk_files
+    else:
+        mafft_inputs = [input_data]
+
+    # Results of MAFFT are cached on disk, keyed on the encoded input, substitution matrix and parameters
+    # The key includes MAFFT version, so the results of an older MAFFT are not reused after an upgrade
+    cache_key, cached_output = None, None
+    mafft_version = _mafft_version(path_to_mafft) if use_cache and _MAFFT_CACHE_SIZE > 0 else None
+    if mafft_version is not None:
+        cache_key = _mafft_cache_key(mafft_inputs, subst_matrix_file, path_to_mafft, mafft_version, gap_opening_penalty,
+                                     gap_extension_penalty, mafft_options, realign_method, chunk_size)
+        cached_output = _read_mafft_cache(cache_key)
+
+    if cached_output is not None:
+        mafft_stdout, mafft_stderr = cached_output
+    elif realign:
+        # Realign sequences in MAFFT
+        mafft_stdout, mafft_stderr = aligner.run_mafft_utility("-", input_data=input_data, add_data=new_data,
+                                                               mafft_binary=path_to_mafft,
+                                                               matrix_file=subst_matrix_file, gap_opening_penalty=gap_opening_penalty,
+                                                               gap_extension_penalty=gap_extension_penalty, realign=realign,
+                                                               realign_method=realign_method, mafft_options=mafft_options)
+    elif chunk_files:
+        # Align chunks in parallel and merge them into a single alignment
+        mafft_stdout, mafft_stderr = _align_chunks(chunk_files, key, timestamp, work_dir, mafft_binary=path_to_mafft,
+                                                   matrix_file=subst_matrix_file,
+                                                   gap_opening_penalty=gap_opening_penalty,
+                                                   gap_extension_penalty=gap_extension_penalty,
+                                                   mafft_options=mafft_options)
+    else:
+        # Run MAFFT utility
+        mafft_stdout, mafft_stderr = aligner.run_mafft_utility("-", input_data=input_data, mafft_binary=path_to_mafft,
+                                                               matrix_file=subst_matrix_file,
+                                                               gap_opening_penalty=gap_opening_penalty,
+                                                               gap_extension_penalty=gap_extension_penalty,
+                                                               realign=realign, mafft_options=mafft_options)
 
-        if realign:
-            # Realign sequences in MAFFT
-            mafft_stdout, mafft_stderr = aligner.run_mafft_utility(aligned_seqs_input_file, new_seqs_input_file,
-                                                                   mafft_binary=path_to_mafft,
-                                                                   matrix_file=subst_matrix_file, gap_opening_penalty=gap_opening_penalty,
-                                                                   gap_extension_penalty=gap_extension_penalty, realign=realign,
-                                                                   realign_method=realign_method, mafft_options=mafft_options)
+    if cache_key is not None and cached_output is None:
+        _write_mafft_cache(cache_key, (mafft_stdout, mafft_stderr))
+
+    # Read aligned sequences in FASTA from the full MAFFT output
+    fasta_mafft_output_array = get_aligned_sequences(mafft_stdout)
+
+    # Restore the duplicated sequences, so they are present in the output and in the score
+    if expand_map is not None:
+        fasta_mafft_output_array = [fasta_mafft_output_array[i] for i in expand_map]
+        mafft_stdout = "".join(fasta_mafft_output_array)
+
+    # Calculate alignment score
+    alignment_score = get_alignment_score(mafft_stdout, subst_matrix_file) if compute_scores else None
+
+    # Decode MAFFT output and return the real names for replaced NAA
+    fasta_mafft_decoded_array = aligner.decode_mafft(fasta_mafft_output_array)
+
+    # Convert array to string
+    return "".join(fasta_mafft_decoded_array), mafft_stderr, alignment_score
+
+
+def _mafft_cache_key(inputs, matrix_file, *params):
+    """
+    Calculate the key of MAFFT results in the cache
+
+    :param inputs: list of MAFFT inputs with encoded sequences: files, or bytes passed through the standard input
+    :param matrix_file: substitution matrix file
+    :param params: MAFFT parameters, which affect the alignment
+    :return: hexadecimal SHA-256 digest
+    """
+    digest = hashlib.sha256()
+    for item in [*inputs, matrix_file]:
+        if isinstance(item, bytes):
+            digest.update(item)
         else:
-            # Run MAFFT utility
-            mafft_stdout, mafft_stderr = aligner.run_mafft_utility(input_file_mafft, mafft_binary=path_to_mafft,
-                                                                   matrix_file=subst_matrix_file,
-                                                                   gap_opening_penalty=gap_opening_penalty,
-                                                                   gap_extension_penalty=gap_extension_penalty,
-                                                                   realign=realign, mafft_options=mafft_options)
+            with open(item, "rb") as ifile:
+                digest.update(ifile.read())
+        digest.update(b"\0")
+    digest.update(repr(params).encode("utf-8"))
+    return digest.hexdigest()
 
-        # Read aligned sequences in FASTA from the full MAFFT output
-        fasta_mafft_output_array = get_aligned_sequences(mafft_stdout)
 
-        # Calculate alignment score
-        alignment_scores[key] = get_alignment_score(mafft_stdout, subst_matrix_file)
+def _mafft_cache_dir():
+    """Directory of cached MAFFT results. The environment is read on every call, so the directory can be changed at runtime"""
+    return os.environ.get("PEPSEA_CACHE_DIR", _DEFAULT_CACHE_DIR)
 
-        # Decode MAFFT output and return the real names for replaced NAA
-        fasta_mafft_decoded_array = aligner.decode_mafft(fasta_mafft_output_array)
 
-        # Convert array to string
-        main_output[key] = "".join(fasta_mafft_decoded_array)
+def _mafft_version(mafft_binary):
+    """
+    Get the version of MAFFT program, a part of the cache key
 
-        # Clean data about encoded sequences from the aligner
-        aligner.clear_symbols()
+    :param mafft_binary: path to the MAFFT binary, or a sequence of the path and MAFFT arguments
+    :return: output of "mafft --version", or None if it can't be run
+    """
+    program = shlex.split(mafft_binary)[0] if isinstance(mafft_binary, str) else mafft_binary[0]
+    return _program_version(program)
 
-    # Clean-up temporary files for this task
-    cleanup(timestamp)
 
-    return main_output, mafft_stderr, alignment_scores
+@functools.lru_cache(maxsize=16)
+def _program_version(program):
+    """Run "PROGRAM --version" once per program, see _mafft_version()"""
+    try:
+        result = subprocess.run([program, "--version"], check=False, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    except OSError:
+        return None
+    if result.returncode != 0:
+        return None
+    return result.stdout.decode(encoding="utf-8", errors="replace").strip()
 
 
-def split_sub_peptides(helm_input, polymer_to_align):
+def _read_mafft_cache(cache_key):
+    """
+    Read MAFFT results from the cache
+
+    :param cache_key: key of the results, see _mafft_cache_key()
+    :return: MAFFT standard output and error, or None if the results are not cached
+    """
+    cache_file = os.path.join(_mafft_cache_dir(), cache_key + ".json")
+    try:
+        with open(cache_file, "rb") as ifile:
+            mafft_output = json.load(ifile)
+        # Recently used results are kept, when the cache is full
+        os.utime(cache_file)
+    except (OSError, ValueError):
+        return None
+
+    # Only a pair of strings is accepted, anything else in the cache directory is ignored
+    if not (isinstance(mafft_output, list) and len(mafft_output) == 2 and all(isinstance(i, str) for i in mafft_output)):
+        return None
+    return tuple(mafft_output)
+
+
+def _write_mafft_cache(cache_key, mafft_output):
+    """
+    Store MAFFT results in the cache. Failures are ignored, as the cache is optional
+
+    :param cache_key: key of the results, see _mafft_cache_key()
+    :param mafft_output: MAFFT standard output and error
+    """
+    cache_dir = _mafft_cache_dir()
+    cache_file = os.path.join(cache_dir, cache_key + ".json")
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+
+        # Write to a temporary file first, so parallel tasks never read incomplete results
+        temp_file = f"{cache_file}.{os.getpid()}.{threading.get_ident()}"
+        with open(temp_file, "w", encoding="utf-8") as ofile:
+            json.dump(list(mafft_output), ofile)
+        os.replace(temp_file, cache_file)
+
+        # Scanning the directory is slow for a big cache, so it's trimmed only after a number of writes,
+        # and may hold about a tenth more results in between
+        if next(_MAFFT_CACHE_WRITES) % max(1, _MAFFT_CACHE_SIZE // 10) == 0:
+            _trim_mafft_cache(cache_dir)
+    except OSError:
+        pass
+
+
+def _trim_mafft_cache(cache_dir):
+    """
+    Remove the least recently used results, so the cache holds at most _MAFFT_CACHE_SIZE results
+
+    :param cache_dir: directory of cached MAFFT results
+    """
+    entries = []
+    for entry in os.scandir(cache_dir):
+        if entry.name.endswith(".json"):
+            try:
+                entries.append((entry.stat().st_mtime, entry.path))
+            except OSError:
+                continue
+
+    if len(entries) <= _MAFFT_CACHE_SIZE:
+        return
+
+    entries.sort()
+    for _, path in entries[:len(entries) - _MAFFT_CACHE_SIZE]:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def _align_chunks(chunk_files, key, timestamp, work_dir, *, mafft_binary, matrix_file, gap_opening_penalty,
+                  gap_extension_penalty, mafft_options):
+    """
+    Align chunks of sequences of a single sub-peptide in parallel, then merge the alignments of chunks
+    with MAFFT "merge" option, keeping the alignment inside every chunk.
+
+    :param chunk_files: list of MAFFT input files with encoded chunks of sequences
+    :param key: name of the sub-peptide (PEPTIDE1, PEPTIDE2,...)
+    :param timestamp: unique marker of the task, used for creating temporary file names
+    :param work_dir: directory for temporary files
+    :return: MAFFT standard output and error of the final merge as strings
+    """
+    mafft_kwargs = {"mafft_binary": mafft_binary, "matrix_file": matrix_file, "gap_opening_penalty": gap_opening_penalty,
+                    "gap_extension_penalty": gap_extension_penalty, "realign": False}
+
+    def align_chunk(chunk_file):
+        # The number of MAFFT processes running at the same time is limited by run_mafft_utility()
+        return AlignUtils.run_mafft_utility(chunk_file, mafft_options=mafft_options, **mafft_kwargs)
+
+    with ThreadPoolExecutor(max_workers=len(chunk_files)) as executor:
+        chunk_outputs = list(executor.map(align_chunk, chunk_files))
+
+    # Merge input contains all aligned chunks, and the table lists the sequence numbers of every chunk
+    merge_input_file = os.path.join(work_dir, f"{key}_{timestamp}_merge_mafft.txt")
+    merge_table_file = os.path.join(work_dir, f"{key}_{timestamp}_merge_table.txt")
+    sequence_number = 0
+    merge_table = []
+    for chunk_stdout, _ in chunk_outputs:
+        chunk_length = chunk_stdout.count(">")
+        merge_table.append(" ".join(str(i) for i in range(sequence_number + 1, sequence_number + chunk_length + 1)) + "\n")
+        sequence_number += chunk_length
+
+    with open(merge_input_file, "wb") as input_file, open(merge_table_file, "wb") as table_file:
+        input_file.write("".join(chunk_stdout for chunk_stdout, _ in chunk_outputs).encode("latin-1"))
+        table_file.write("".join(merge_table).encode("ascii"))
+
+    merge_options = mafft_options + " --merge " + shlex.quote(merge_table_file)
+    return AlignUtils.run_mafft_utility(merge_input_file, mafft_options=merge_options, **mafft_kwargs)
+
+
+def split_sub_peptides(helm_input, polymer_to_align, parsed_cache=None):
     """
     Split HELM string into individual sub-peptides (PEPTIDE1, PEPTIDE2...)
 
     :param helm_input: HELM string
     :param polymer_to_align: name of the subpeptide, used for alignment. If None, then all the subpeptides are aligned
+    :param parsed_cache: optional dictionary, which is filled with the parsed HELM strings of sub-peptides
+                         {PEPTIDE_NAME: {HELM_STR: HelmObj}}, so they don't need to be parsed again
     :return: helm_lines: dictionary [PEPTIDE_NAME, HELM_STR] (instead peptide may be any other key)
     """
-    input_lines = helm_input.split("\n")
+    return split_sub_peptides_from_list(helm_input.split("\n"), polymer_to_align, parsed_cache)
+
+
+def split_sub_peptides_from_list(input_lines: List[str], polymer_to_align, parsed_cache=None):
+    """
+    Split a list of HELM strings into individual sub-peptides (PEPTIDE1, PEPTIDE2...), see split_sub_peptides()
+
+    :param input_lines: list of HELM strings
+    :param polymer_to_align: name of the subpeptide, used for alignment. If None, then all the subpeptides are aligned
+    :param parsed_cache: optional dictionary, which is filled with the parsed HELM strings of sub-peptides
+                         {PEPTIDE_NAME: {HELM_STR: HelmObj}}
+    :return: helm_lines: dictionary [PEPTIDE_NAME, HELM_STR]
+    """
+    helm_lines = _split_sub_peptide_lists(input_lines, polymer_to_align, parsed_cache)
+    return {name: "\n".join(lines) for name, lines in helm_lines.items()}
+
+
+def _split_sub_peptide_lists(input_lines, polymer_to_align, parsed_cache=None):
+    """
+    Split a list of HELM strings into individual sub-peptides, keeping HELM strings of every sub-peptide in a list
+
+    :param input_lines: list of HELM strings
+    :param polymer_to_align: name of the subpeptide, used for alignment. If None, then all the subpeptides are aligned
+    :param parsed_cache: optional dictionary, which is filled with the parsed HELM strings of sub-peptides
+                         {PEPTIDE_NAME: {HELM_STR: HelmObj}}
+    :return: helm_lines: dictionary [PEPTIDE_NAME, list of HELM_STR]
+    """
     helm_obj = HelmObj()
     helm_lines = {}
     for line in input_lines:
         helm_obj.parse_helm(line)
         for polymer in helm_obj.polymers:
             if not polymer_to_align or polymer.name == polymer_to_align:
-                helm_lines = extract_sub_peptide(polymer.name, helm_lines, polymer.data)
+                sub_peptide = polymer.name + "{" + polymer.data + "}$$$$"
+                helm_lines.setdefault(polymer.name, []).append(sub_peptide)
+                if parsed_cache is not None:
+                    # HELM string of the sub-peptide consists of this polymer only
+                    sub_peptide_obj = HelmObj()
+                    sub_peptide_obj.polymers.append(polymer)
+                    parsed_cache.setdefault(polymer.name, {})[sub_peptide] = sub_peptide_obj
 
     return helm_lines
 
@@ -208,7 +536,7 @@ def extract_sub_peptide(polymer_name, helm_dict, polymer_data):
     return helm_dict
 
 
-def helm2fasta(helm):
+def helm2fasta(helm, parsed=None):
     """
     Converts HELM string into an extended FASTA format.
     Only peptide polymers are converted, other polymers are ignored.
@@ -216,30 +544,61 @@ def helm2fasta(helm):
     Any residue names longer than one character are converted into "(name)" in the FASTA output.
 
     :param helm: HELM string
+    :param parsed: optional HelmObj, which already contains the parsed HELM string. Then the string is not parsed again
     :return: fasta: FASTA string
     """
+    return _helm2fasta(HelmObj(), helm, parsed)
+
+
+def helm2fasta_many(helm_lines, parsed_cache=None):
+    """
+    Converts a list of HELM strings into a list of strings in an extended FASTA format, see helm2fasta().
+    A single HELM parser is reused for all the strings.
+
+    :param helm_lines: list of HELM strings
+    :param parsed_cache: optional dictionary of already parsed HELM strings {HELM_STR: HelmObj}
+    :return: list of FASTA strings
+    """
     helm_obj = HelmObj()
-    helm_obj.parse_helm(helm)
+    if parsed_cache is None:
+        parsed_cache = {}
+    return [_helm2fasta(helm_obj, helm, parsed_cache.get(helm)) for helm in helm_lines]
 
-    fasta = ''
-    for polymer in helm_obj.polymers:
-        fasta += "> %s\n" % polymer.name
+
+def _helm2fasta(helm_obj, helm, parsed=None):
+    """
+    Converts HELM string into an extended FASTA format, using the given HELM parser
+
+    :param helm_obj: HelmObj instance, used for parsing HELM
+    :param helm: HELM string
+    :param parsed: optional HelmObj, which already contains the parsed HELM string
+    :return: fasta: FASTA string
+    """
+    if parsed is None:
+        helm_obj.parse_helm(helm)
+        parsed = helm_obj
+
+    # FASTA fragments, joined once at the end
+    fasta = []
+    for polymer in parsed.polymers:
+        fasta.append("> %s\n" % polymer.name)
 
         # Read polymers of CHEM type as single monomer
         if polymer.type == "CHEM":
-            fasta += polymer.data
+            fasta.append(polymer.data)
         else:
-            for monomer in helm_obj.get_monomers_from_polymer(helm, polymer.name):
+            # Monomers are taken from the parsed polymer, without splitting the HELM string again
+            for monomer in polymer.data.split("."):
                 if len(monomer) == 1:
-                    fasta += monomer
+                    fasta.append(monomer)
                 else:
                     if "[" in monomer:
-                        fasta += monomer
+                        fasta.append(monomer)
                     else:
-                        fasta += "[%s]" % monomer
-        fasta += '\n'
+                        fasta.append("[%s]" % monomer)
+        fasta.append('\n')
 
-    return fasta
+    return "".join(fasta)
 
 
 def convert2helm(fasta):
@@ -269,35 +628,19 @@ def convert2helm(fasta):
 
 def fasta2helm(fasta_seq):
     """Converts multi-line FASTA format into HELM strings"""
-    helm = ''
-    nnAA = False
-    amino_symbol = ''
-    for el in fasta_seq:
-        if len(helm) > 0 and not nnAA:
-            helm += "."
-
-        if el == "[":
-            amino_symbol += el
-            nnAA = True
-        elif el == "]":
-            amino_symbol += el
-            helm += amino_symbol
-            nnAA = False
-            amino_symbol = ''
-        elif nnAA:
-            amino_symbol += el
-        else:
-            helm += el
+    # Monomers are matched by the compiled regular expression, instead of a loop over single characters
+    monomers = _FASTA_MONOMER_RE.findall(fasta_seq)
 
     # Check that all the nnAAs were processed correctly - all the squared brackets in the input sequence are paired
-    assert not nnAA, f"Non-valid notation of non-natural amino acids in the following sequence {fasta_seq}"
+    assert "[" not in monomers, f"Non-valid notation of non-natural amino acids in the following sequence {fasta_seq}"
 
-    return helm
+    return ".".join(monomers)
 
 
 def get_common_subpeptides(list1, list2):
-    """Get intersection of two sub-peptide chain lists (chain names)"""
-    common_list = [sub_peptide for sub_peptide in list1 if sub_peptide in list2]
+    """Get intersection of two sub-peptide chain lists (chain names), keeping the order of the first list"""
+    names2 = set(list2)
+    common_list = [sub_peptide for sub_peptide in list1 if sub_peptide in names2]
     return common_list
 
 
@@ -307,26 +650,32 @@ def get_aligned_sequences(mafft_output):
     :param mafft_output: MAFFT program output in FASTA format
     :return: Array of the aligned sequences in FASTA format
     """
-    # mafft_lines = Array of FASTA lines
-
-    mafft_lines = mafft_output.splitlines()
-    headers = [line for line in mafft_lines if line.startswith(">")]
-    sequences = ["".join(sequence.split("\n")[1:]) for sequence in mafft_output.split(">") if sequence]
-
-    sequence_part = [i + "\n" + j + "\n" for i, j in zip(headers, sequences)]
+    sequence_part = []
+    header = None
+    sequence = []
+
+    # Single pass over the lines. Don't use splitlines(), as some of the encoding characters are line breaks for it
+    for line in mafft_output.split("\n"):
+        if line.startswith(">"):
+            if header is not None:
+                sequence_part.append(header + "\n" + "".join(sequence) + "\n")
+            header = line
+            sequence = []
+        else:
+            sequence.append(line)
+    if header is not None:
+        sequence_part.append(header + "\n" + "".join(sequence) + "\n")
 
     return sequence_part
 
 
-def cleanup(timestamp):
+def cleanup(work_dir):
     """
     Delete all temporary files
-    :param timestamp:
+    :param work_dir: directory with temporary files of the task
     :return:
     """
-    files = glob.glob(f'*{timestamp}*')
-    for file in files:
-        os.remove(file)
+    shutil.rmtree(work_dir, ignore_errors=True)
 
 
 def get_alignment_score(mafft_out, path_to_subst_matrix):
@@ -3,11 +3,44 @@ Unicode characters encoding/decoding
 """
 
 import csv
+import functools
 import os
 import re
-import ntpath
+import shlex
 from subprocess import run, PIPE, CompletedProcess
 import sys
+import threading
+
+# Patterns used on every sequence, compiled once. ApiUtils shares them
+_RE_CHEM = re.compile(r"\[.*\]")
+_RE_BRACKETS = re.compile(r'[\[\]]')
+# Non-natural AA without nested brackets. Line breaks are excluded, so a token never spans joined sequences
+_RE_NAA = re.compile(r'\[[^\[\]\n]*\]')
+
+# Natural amino acids, the order is kept in the substitution matrix
+_NATURAL_AA = ("G", "A", "V", "L", "I", "M", "P", "F", "W", "S", "T", "N", "Q", "Y", "C", "K", "R", "H", "D", "E")
+_NATURAL_AA_SET = frozenset(_NATURAL_AA)
+# Characters available for encoding of non-natural AA, excluding ASCII chars with special meaning for MAFFT
+_EXCLUDED_ASCII = frozenset([0x3E, 0x3D, 0x3C, 0x2D, 0x20, 0x0d, 0x0a, 0x00])
+_ENCODING_CHARS = tuple(chr(i) for i in range(256)
+                        if i not in _EXCLUDED_ASCII and chr(i).upper() not in _NATURAL_AA_SET)
+# Environment of MAFFT runs. If the locale is set to UTF-8, then MAFFT will not accept characters over 0x79,
+# and reports "tr: Illegal byte sequence"
+_MAFFT_ENV = {**os.environ, "LC_CTYPE": "C"}
+# The only limit of MAFFT processes running at the same time in this process, shared by all the requests, sub-peptides
+# and chunks. By default, it is the number of CPUs
+_MAFFT_SEMAPHORE = threading.BoundedSemaphore(int(os.environ.get("PEPSEA_MAX_MAFFT_PROCESSES", 0)) or os.cpu_count() or 1)
+
+
+@functools.lru_cache(maxsize=256)
+def _tokens_re(tokens):
+    """Compile pattern, which matches any of the tokens. The result is cached, as batches of the same polymer
+    usually share their nested monomers
+
+    :param tokens: tuple of tokens, the longest ones first
+    :return: compiled pattern
+    """
+    return re.compile("|".join(re.escape(token) for token in tokens))
 
 
 class AlignUtils:
@@ -23,75 +56,135 @@ class AlignUtils:
         self.__d_enc = {}
         # dictionary for decoding
         self.__d_dec = {}
+        # table of str.translate() for decoding, kept in sync with the dictionary
+        self.__trans_table = {}
         # list of natural amino acids
-        self.__natAA = ["G", "A", "V", "L", "I", "M", "P", "F", "W", "S", "T", "N", "Q", "Y", "C", "K", "R", "H", "D", "E"]
+        self.__natAA = list(_NATURAL_AA)
 
     # Private methods:
     def __repl(self, val):
         """
         Replaces non-natural amino-acids to special symbols
         :param val: string, non-natural amino acid to be replaced by Hex code
-        :return:
+        :return: the character, which encodes the non-natural amino acid
         """
 
-        if len(self.__chars) == 0:
-            exc_ascii = [0x3E, 0x3D, 0x3C, 0x2D, 0x20, 0x0d, 0x0a, 0x00]  # excluding ASCII chars
-            all_chars = [chr(i) for i in range(256) if i not in exc_ascii]  # valid ASCII characters
-            for x in all_chars:
-                if x.upper() not in self.__natAA:
-                    self.__chars.append(x)
+        chars = self.__chars
+        if len(chars) == 0:
+            # valid ASCII characters, computed once at import
+            chars.extend(_ENCODING_CHARS)
 
-        if val not in self.__d_enc:
-            curr_pos = len(self.__d_enc)
-            if curr_pos >= len(self.__chars):
+        d_enc = self.__d_enc
+        if val not in d_enc:
+            curr_pos = len(d_enc)
+            if curr_pos >= len(chars):
                 raise Exception("There are no more letters in mapping array")
             # assign ascii symbol one by one
-            ch = self.__chars[curr_pos]
-            self.__d_enc[val] = ch
+            ch = chars[curr_pos]
+            d_enc[val] = ch
             self.__d_dec[ch] = val
-        result = self.__d_enc.get(val, '')  # if no match found, insert nothing
-        return result
+            self.__trans_table[ord(ch)] = val
+        return d_enc[val]
+
+    def __assign_symbols(self, sequences, peptide_name):
+        """
+        Assigns symbols to all non-natural AA of the sequences, in the order of appearance
+        :param sequences: list of FASTA sequences
+        :param peptide_name: The Peptide name to be processed (PEPTIDE1, PEPTIDE2,...)
+        :return: list of non-natural AA of all the sequences. For CHEM polymers, there is one per sequence
+        """
+
+        # Treat polymers of CHEM type as single monomer
+        if peptide_name.startswith("CHEM"):
+            naas = [_RE_CHEM.match(seq).group() for seq in sequences]
+        else:
+            # Tokenize the whole batch in a single scan, if it has no nested or unpaired brackets.
+            # Otherwise, sequences are parsed one by one, to report the invalid one
+            joined = "\n".join(sequences)
+            naas = _RE_NAA.findall(joined)
+            if not len(naas) == joined.count("[") == joined.count("]"):
+                naas = [s for seq in sequences for s in self.parse_naa_in_fasta(seq)]
+
+        for s in naas:
+            self.__repl(s)
+        return naas
 
     # Instance methods:
-    def encode_alignment_sequences(self, fasta_input_array, peptide_name, timestamp):
+    def encode_alignment_sequences(self, fasta_input_array, peptide_name, timestamp, work_dir=""):
         """
         Replace non-natural AA
         NOTE: this method operates with ARRAY now, not with files
         :param fasta_input_array: array of FASTA input lines
         :param peptide_name: The Peptide name to be processed (PEPTIDE1, PEPTIDE2,...)
         :param timestamp: unique ID of this task
+        :param work_dir: directory for the output file, current directory by default
         :return:
         """
 
-        output_file = os.path.join(peptide_name + "_" + str(timestamp) + "_mafft.txt")
-        with open(output_file, "w", encoding='latin-1') as ofile:
-            for name, seq in AlignUtils.read_fasta(fasta_input_array):  # calling generator f-ion
-                # translated sequence according to sub matrix
+        # Sequences are encoded before the file is opened, so no file is left if encoding fails
+        encoded_data = self.encode_alignment_sequences_to_bytes(fasta_input_array, peptide_name)
 
-                # Treat polymers of CHEM type as single monomer, encode the whole sequence
-                if peptide_name.startswith("CHEM"):
-                    monomer = re.match(r"\[.*\]", seq).group()
-                    self.__repl(monomer)
-                    seq = self.__d_enc[seq]
-                else:
-                    # findings = re.finditer(r'\[[^\]]*\]', seq)
-                    findings = self.parse_naa_in_fasta(seq)
-                    for s in findings:
-                        # find all NAA replacements
-                        self.__repl(s)
-
-                    # replace NAA in original string
-                    for key in self.__d_enc:
-                        seq = seq.replace(key, self.__d_enc[key])
-                ofile.write(name + "\n" + seq + "\n")
+        output_file = f"{peptide_name}_{timestamp}_mafft.txt"
+        if work_dir:
+            output_file = os.path.join(work_dir, output_file)
+        with open(output_file, "wb") as ofile:
+            ofile.write(encoded_data)
 
         return output_file
 
+    def build_symbol_tables(self, fasta_input_array, peptide_name):
+        """
+        Fill the encoding and decoding dictionaries with non-natural AA, without encoding the sequences.
+        For example, to decode MAFFT output of sequences, which were encoded by another instance
+        :param fasta_input_array: array of FASTA input lines
+        :param peptide_name: The Peptide name to be processed (PEPTIDE1, PEPTIDE2,...)
+        :return:
+        """
+
+        self.__assign_symbols([seq for _, seq in AlignUtils.read_fasta(fasta_input_array)], peptide_name)
+
+    def encode_alignment_sequences_to_bytes(self, fasta_input_array, peptide_name):
+        """
+        Replace non-natural AA, and keep the MAFFT input in memory instead of a file
+        :param fasta_input_array: array of FASTA input lines
+        :param peptide_name: The Peptide name to be processed (PEPTIDE1, PEPTIDE2,...)
+        :return: encoded FASTA lines as bytes in latin-1
+        """
+
+        records = list(AlignUtils.read_fasta(fasta_input_array))  # calling generator f-ion
+        names = [name for name, _ in records]
+        sequences = [seq for _, seq in records]
+
+        # find all NAA replacements, symbols are assigned in the order of appearance
+        naas = self.__assign_symbols(sequences, peptide_name)
+
+        # Treat polymers of CHEM type as single monomer, encode the whole sequence
+        if peptide_name.startswith("CHEM"):
+            sequences = [self.__d_enc[naa] for naa in naas]
+        else:
+            batch_naas = dict.fromkeys(naas)
+
+            # replace NAA of the whole batch in a single scan. Sequences contain no line breaks,
+            # so they are joined and split back by them
+            if batch_naas:
+                d_enc = self.__d_enc
+                if any("[" in naa[1:] for naa in batch_naas):
+                    # Nested monomers, like SMILES: match the batch tokens, preferring the longest one at each position
+                    naa_re = _tokens_re(tuple(sorted(batch_naas, key=lambda k: (-len(k), k))))
+                else:
+                    # Without nested monomers, the tokens are exactly the matches of the precompiled pattern
+                    naa_re = _RE_NAA
+                sequences = naa_re.sub(lambda m: d_enc[m.group()], "\n".join(sequences)).split("\n")
+
+        encoded_lines = [f"{name}\n{seq}\n" for name, seq in zip(names, sequences)]
+        return "".join(encoded_lines).encode("latin-1")
+
     def clear_symbols(self):
         """Clear private dictionaries of Unicode character codes"""
         self.__chars.clear()
         self.__d_enc.clear()
         self.__d_dec.clear()
+        self.__trans_table.clear()
 
     def decode_mafft(self, fasta_input_array):
         """
@@ -100,15 +193,13 @@ class AlignUtils:
         :return:
         """
         fasta_output_array = []
+        # str.translate accepts multi-character replacements, so each sequence is decoded in a single pass
+        trans_table = self.__trans_table
         for name, seq in AlignUtils.read_fasta(fasta_input_array):
-            translated = ""
-            for b in seq:
-                aa = self.__d_dec.get(b, b)
-                translated += aa
-            fasta_output_array.append(name + "\n" + translated + "\n")
+            fasta_output_array.append(f"{name}\n{seq.translate(trans_table)}\n")
         return fasta_output_array
 
-    def create_substitution_matrix(self, matrix_file_path, monomers_map_file_path, peptide_name, timestamp):  # noqa: C901, pylint: disable=too-many-branches, too-many-statements
+    def create_substitution_matrix(self, matrix_file_path, monomers_map_file_path, peptide_name, timestamp, work_dir=""):  # noqa: C901, pylint: disable=too-many-branches, too-many-statements
         """
         Create a custom substitution matrix
         NOTE: use this function during MAFFT calculation because it is required to provide a table of encoding for NAA
@@ -118,11 +209,14 @@ class AlignUtils:
         :param monomers_map_file_path: path to monomers map
         :param peptide_name: The Peptide name to be processed (PEPTIDE1, PEPTIDE2,...)
         :param timestamp: Unique marker for this API call
+        :param work_dir: directory for the output file, current directory by default
         :return:
         """
 
         # subst. matrix file
-        subst_matrix_file = os.path.join(peptide_name + "_" + str(timestamp) + "_matrix.txt")
+        subst_matrix_file = f"{peptide_name}_{timestamp}_matrix.txt"
+        if work_dir:
+            subst_matrix_file = os.path.join(work_dir, subst_matrix_file)
 
         # prepare list of used chars
         d_hex = {}
@@ -139,58 +233,35 @@ class AlignUtils:
         d_monomer_map = {}
         # list of non-natural AA which aren't found in Monomers Map
         not_found = []
-        with open(monomers_map_file_path) as csv_file:
-            reader = csv.reader(csv_file)
-            header_skipped = False
-            for row in reader:
-                if not header_skipped:
-                    header_skipped = True
-                    continue  # skip header
-                tokens = re.split(r'\t+', row[0])
-                if len(tokens) == 0:
-                    continue
-                # Unicode field is key
-                # array: Symbol field, position in mapping file
-                symbol_field = tokens[0]
-                unicode_field = AlignUtils.get_unicode_char(tokens[1])
-                # aa = symbol_field.upper()
-                if symbol_field in d_hex:
-                    d_monomer_map[unicode_field] = [symbol_field, -1]
-                    if len(d_hex) == len(d_monomer_map):
-                        break  # all AA found and covered
+        for symbol_field, unicode_field in AlignUtils._read_monomers_map(monomers_map_file_path):
+            # Unicode field is key
+            # array: Symbol field, position in mapping file
+            if symbol_field in d_hex:
+                d_monomer_map[unicode_field] = [symbol_field, -1]
+                if len(d_hex) == len(d_monomer_map):
+                    break  # all AA found and covered
         # print(d_monomer_map)
         if len(d_hex) != len(d_monomer_map):
+            # reverse index {symbol: Unicode character}
+            symbol_to_unicode = {item[0]: mm_key for mm_key, item in d_monomer_map.items()}
             for key in d_hex:
-                found = False
-                for mm_key in d_monomer_map:
-                    it = d_monomer_map[mm_key]
-                    if it[0] == key:
-                        found = True
-                        break
-                if not found:
+                if key not in symbol_to_unicode:
                     not_found.append(key)
                     sys.stderr.write(key + " not found in Monomer Map\n")
 
         # reads ROCS file
         # indexing list of chars. The order of symbols are the same on vertical and horizontal
-        with open(matrix_file_path, "rb") as mfp:
-            # this row contains characters which we need for mapping with monomers_map
-            # analyze the row to find coordinates
-            first_row = mfp.readline()
-            chars = first_row.split(b"\x20")
-            # index = 0 has empty character. And this is good because rows also started with 1
-            found_chars = 0
-            # numbers of rows we need for quick access
-            row_numbers = []
-            for index in range(len(chars) - 1):
-                current_char = chars[index].decode("utf-8")
-                if current_char in d_monomer_map:
-                    d_monomer_map[current_char][1] = index
-                    row_numbers.append(index)
-                    found_chars += 1
-                    if found_chars == len(d_monomer_map):
-                        break
-                # print("index=" + str(index) + "; char=" + current_char)
+        header_index, line_offsets = AlignUtils._read_matrix_index(matrix_file_path)
+        found_chars = 0
+        # numbers of rows we need for quick access
+        row_numbers = []
+        # the header is indexed by raw bytes, so only the characters of used monomers are encoded
+        for current_char, item in d_monomer_map.items():
+            index = header_index.get(current_char.encode("utf-8"))
+            if index is not None:
+                item[1] = index
+                row_numbers.append(index)
+                found_chars += 1
 
         # check if we found all rows in ROCS
         if found_chars != len(d_monomer_map):
@@ -199,49 +270,39 @@ class AlignUtils:
                 if item[1] == -1:
                     raise Exception("Can't find row with key=" + key + " in ROCS file")
 
-        # lets find rows we need. We know their numbers. Other rows ignore.
+        # lets read rows we need. We know their offsets in the file. Other rows ignore.
         row_numbers.sort()
-        last_row_number = row_numbers[len(row_numbers) - 1]
         rows_cache = {}
-        # open file again for indexation
         with open(matrix_file_path, "rb") as mfp:
-            for index, row in enumerate(mfp):
-                if index in row_numbers:
-                    arr = row.split(b"\x20")
-                    ch = arr[0].decode("utf-8")
-                    rows_cache[ch] = arr
-                    if index == last_row_number:
-                        break
+            for index in row_numbers:
+                mfp.seek(line_offsets[index])
+                # the row is decoded at once, not score by score
+                arr = mfp.readline().decode("utf-8").split("\x20")
+                rows_cache[arr[0]] = arr
 
         # prepare score matrix (char, char, score, comment)
+        # (Unicode character, symbol, hex code, column index) of every monomer, computed once for all pairs
+        mm_items = [(key, item[0], d_hex[item[0]], item[1]) for key, item in d_monomer_map.items()]
+        # parts of the rows, which depend only on the right monomer
+        right_items = [(column_index, " " + hex_right + " ", symbol_right)
+                       for _, symbol_right, hex_right, column_index in mm_items]
         score_template = []
-        for key_left in d_monomer_map:
-            symbol_left = d_monomer_map[key_left][0]
-            hex_left = d_hex[symbol_left]
+        for key_left, symbol_left, hex_left, _ in mm_items:
             if key_left not in rows_cache:
                 print("error")
             row_array = rows_cache[key_left]
-            for key_right in d_monomer_map:
-                # this index is 1-based but this is OK because the first position in a row is char
-                dkr = d_monomer_map[key_right]
-                symbol_right = dkr[0]
-                hex_right = d_hex[symbol_right]
-                column_index = dkr[1]
-                score = row_array[column_index].decode("utf-8")
-                score_template.append(str(hex_left) + " " + str(hex_right) + " " + str(
-                    score) + "   # " + symbol_left + " x " + symbol_right)
+            comment_left = "   # " + symbol_left + " x "
+            # this index is 1-based but this is OK because the first position in a row is char
+            score_template.extend([hex_left + hex_right + row_array[column_index] + comment_left + symbol_right
+                                   for column_index, hex_right, symbol_right in right_items])
 
         # add special rows for NAA which are not found in Monomer Map.
         if len(not_found) > 0:
             score_for__not_found = -10  # according to PEPSAR-59
             for naa in not_found:
                 hex_left = d_hex[naa]
-                for key_right in d_monomer_map:
-                    # this index is 1-based but this is OK because the first position in a row is char
-                    dkr = d_monomer_map[key_right]
-                    symbol_right = dkr[0]
-                    hex_right = d_hex[symbol_right]
-                    score_template.append(str(hex_left) + " " + str(hex_right) + " " + str(
+                for _, symbol_right, hex_right, _ in mm_items:
+                    score_template.append(hex_left + " " + hex_right + " " + str(
                         score_for__not_found) + "   # " + naa + " x " + symbol_right)
 
                 # Add substitutions between not found monomers
@@ -253,65 +314,148 @@ class AlignUtils:
                     if hex_left == hex_right:
                         score_for__not_found = 10
 
-                    score_template.append(str(hex_left) + " " + str(hex_right) + " " + str(
+                    score_template.append(hex_left + " " + hex_right + " " + str(
                         score_for__not_found) + "   # " + naa + " x " + naa2)
 
-        with open(subst_matrix_file, "w", encoding='utf8') as ofl:
-            for s in score_template:
-                ofl.write(s + "\n")
+        # Write all rows at once, encoding them in a single pass
+        score_template.append("")
+        with open(subst_matrix_file, "wb") as ofl:
+            ofl.write("\n".join(score_template).encode("utf8"))
 
         return subst_matrix_file
 
     # Static methods:
     @staticmethod
     def run_mafft_utility(*args, mafft_binary, matrix_file, gap_opening_penalty, gap_extension_penalty,
-                          realign, realign_method="", mafft_options="") -> (str, str):
+                          realign, realign_method="", mafft_options="", input_data=None, add_data=None) -> (str, str):
         """
-        Run MAFFT utility
-        :param args: list of input files for alignment with encoded characters
-        :param mafft_binary: Absolute path to the MAFFT binary
-        :param matrix_file: Matrix file. Use its name without path.
+        Run MAFFT utility. The call waits, while PEPSEA_MAX_MAFFT_PROCESSES MAFFT processes are running
+        :param args: list of input files for alignment with encoded characters. "-" means the standard input
+        :param mafft_binary: Absolute path to the MAFFT binary, or a sequence of the path and MAFFT arguments
+        :param matrix_file: Matrix file
         :param gap_opening_penalty: a penalty for creating a gap on any length in an aligned sequence
         :param gap_extension_penalty: a penalty for extending a gap by one monomer. See https://en.wikipedia.org/wiki/Gap_penalty.
         :param realign: specifies, whether MAFFT should align sequences, or realign
         :param realign_method: MAFFT method used for realignment
-        :param mafft_options: extra MAFFT options, copied unchanged to the MAFFT command string
+        :param mafft_options: extra MAFFT options, split into arguments like in a shell
+        :param input_data: encoded sequences as bytes, passed to MAFFT through the standard input
+        :param add_data: encoded sequences to add in realignment as bytes, passed to MAFFT through a pipe instead of
+                         the file args[1]. MAFFT opens the pipe as /dev/fd/N, which is available on Linux and macOS
         :return: MAFFT standard output and error as strings
+        :raises ValueError: if realign is True, but neither the file of new sequences, nor add_data are given
         """
 
-        head, tail = ntpath.split(matrix_file)
-        matrix_file_fn_only = tail or ntpath.basename(head)
-        matrix_part = " --textmatrix " + matrix_file_fn_only
-        gaps = " --op " + str(gap_opening_penalty) + " --ep " + str(gap_extension_penalty)
-
-        # If the shell locale is set to UTF-8, then MAFFT will not accept characters over 0x79,
-        # and reports "tr: Illegal byte sequence"
-        shell_locale_setting = "LC_CTYPE=C "
-        mafft_cmd = shell_locale_setting + mafft_binary + matrix_part + gaps + " " + mafft_options + " --text "
+        # The binary can include MAFFT arguments, e.g. "mafft --auto", as a string or as a sequence of arguments
+        mafft_cmd = shlex.split(mafft_binary) if isinstance(mafft_binary, str) else list(mafft_binary)
+        mafft_cmd += ["--textmatrix", matrix_file, "--op", str(gap_opening_penalty), "--ep", str(gap_extension_penalty)]
+        mafft_cmd += shlex.split(mafft_options)
+        mafft_cmd.append("--text")
 
+        pipe_fd = None
         if realign:
-            method = "--" + realign_method
-            mafft_cmd += " " + method + " " + args[1] + " " + args[0]
+            if add_data is None and len(args) < 2:
+                raise ValueError("Realignment needs new sequences: a file in the second argument, or add_data")
+            add_file = args[1] if len(args) > 1 else None
+            if add_data is not None:
+                # The pipe is filled in a thread, as MAFFT reads it only after the standard input
+                pipe_fd, write_fd = os.pipe()
+                add_file = f"/dev/fd/{pipe_fd}"
+                writer = threading.Thread(target=_write_to_pipe, args=(write_fd, add_data), daemon=True)
+                writer.start()
+            mafft_cmd += ["--" + realign_method, add_file, args[0]]
         else:
-            mafft_cmd += args[0]
-
-        mafft_result: CompletedProcess = run(mafft_cmd, shell=True, check=True, stdout=PIPE, stderr=PIPE)
+            mafft_cmd.append(args[0])
+
+        # MAFFT is started without a shell
+        try:
+            with _MAFFT_SEMAPHORE:
+                mafft_result: CompletedProcess = run(mafft_cmd, env=_MAFFT_ENV, check=True, input=input_data, stdout=PIPE,
+                                                     stderr=PIPE, pass_fds=() if pipe_fd is None else (pipe_fd,))
+        finally:
+            if pipe_fd is not None:
+                # If MAFFT has not read all the data, the writer is stopped by the closed pipe
+                os.close(pipe_fd)
+                writer.join()
 
         return mafft_result.stdout.decode(encoding="latin-1"), mafft_result.stderr.decode(encoding="utf-8",
                                                                                           errors="ignore")
 
     @staticmethod
+    def _read_monomers_map(monomers_map_file_path):
+        """
+        Read Monomers Map. The result is cached until the file is modified, as the same file is used for every alignment
+        :param monomers_map_file_path: path to monomers map
+        :return: tuple of (symbol, Unicode character) pairs in the order of the file
+        """
+        return AlignUtils._load_monomers_map(monomers_map_file_path, os.path.getmtime(monomers_map_file_path))
+
+    @staticmethod
+    @functools.lru_cache(maxsize=8)
+    def _load_monomers_map(monomers_map_file_path, mtime):  # pylint: disable=unused-argument
+        """
+        Read Monomers Map once per modification of the file
+        :param monomers_map_file_path: path to monomers map
+        :param mtime: modification time of the file, part of the cache key
+        :return: tuple of (symbol, Unicode character) pairs in the order of the file
+        """
+        monomers = []
+        with open(monomers_map_file_path) as csv_file:
+            # The file is tab-separated, names of monomers can contain quotes
+            reader = csv.reader(csv_file, delimiter="\t", quoting=csv.QUOTE_NONE)
+            next(reader, None)  # skip header
+            for row in reader:
+                if len(row) < 2:
+                    continue
+                monomers.append((row[0], AlignUtils.get_unicode_char(row[1])))
+        return tuple(monomers)
+
+    @staticmethod
+    def _read_matrix_index(matrix_file_path):
+        """
+        Get the index of ROCS file. The index is cached until the file is modified
+        :param matrix_file_path: path to ROCS matrix file
+        :return: dictionary {UTF-8 encoded character: index in the row}, tuple of offsets of every row in the file
+        """
+        return AlignUtils._index_matrix_file(matrix_file_path, os.path.getmtime(matrix_file_path))
+
+    @staticmethod
+    @functools.lru_cache(maxsize=8)
+    def _index_matrix_file(matrix_file_path, mtime):  # pylint: disable=unused-argument
+        """
+        Read ROCS file once. The first row contains characters of monomers in the order of rows and columns,
+        the offsets of rows allow reading only the rows needed for a substitution matrix
+        :param matrix_file_path: path to ROCS matrix file
+        :param mtime: modification time of the file, part of the cache key
+        :return: dictionary {UTF-8 encoded character: index in the row}, tuple of offsets of every row in the file
+        """
+        line_offsets = []
+        offset = 0
+        with open(matrix_file_path, "rb") as mfp:
+            first_row = mfp.readline()
+            line_offsets.append(offset)
+            offset += len(first_row)
+            for row in mfp:
+                line_offsets.append(offset)
+                offset += len(row)
+        chars = first_row.split(b"\x20")
+        # index = 0 has empty character. And this is good because rows also started with 1
+        # Characters are kept as bytes, there is no need to decode thousands of them
+        header_index = {}
+        for index, char in enumerate(chars[:-1]):
+            header_index.setdefault(char, index)
+        return header_index, tuple(line_offsets)
+
+    @staticmethod
+    # Codes have up to 4 hex digits, so the cache holds all of them. A smaller cache is missed on every row of
+    # monomer tables, which are longer than it and read in order
+    @functools.lru_cache(maxsize=65536)
     def get_unicode_char(un):
         """
         Converts string to unicode character
         :param un: string representing the unicode character
         :return:
         """
-        ln = len(un)
-        if ln < 4:
-            for _ in range(ln, 4):
-                un = "0" + un
-        return chr(int("0x" + un, 16))
+        return chr(int(un.zfill(4), 16))
 
     @staticmethod
     def read_fasta(fasta_input_array):
@@ -320,20 +464,27 @@ class AlignUtils:
         :param fasta_input_array: array of strings (FASTA lines)
         :return:
         """
+        return AlignUtils.read_fasta_lines(line for item in fasta_input_array for line in item.split("\n"))
+
+    @staticmethod
+    def read_fasta_lines(fasta_lines):
+        """
+        Read lines in FASTA format, for the callers which already have one line per item
+        :param fasta_lines: iterable of strings (FASTA lines without line breaks inside)
+        :return:
+        """
         name, seq = None, []
-        for item in fasta_input_array:
-            tokens = item.split("\n")
-            for line in tokens:
-                line = line.rstrip()
-                if len(line) == 0:
-                    continue
-                if line.startswith(">"):
-                    if name:
-                        yield name, "".join(seq)  # generator f-ion
-                    name, seq = line, []
-                else:
-                    seq.append(line)
-                    # seq.append(line.upper())  # converting seq to upper letters
+        for line in fasta_lines:
+            line = line.rstrip()
+            if not line:
+                continue
+            if line[0] == ">":
+                if name:
+                    yield name, "".join(seq)  # generator f-ion
+                name, seq = line, []
+            else:
+                seq.append(line)
+                # seq.append(line.upper())  # converting seq to upper letters
         if name:
             yield name, "".join(seq)
 
@@ -345,40 +496,44 @@ class AlignUtils:
         :param sequence: FASTA sequence
         :return: list of non-natural AAs
         """
+        # Fast path: if every bracket belongs to a flat [...] token, the tokens are found by a single C-level scan
+        naas = _RE_NAA.findall(sequence)
+        if len(naas) == sequence.count("[") == sequence.count("]"):
+            return naas
+
         naas = []
 
-        # Track the number of opened and closed brackets, in case there are nested monomers, like SMILES
-        opened = 0
-        closed = 0
+        # Only square brackets are visited in Python. Track their depth, in case of nested monomers, like SMILES
+        depth = 0
+        start = -1
 
-        naa = False
-        monomer = ""
+        for m in _RE_BRACKETS.finditer(sequence):
+            if m.group() == "[":
+                if depth == 0:
+                    start = m.start()
+                depth += 1
+            elif depth > 0:
+                depth -= 1
+                if depth == 0:
+                    naas.append(sequence[start:m.end()])
 
-        for el in sequence:
+        assert depth == 0, f"Non-valid notation of non-natural amino acids in the following sequence {sequence}"
 
-            if el == "[":
-                # If this is an opening bracket, then just increase opened variable and set naa to True
-                if opened == 0:
-                    naa = True
-                    opened += 1
-                else:
-                    opened += 1
-                    monomer += el
-
-            elif el == "]":
-                # If this is closing bracket, then append monomer to the list
-                if opened == closed + 1:
-                    naas.append("[" + monomer + "]")
-                    opened = 0
-                    closed = 0
-                    monomer = ""
-                    naa = False
-                else:
-                    monomer += el
-                    closed += 1
-            elif naa:
-                monomer += el
+        return naas
 
-        assert not naa, f"Non-valid notation of non-natural amino acids in the following sequence {sequence}"
 
-        return naas
+def _write_to_pipe(fd, data):
+    """
+    Writes data to the pipe and closes it
+    :param fd: file descriptor of the write end of the pipe
+    :param data: bytes to write
+    :return:
+    """
+    view = memoryview(data)
+    try:
+        while view:
+            view = view[os.write(fd, view):]
+    except BrokenPipeError:
+        pass
+    finally:
+        os.close(fd)
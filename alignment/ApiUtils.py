@@ -2,9 +2,26 @@
 API input/output manipulation utility functions
 """
 
-import json
+from alignment.AlignUtils import _RE_BRACKETS
+from alignment.PyHELM_simple import NotationError
 
-from alignment.PyHELM_simple import HelmObj
+# Use the fastest JSON encoder available
+try:
+    import orjson
+
+    def _dumps(obj):
+        return orjson.dumps(obj).decode("utf-8")
+except ImportError:
+    try:
+        import ujson
+
+        def _dumps(obj):
+            return ujson.dumps(obj, ensure_ascii=False, escape_forward_slashes=False)
+    except ImportError:
+        import json
+
+        def _dumps(obj):
+            return json.dumps(obj, ensure_ascii=False)
 
 
 def extract_helm_from_json(input_json):
@@ -13,12 +30,7 @@ def extract_helm_from_json(input_json):
     :param input_json: JSON array of Peptide objects
     :return: output_helm: string (extracted HELM strings separated by a newline)
     """
-    output_helm = ""
-    for peptide in input_json:
-        if len(output_helm) > 0:
-            output_helm += "\n"
-        output_helm += peptide["HELM"]
-    return output_helm
+    return "\n".join([peptide["HELM"] for peptide in input_json])
 
 
 def json_output(helm_data, json_input):
@@ -66,12 +78,11 @@ def json_output(helm_data, json_input):
 
                 # If there is a subpeptide with a given key, we can add it to the output
                 if sequence is not None:
-                    output_json = "{"
-                    output_json += '"PolymerID":"' + key + '", '
-                    output_json += '"AlignedSubpeptide":"' + sequence + '", '
-                    output_json += '"HELM":"' + entity['HELM'] + '", '
-                    output_json += '"ID":"' + entity["ID"] + '", '
-                    output_json += '"AlignedSeq":"' + peptides[index] + '", '
+                    record = {"PolymerID": key,
+                              "AlignedSubpeptide": sequence,
+                              "HELM": entity['HELM'],
+                              "ID": entity["ID"],
+                              "AlignedSeq": peptides[index]}
 
                     """
                     The following cycle iterates over the aligned subsequence, and the the help of the "extract_monomer"
@@ -81,40 +92,60 @@ def json_output(helm_data, json_input):
 
                     """
                     if key.startswith("CHEM"):
-                        output_json += f'"{key}_1":"' + sequence[1:-1] + '"' + ", "
+                        record[f"{key}_1"] = sequence[1:-1]
                     else:
-                        for ind, el in enumerate(extract_monomer(peptides[index])):
-                            output_json += f'"{key}_{ind + 1}":"' + el + '"' + ", "
-                    output_json = output_json[:-2]
-                    output_json += "}"
+                        for ind, el in enumerate(extract_monomer(peptides[index]), start=1):
+                            record[f"{key}_{ind}"] = el
                     index += 1
 
-                    json_list.append(json.loads(output_json))
+                    json_list.append(record)
 
     return json_list
 
 
+def dump_json(output):
+    """Serializes the API output to a JSON string, with orjson or ujson, if installed.
+    Double quotes in HELM strings are escaped by the encoder.
+
+    :param output: dictionary or list of the API output
+    :return: string, JSON document
+    """
+    return _dumps(output)
+
+
 def extract_subpeptide(peptide_name, helm_string):
     """Extracts the sub-peptide sequence, given the HELM string and the name of the sub-peptide.
+    If there are several sub-peptides with the same name, the first one is used.
 
     :param peptide_name:
     :param helm_string:
     :return:
+    :raises NotationError: if the sections of HELM or the brackets of the sub-peptide are missing
     """
-    helm_obj = HelmObj()
-    helm_obj.parse_helm(helm_string)
-
-    # The following cycle goes through all the subpeptides of the HELM sequence.
-    # If the name of the subpeptide equals the peptide_name, the function returns sequence of the subpeptide
-    for poly in helm_obj.polymers:
-        if poly.name == peptide_name:
-            return poly.data
-    return None
+    # Only the first section of HELM with polymers is searched, where every polymer starts the string or follows "|"
+    end = helm_string.find("$")
+    if end < 0:
+        raise NotationError('Invalid HELM notation')
+
+    key = peptide_name + "{"
+    index = helm_string.find(key, 0, end)
+    while index > 0 and helm_string[index - 1] != "|":
+        index = helm_string.find(key, index + 1, end)
+    if index < 0:
+        return None
+
+    # The sequence is enclosed in curly brackets, up to the next polymer
+    stop = helm_string.find("|", index, end)
+    if stop < 0:
+        stop = end
+    if helm_string[stop - 1] != "}":
+        raise NotationError('Invalid HELM notation')
+    return helm_string[index + len(key):stop - 1]
 
 
 def extract_monomer(aligned_sequence):
     """
-    Generator function. Yields the monomers of the aligned sequence. Every symbol is accounted for monomer,
+    Returns the list of monomers of the aligned sequence. Every symbol is accounted for monomer,
     unless they are not in square brackets. Otherwise, symbols in square brackets are precessed as single monomer.
 
     Currently works with sequences, where monomers are not separated with dots, e.g.
@@ -124,41 +155,31 @@ def extract_monomer(aligned_sequence):
     :param aligned_sequence:
     :return:
     """
-    non_natural = False
-    monomer = ''
-
-    # These variables track the number of opened and and closed square brackets.
-    # This is needed for correct parsing of sequences, which have SMILES as monomers
-    opened = 0
-    closed = 0
-
-    for el in aligned_sequence:
-        if monomer != "" and not non_natural:
-            monomer = ""
-
-        if el == "[" and opened == 0:
-            non_natural = True
-            opened += 1
-        elif el == "[":
-            opened += 1
-            monomer += el
-        elif not non_natural:
-            yield el
-
-        # Yield the monomer, only if the current symbol is closing bracket,
-        # and number of opened brackets is exactly one more than the number of closed ones
-        elif el == "]" and opened == closed + 1:
-            non_natural = False
-            opened = 0
-            closed = 0
-            yield monomer
-        elif el == "]":
-            monomer += el
-            closed += 1
-        else:
-            monomer += el
-
-    assert not non_natural, f"Non-valid notation of non-natural amino acids in the following sequence {aligned_sequence}"
+    # Only square brackets are visited by Python, the symbols between them are sliced at once.
+    # The depth of brackets is tracked for correct parsing of sequences, which have SMILES as monomers
+    monomers = []
+    depth = 0
+    start = 0
+    position = 0
+
+    for m in _RE_BRACKETS.finditer(aligned_sequence):
+        index = m.start()
+        if m.group() == "[":
+            if depth == 0:
+                monomers.extend(aligned_sequence[position:index])
+                start = index + 1
+            depth += 1
+        elif depth > 0:
+            depth -= 1
+            # Add the monomer, only if the closing bracket matches the first opened one
+            if depth == 0:
+                monomers.append(aligned_sequence[start:index])
+                position = index + 1
+
+    assert depth == 0, f"Non-valid notation of non-natural amino acids in the following sequence {aligned_sequence}"
+
+    monomers.extend(aligned_sequence[position:])
+    return monomers
 
 
 def extract_aligned_sequences(aligned_array):
@@ -169,38 +190,6 @@ def extract_aligned_sequences(aligned_array):
     :return: string, aligned sequences in FASTA format
     """
 
-    aligned_seqs = ''
-
-    for element in aligned_array:
-        if len(aligned_seqs) > 0:
-            aligned_seqs += '\n'
-        aligned_seqs += f"> {element['PolymerID']}\n"
-        aligned_seqs += element['AlignedSeq']
-
-    return aligned_seqs
-
-
-def escape_double_quotes_in_input(input_data):
-    """ Adds escape character in front of double quotes in HELM string
-
-    :param input_data: JSON array of input data
-    :return: JSON array
-    """
-
-    if "aligned_sequences" and "new_sequences" in input_data:
-
-        for ind, element in enumerate(input_data["aligned_sequences"]):
-            helm = element["HELM"].replace('"', '\\"')
-            input_data["aligned_sequences"][ind]["HELM"] = helm
-
-        for ind, element in enumerate(input_data["new_sequences"]):
-            helm = element["HELM"].replace('"', '\\"')
-            input_data["new_sequences"][ind]["HELM"] = helm
-
-    else:
-
-        for ind, element in enumerate(input_data):
-            helm = element["HELM"].replace('"', '\\"')
-            input_data[ind]["HELM"] = helm
+    aligned_seqs = [f"> {element['PolymerID']}\n{element['AlignedSeq']}" for element in aligned_array]
 
-    return input_data
+    return "\n".join(aligned_seqs)
@@ -4,8 +4,108 @@ PyHELM - A class for working with HELM
 Copyright 2014, quattro research GmbH
 """
 
+import functools
 import re
 
+# Patterns for HELM polymers and connections, compiled once. Sections and polymers are split with str.split()
+_RE_POLY_HEAD = re.compile(r'\w+(?=\{)')
+_RE_POLY_TYPE = re.compile(r'\D+')
+_RE_CONN_SEP = re.compile(r'[,:-]')
+_RE_POLY_COMMA = re.compile(r'\w+(?=[\{,])')
+
+
+@functools.lru_cache(maxsize=8192)
+def _split_helm(helm):
+    """Split HELM string into sections and polymers. The result is cached, as the same HELM is split by several methods,
+    so the string is scanned once for validation, polymers and connections
+
+    :param helm: HELM string
+    :return: tuple of sections, tuple of polymers of the first section
+    """
+    sections = tuple(helm.split('$'))
+    return sections, tuple(sections[0].split('|'))
+
+
+@functools.lru_cache(maxsize=8192)
+def _split_and_validate(helm):
+    """Split input HELM string into sections and polymers, or return None if it is not valid.
+    The result is cached, so validate_helm() followed by parse_helm() of the same HELM validates it once
+    """
+    # #check $ signs
+    split = _split_helm(helm)
+    sections = split[0]
+    if len(sections) != 5:
+        return None
+
+    # #check polymer connections
+    first_set = set(_RE_POLY_HEAD.findall(sections[0]))  # all polymers from first element
+    second_list = _RE_POLY_COMMA.findall(sections[1])   # all polymers from second element
+    for element in second_list:
+        if element not in first_set:
+            return None
+    return split
+
+
+@functools.lru_cache(maxsize=8192)
+def _parse_helm(helm):
+    """Parse HELM string into the fields of polymers and connections. The result is cached, as the same HELM
+    is often parsed several times, e.g. for every sub-peptide
+
+    :param helm: HELM string
+    :return: tuple of (type, data, name) of polymers, tuple of (polymer name, polymer name, start, stop)
+             of connections, or None if HELM is not valid
+    """
+    split = _split_and_validate(helm)
+    if split is None:
+        return None
+
+    sections, poly_strings = split
+    poly_fields = []
+    for p in poly_strings:
+        # name is followed by the first curly bracket, and data ends with the closing one
+        p_name, sep, p_data = p.partition('{')
+        if not sep or not p_data.endswith('}'):
+            return None
+        p_type = _RE_POLY_TYPE.match(p_name).group()
+        p_data = p_data[:-1]
+        poly_fields.append((p_type, p_data, p_name))
+
+    conn_fields = []
+    if sections[1] != '':
+        for c in sections[1].split('|'):
+            items = _RE_CONN_SEP.split(c)
+            start = (int(items[2]), items[3])
+            stop = (int(items[4]), items[5])
+            conn_fields.append((items[0], items[1], start, stop))
+
+    return tuple(poly_fields), tuple(conn_fields)
+
+
+def _polymer_data(helm, polymer_name):
+    """Find the data of the polymer chain in HELM string
+
+    :param helm: HELM string
+    :param polymer_name: name of the polymer chain
+    :return: string of dot-separated monomers, or None if there is no such polymer
+    """
+    _, polymers = _split_helm(helm)
+    for p in polymers:
+        if p.find(polymer_name) >= 0:
+            # remove name and curly brackets
+            return p[len(polymer_name) + 1:len(p) - 1]
+    return None
+
+
+@functools.lru_cache(maxsize=8192)
+def _distinct_monomers(helm, polymer_name):
+    """Unique monomers of a polymer chain. The result is cached and immutable, so it is safely shared by the callers
+
+    :param helm: HELM string
+    :param polymer_name: name of the polymer chain
+    :return: frozenset of monomers
+    """
+    return frozenset(_polymer_data(helm, polymer_name).split("."))
+
 
 class NotationError (Exception):
     """Custom exception for invalid HELM"""
@@ -15,6 +115,8 @@ class NotationError (Exception):
 # noinspection PyShadowingBuiltins
 class Polymer:
     """Class representing a polymer chain"""
+    __slots__ = ("type", "data", "name")
+
     def __init__(self, type, data='', name=''):
         self.type = type
         self.data = data
@@ -27,6 +129,8 @@ class Connection:
 
     Example: (Polymer1,Polymer2),(20,'R2'),(3,'R1') or (Polymer1,Polymer2),(10,'pair'),(3,'pair')
     """
+    __slots__ = ("polymers", "start", "stop")
+
     def __init__(self, poly, start, stop):
         self.polymers = poly
         self.start = start
@@ -72,18 +176,7 @@ class HelmObj:
     # noinspection PyPep8Naming,PyMethodMayBeStatic
     def validate_helm(self, helm):  # pylint: disable=no-self-use
         """Validate input HELM string"""
-        # #check $ signs
-        sections = re.split(r'\$', helm)
-        if len(sections) != 5:
-            return False
-
-        # #check polymer connections
-        first_list = re.findall(r'\w+(?=\{)', sections[0])  # all polymers from first element
-        second_list = re.findall(r'\w+(?=[\{,])', sections[1])   # all polymers from second element
-        for element in second_list:
-            if element not in first_list:
-                return False
-        return True
+        return _split_and_validate(helm) is not None
 
     # noinspection PyPep8Naming,PyShadowingNames
     def parse_helm(self, helm):
@@ -93,59 +186,42 @@ class HelmObj:
         del self.connections[:]
         del self.attributes[:]
 
-        if not self.validate_helm(helm):
+        parsed = _parse_helm(helm)
+        if parsed is None:
             raise NotationError('Invalid HELM notation')
 
-        sections = re.split(r'\$', helm)
-        poly_section = sections[0]
-        poly_strings = re.split(r'\|', poly_section)
-        for p in poly_strings:
-            p_name = re.match(r'\w+(?=\{)', p).group()
-            p_type = re.match(r'\D+', p_name).group()
-            p_data = p[len(p_name) + 1:len(p) - 1]
-            self.polymers.append(Polymer(p_type, p_data, p_name))
-
-        if sections[1] != '':
-            conn_section = sections[1]
-            conn_strings = re.split(r'\|', conn_section)
-            for c in conn_strings:
-                items = re.split(r'[,:-]', c)
-                polys = [poly for poly in self.polymers if poly.name == items[0]]
-                polys.extend([poly for poly in self.polymers if poly.name == items[1]])
-                start = (int(items[2]), items[3])
-                stop = (int(items[4]), items[5])
-                self.connections.append(Connection(polys, start, stop))
+        # The objects are created for every call, so the parsed HELM can be modified by the caller
+        poly_fields, conn_fields = parsed
+        self.polymers.extend([Polymer(p_type, p_data, p_name) for p_type, p_data, p_name in poly_fields])
+        for name_1, name_2, start, stop in conn_fields:
+            polys = [poly for poly in self.polymers if poly.name == name_1]
+            polys.extend([poly for poly in self.polymers if poly.name == name_2])
+            self.connections.append(Connection(polys, start, stop))
 
     # noinspection PyPep8Naming,PyMethodMayBeStatic
     def get_polymer_names_from_helm(self, helm):  # pylint: disable=no-self-use
         """Get Polymer chain names from a HELM string"""
-        sections = re.split(r'\$', helm)
-        return re.findall(r'\w+(?=\{)', sections[0])
+        sections, _ = _split_helm(helm)
+        return _RE_POLY_HEAD.findall(sections[0])
 
     # noinspection PyPep8Naming,PyMethodMayBeStatic
     def get_polymers_from_helm(self, helm):  # pylint: disable=no-self-use
         """Get Polymer chain name and sequence from a HELM string"""
-        sections = re.split(r'\$', helm)
-        poly_section = sections[0]
-        return re.split(r'\|', poly_section)
+        _, polymers = _split_helm(helm)
+        return list(polymers)
 
     # noinspection PyPep8Naming,PyMethodMayBeStatic
     def get_monomers_from_polymer(self, helm, polymer_name):  # pylint: disable=no-self-use,inconsistent-return-statements
         """Get all monomers from a Polymer chain - the sequence"""
-        sections = re.split(r'\$', helm)
-        poly_section = sections[0]
-        polymers = re.split(r'\|', poly_section)
-        for p in polymers:
-            if p.find(polymer_name) >= 0:
-                # remove name and curly brackets
-                mono_str = p[len(polymer_name) + 1:len(p) - 1]
-                return re.split(r'\.', mono_str)
-
-    # noinspection PyPep8Naming
-    def get_distinct_monomers_from_polymer(self, helm, polymer_name):
-        """Return a set of unique monomers in a polymer chain"""
-        all_monomers = self.get_monomers_from_polymer(helm, polymer_name)
-        return set(all_monomers)
+        mono_str = _polymer_data(helm, polymer_name)
+        if mono_str is not None:
+            # monomers never contain dots, so no pattern is needed
+            return mono_str.split(".")
+
+    # noinspection PyPep8Naming,PyMethodMayBeStatic
+    def get_distinct_monomers_from_polymer(self, helm, polymer_name):  # pylint: disable=no-self-use
+        """Return a frozen set of unique monomers in a polymer chain"""
+        return _distinct_monomers(helm, polymer_name)
 
 
 if __name__ == '__main__':
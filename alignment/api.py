@@ -3,21 +3,26 @@ Main API module - FastAPI endpoints
 """
 # pylint: disable=line-too-long
 
+import asyncio
+import functools
 import os
+import shlex
+import shutil
 import subprocess
-from typing import List, Optional
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
 
 from fastapi import FastAPI, Query
-from fastapi.encoders import jsonable_encoder
-from fastapi.responses import RedirectResponse, PlainTextResponse, JSONResponse
+from fastapi.responses import RedirectResponse, PlainTextResponse, JSONResponse, Response, FileResponse
 from fastapi.middleware.httpsredirect import HTTPSRedirectMiddleware
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
+from typing_extensions import Annotated
 
 from alignment.AlignSubPeptides import align_sub_peptides
-from alignment.ApiUtils import extract_helm_from_json, json_output, extract_aligned_sequences, \
-    escape_double_quotes_in_input
+from alignment.ApiUtils import extract_helm_from_json, json_output, extract_aligned_sequences, dump_json
 from alignment.models import Peptide, MafftMethods, ApiStatus, MafftVersion, RealignInput, \
-    RealignMethods
+    RealignMethods, PolymerID
 
 
 # Environment variables
@@ -26,6 +31,42 @@ monomers_map_file = os.getenv("MONOMERS_MAP_FILE", "alignment/monomers_map.txt")
 mafft_dir = os.getenv("MAFFT_DIR", "alignment/mafft/bin/")
 mafft_man_file = os.getenv("MAFFT_MAN_FILE", "alignment/mafft_manpage.txt")
 add_https_middleware = os.getenv("ADD_HTTPS_MIDDLEWARE", True)
+# Number of MAFFT threads per run. It should be chosen, so that the number of workers x threads is about the number of cores
+mafft_threads = os.getenv("MAFFT_THREADS")
+
+
+def _resolve_mafft_argv(method):
+    """Resolves the MAFFT program of the method, like "ginsi" or "mafft --auto", to the absolute path in MAFFT_DIR.
+
+    :param method: MAFFT method with optional arguments
+    :return: tuple of MAFFT arguments, starting with the absolute path to the program
+    """
+    program, *arguments = shlex.split(method)
+    path = shutil.which(program, path=mafft_dir) or os.path.join(mafft_dir, program)
+    return (os.path.abspath(path), *arguments)
+
+
+# MAFFT arguments of all methods are prepared once, so they don't need to be joined and split for every request
+mafft_argv = {m.value: _resolve_mafft_argv(m.value) for m in MafftMethods}
+
+
+def _add_mafft_threads(mafft_options):
+    """Adds "--thread MAFFT_THREADS" to MAFFT options, if the variable is set and the options don't set the threads.
+
+    :param mafft_options: extra MAFFT options of the request
+    :return: MAFFT options
+    """
+    if mafft_threads and "--thread" not in shlex.split(mafft_options):
+        return f"--thread {shlex.quote(mafft_threads)} {mafft_options}"
+    return mafft_options
+
+
+# Executor for the blocking alignment calls, so the event loop can serve other requests meanwhile.
+# Its threads mostly wait for MAFFT, the number of MAFFT processes is limited by PEPSEA_MAX_MAFFT_PROCESSES
+executor = ThreadPoolExecutor()
+
+# Outputs of "mafft --version" and "mafft --help"
+mafft_output_cache = {}
 
 # OpenAPI tags
 tags_metadata = [{"name": "alignment", "description": "Multiple sequence alignment."}]
@@ -62,6 +103,9 @@ api.add_middleware(
     allow_headers=["*"],
 )
 
+# Add GZip middleware, as the alignment output with a field per monomer is highly repetitive and compresses well
+api.add_middleware(GZipMiddleware, minimum_size=1024)
+
 
 # API Base URL: Redirect to Swagger documentation page
 @api.get('/', include_in_schema=False)
@@ -72,22 +116,24 @@ def index():
 
 
 @api.post('/align', tags=["alignment"], summary="Multiple sequence alignment.")
-def align_sequences(peptides: List[Peptide],
-                    method: MafftMethods = Query(default=MafftMethods.ginsi,
-                                                 title="MAFFT alignment method",
-                                                 description='''MAFFT alignment method used.<br>
-                                                             See "/man" endpoint or MAFFT manual for more information.'''),
-                    gap_open: float = Query(..., title="Gap opening penalty.",
-                                            description="Penalty to open a gap of any length used in the global alignment.<br>"
-                                                        "MAFFT default value: 1.53"),
-                    gap_extend: float = Query(..., title="Gap extension penalty.",
-                                              description="Penalty to extend an existing gap in the global alignment.<br>"
-                                                          "MAFFT default value: 0.0"),
-                    polymer_id: Optional[str] = Query(None, title="Polymer selected for alignment.",  # pylint: disable=unsubscriptable-object
-                                                      description='Specify which chain will be used for alignment, example: "**PEPTIDE1**".'
-                                                                  '<br>Default is **None** (All peptide chains found will be aligned).'),
-                    mafft_options: str = Query(default="", title="Additional MAFFT arguments.",
-                                               description="Extra arguments that can be passed to the MAFFT command line")):
+async def align_sequences(peptides: List[Peptide],
+                          method: MafftMethods = Query(default=MafftMethods.ginsi,
+                                                       title="MAFFT alignment method",
+                                                       description='''MAFFT alignment method used.<br>
+                                                                   See "/man" endpoint or MAFFT manual for more information.'''),
+                          gap_open: float = Query(..., title="Gap opening penalty.",
+                                                  description="Penalty to open a gap of any length used in the global alignment.<br>"
+                                                              "MAFFT default value: 1.53"),
+                          gap_extend: float = Query(..., title="Gap extension penalty.",
+                                                    description="Penalty to extend an existing gap in the global alignment.<br>"
+                                                                "MAFFT default value: 0.0"),
+                          polymer_id: Annotated[PolymerID, Query(title="Polymer selected for alignment.",
+                                                                 description='Specify which chain will be used for alignment, example: "**PEPTIDE1**".'
+                                                                             '<br>Default is **None** (All peptide chains found will be aligned).')] = None,
+                          mafft_options: str = Query(default="", title="Additional MAFFT arguments.",
+                                                     description="Extra arguments that can be passed to the MAFFT command line"),
+                          score: bool = Query(default=True, title="Compute sum-of-pairs score.",
+                                              description="If false, the score is not computed and AlignmentScore is omitted")):
     """Align HELM sequences of peptides with non-natural amino acids.
 
     \f
@@ -99,6 +145,7 @@ def align_sequences(peptides: List[Peptide],
     :param gap_extend: Gap extension penalty.
     :param polymer_id: What polymer will be used for alignment, Example: PEPTIDE1.
     :param mafft_options: Extra MAFFT arguments.
+    :param score: Whether to compute the alignment score.
     :return:
 
     Input example for body:
@@ -162,60 +209,64 @@ def align_sequences(peptides: List[Peptide],
       POLYMERID_i         Aligned monomer at position i
 
     AlignmentScore:
-      Score of alignment normalized by the number of sequences and alignment's length
+      Score of alignment normalized by the number of sequences and alignment's length. Omitted, if score is false
     """
 
     # Select which MAFFT alignment method to use (default is: "ginsi")
-    mafft_binary = mafft_dir + method
+    mafft_binary = mafft_argv[method]
 
-    # This is necessary because input is of type Pydantic BaseModel object, which can be converted to dict
-    # https://fastapi.tiangolo.com/tutorial/encoder/
-    peptides_encoded = escape_double_quotes_in_input(jsonable_encoder(peptides))
+    # This is necessary because input is of type Pydantic BaseModel object, which can be converted to dict.
+    # The models are already validated and contain only strings, so model_dump() is enough instead of jsonable_encoder()
+    # The output is built from dictionaries, so double quotes in HELM don't need to be escaped
+    peptides_encoded = [peptide.model_dump() for peptide in peptides]
     helm_input = extract_helm_from_json(peptides_encoded)
 
-    if polymer_id:
-        polymer_id = polymer_id.upper()
-
-    align_output, _, alignment_score = align_sub_peptides(helm_input,
-                                                          gap_opening_penalty=gap_open,
-                                                          gap_extension_penalty=gap_extend,
-                                                          polymer_to_align=polymer_id,
-                                                          mafft_options=mafft_options,
-                                                          path_to_mafft=mafft_binary,
-                                                          path_to_subst_matrix=rocs_path,
-                                                          path_to_monomer_table=monomers_map_file)
+    align_call = functools.partial(align_sub_peptides, helm_input,
+                                   gap_opening_penalty=gap_open,
+                                   gap_extension_penalty=gap_extend,
+                                   polymer_to_align=polymer_id,
+                                   mafft_options=_add_mafft_threads(mafft_options),
+                                   path_to_mafft=mafft_binary,
+                                   path_to_subst_matrix=rocs_path,
+                                   path_to_monomer_table=monomers_map_file,
+                                   compute_scores=score)
+    align_output, _, alignment_score = await asyncio.get_running_loop().run_in_executor(executor, align_call)
     if align_output is None:
         message = {"Message": f"Alignment failure. "
                               f"There are no sub-peptides with ID: {polymer_id} in the given input data."}
         return JSONResponse(status_code=460, content=message)
 
-    output = json_output(align_output, peptides_encoded)
+    output = await asyncio.get_running_loop().run_in_executor(executor, json_output, align_output, peptides_encoded)
 
-    return {"Alignment": output, "AlignmentScore": alignment_score}
+    # Serialize the whole output at once with the fastest JSON encoder available
+    response = {"Alignment": output, "AlignmentScore": alignment_score} if score else {"Alignment": output}
+    return Response(content=dump_json(response), media_type="application/json")
 
 
 @api.post('/realign', tags=["alignment"], summary="Multiple sequence realignment.")
-def realign_sequences(input_json: RealignInput,
-                      method: MafftMethods = Query(default=MafftMethods.ginsi,
-                                                   title="MAFFT alignment method",
-                                                   description='''MAFFT alignment method used.<br>
-                                                               See "/man" endpoint or MAFFT manual for more information.'''),
-                      realign_method: RealignMethods = Query(default=RealignMethods.add,
-                                                             title="MAFFT realignment method",
-                                                             description="Method for adding new sequences into existing alignment"),
-                      gap_open: float = Query(..., title="Gap opening penalty.",
-                                              description="Penalty to open a gap of any length used in the global alignment.<br>"
-                                                          "MAFFT default value: 1.53"),
-                      gap_extend: float = Query(..., title="Gap extension penalty.",
-                                                description="Penalty to extend an existing gap in the global alignment.<br>"
-                                                            "MAFFT default value: 0.0"),
-                      polymer_id: Optional[str] = Query(None, title="Polymer selected for alignment.",  # pylint: disable=unsubscriptable-object
-                                                        description='Specify which chain will be used for alignment,'
-                                                                    'example: "**PEPTIDE1**".'
-                                                                    '<br>Default is **None** (All peptide chains found will be aligned).'),
-                      mafft_options: str = Query(default="", title="Additional MAFFT arguments.",
-                                                 description="Extra arguments that can be passed to the MAFFT command line")
-                      ):
+async def realign_sequences(input_json: RealignInput,
+                            method: MafftMethods = Query(default=MafftMethods.ginsi,
+                                                         title="MAFFT alignment method",
+                                                         description='''MAFFT alignment method used.<br>
+                                                                     See "/man" endpoint or MAFFT manual for more information.'''),
+                            realign_method: RealignMethods = Query(default=RealignMethods.add,
+                                                                   title="MAFFT realignment method",
+                                                                   description="Method for adding new sequences into existing alignment"),
+                            gap_open: float = Query(..., title="Gap opening penalty.",
+                                                    description="Penalty to open a gap of any length used in the global alignment.<br>"
+                                                                "MAFFT default value: 1.53"),
+                            gap_extend: float = Query(..., title="Gap extension penalty.",
+                                                      description="Penalty to extend an existing gap in the global alignment.<br>"
+                                                                  "MAFFT default value: 0.0"),
+                            polymer_id: Annotated[PolymerID, Query(title="Polymer selected for alignment.",
+                                                                   description='Specify which chain will be used for alignment,'
+                                                                               'example: "**PEPTIDE1**".'
+                                                                               '<br>Default is **None** (All peptide chains found will be aligned).')] = None,
+                            mafft_options: str = Query(default="", title="Additional MAFFT arguments.",
+                                                       description="Extra arguments that can be passed to the MAFFT command line"),
+                            score: bool = Query(default=True, title="Compute sum-of-pairs score.",
+                                                description="If false, the score is not computed and AlignmentScore is omitted")
+                            ):
     """
     Realign HELM sequences of peptides with non-natural amino acids.
 
@@ -229,6 +280,7 @@ def realign_sequences(input_json: RealignInput,
     :param gap_extend: Gap extension penalty.
     :param polymer_id: What polymer will be used for alignment, Example: PEPTIDE1.
     :param mafft_options: Extra MAFFT arguments.
+    :param score: Whether to compute the alignment score.
     :return:
 
     Input example for body:
@@ -277,12 +329,9 @@ def realign_sequences(input_json: RealignInput,
     """
 
     # Select which MAFFT alignment method to use (default is: "ginsi")
-    mafft_binary = mafft_dir + method
-
-    if polymer_id:
-        polymer_id = polymer_id.upper()
+    mafft_binary = mafft_argv[method]
 
-    decoded_input = escape_double_quotes_in_input(jsonable_encoder(input_json))
+    decoded_input = input_json.model_dump()
 
     # Extract aligned sequences from JSON
     aligned_sequences = extract_aligned_sequences(decoded_input['aligned_sequences'])
@@ -290,16 +339,18 @@ def realign_sequences(input_json: RealignInput,
     # Extract new sequences
     new_helm_sequences = extract_helm_from_json(decoded_input['new_sequences'])
 
-    realign_output, _, realign_score = align_sub_peptides(aligned_sequences,
-                                                          new_helm_sequences,
-                                                          gap_opening_penalty=gap_open,
-                                                          gap_extension_penalty=gap_extend,
-                                                          polymer_to_align=polymer_id,
-                                                          path_to_mafft=mafft_binary,
-                                                          path_to_subst_matrix=rocs_path,
-                                                          path_to_monomer_table=monomers_map_file,
-                                                          mafft_options=mafft_options,
-                                                          realign_method=realign_method)
+    realign_call = functools.partial(align_sub_peptides, aligned_sequences,
+                                     new_helm_sequences,
+                                     gap_opening_penalty=gap_open,
+                                     gap_extension_penalty=gap_extend,
+                                     polymer_to_align=polymer_id,
+                                     path_to_mafft=mafft_binary,
+                                     path_to_subst_matrix=rocs_path,
+                                     path_to_monomer_table=monomers_map_file,
+                                     mafft_options=_add_mafft_threads(mafft_options),
+                                     realign_method=realign_method,
+                                     compute_scores=score)
+    realign_output, _, realign_score = await asyncio.get_running_loop().run_in_executor(executor, realign_call)
 
     if realign_output is None:
         message = {"Message": f"Alignment failure. "
@@ -308,17 +359,18 @@ def realign_sequences(input_json: RealignInput,
 
     full_input_list = [*decoded_input['aligned_sequences'], *decoded_input['new_sequences']]
 
-    output = json_output(realign_output, full_input_list)
+    output = await asyncio.get_running_loop().run_in_executor(executor, json_output, realign_output, full_input_list)
 
-    return {"Alignment": output, "AlignmentScore": realign_score}
+    # Serialize the whole output at once with the fastest JSON encoder available
+    response = {"Alignment": output, "AlignmentScore": realign_score} if score else {"Alignment": output}
+    return Response(content=dump_json(response), media_type="application/json")
 
 
 @api.get('/version', response_model=MafftVersion, tags=["alignment"])
-def mafft_version():
+async def mafft_version():
     """Print MAFFT version and exit."""
-    result = subprocess.run([f'{mafft_dir + "mafft"}', '--version'], check=True, stdout=subprocess.PIPE,
-                            stderr=subprocess.STDOUT)
-    return {'MAFFT_version': result.stdout.decode().rstrip()}
+    version = await _mafft_output('--version', expect_success=True)
+    return {'MAFFT_version': version.rstrip()}
 
 
 @api.get('/status', response_model=ApiStatus, tags=["alignment"])
@@ -331,19 +383,28 @@ def api_status():
 def mafft_manual():
     """Returns the whole MAFFT manual page as a plain text."""
 
-    mafft_manual_output = ''
-
-    with open(mafft_man_file, 'r', encoding="utf-8") as f:
-        for line in f.readlines():
-            mafft_manual_output += line
-
-    return mafft_manual_output
+    # The file is sent as it is, clients can cache it as it changes only with MAFFT installation
+    return FileResponse(mafft_man_file, media_type='text/plain',
+                        headers={'Cache-Control': 'public, max-age=3600'})
 
 
 @api.get('/help', response_class=PlainTextResponse, tags=["alignment"])
-def mafft_help():
+async def mafft_help():
     """Returns the output of "mafft --help" command as a plain text."""
 
-    mafft_help_output = subprocess.run(f'! {mafft_dir + "mafft"} --help', shell=True, check=True,
-                                       stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-    return mafft_help_output.stdout.decode()
+    # "mafft --help" exits with a non-zero status, so its success is an error
+    return await _mafft_output('--help', expect_success=False)
+
+
+async def _mafft_output(argument, expect_success):
+    """Runs MAFFT with a single argument, like "--version", and returns its output.
+    The output doesn't change while the API is running, so MAFFT is run only once for every argument."""
+
+    if argument not in mafft_output_cache:
+        mafft_cmd = [*mafft_argv[MafftMethods.mafft], argument]
+        process = await asyncio.create_subprocess_exec(*mafft_cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        stdout, _ = await process.communicate()
+        if (process.returncode == 0) != expect_success:
+            raise subprocess.CalledProcessError(process.returncode, mafft_cmd, output=stdout)
+        mafft_output_cache[argument] = stdout.decode()
+    return mafft_output_cache[argument]
@@ -3,8 +3,18 @@ API input/output models defined using Pydantic package
 """
 
 from enum import Enum
-from typing import List
-from pydantic import BaseModel
+from typing import List, Optional
+from pydantic import AfterValidator, BaseModel, ConfigDict
+from typing_extensions import Annotated
+
+
+def _upper(value):
+    """Returns upper case string, or the value itself if it is empty or None"""
+    return value.upper() if value else value
+
+
+# Polymer ID query parameter, e.g. "peptide1" is normalized to "PEPTIDE1" during validation
+PolymerID = Annotated[Optional[str], AfterValidator(_upper)]  # pylint: disable=unsubscriptable-object
 
 
 # Models to be used in the API
@@ -14,13 +24,12 @@ class Peptide(BaseModel):
     ID: str
     HELM: str
 
-    class Config:
-        schema_extra = {
-            "example": {
-                "ID": "L-000000001",
-                "HELM": "PEPTIDE1{[ClAc].F.R.Y.L.Y.[Ahp].F.C.G.K.K.[NH2]}$PEPTIDE1,PEPTIDE1,1:R1-9:R3$$$V2.0"
-            }
+    model_config = ConfigDict(json_schema_extra={
+        "example": {
+            "ID": "L-000000001",
+            "HELM": "PEPTIDE1{[ClAc].F.R.Y.L.Y.[Ahp].F.C.G.K.K.[NH2]}$PEPTIDE1,PEPTIDE1,1:R1-9:R3$$$V2.0"
         }
+    })
 
 
 # Peptide model - API output base
@@ -36,16 +45,14 @@ class AlignedPeptide(BaseModel):
 class ApiStatus(BaseModel):
     Status: str
 
-    class Config:
-        schema_extra = {"example": {"Status": "OK"}}
+    model_config = ConfigDict(json_schema_extra={"example": {"Status": "OK"}})
 
 
 # MAFFT version endpoint "/version" response model
 class MafftVersion(BaseModel):
     MAFFT_version: str
 
-    class Config:
-        schema_extra = {"example": {"MAFFT_version": "v7.471 (2020/Jul/3)"}}
+    model_config = ConfigDict(json_schema_extra={"example": {"MAFFT_version": "v7.471 (2020/Jul/3)"}})
 
 
 # MAFFT available alignment methods enumeration
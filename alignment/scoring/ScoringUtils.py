@@ -1,8 +1,12 @@
-import csv
-import re
+import functools
+import os
+import numpy as np
 from pymsa import MSA, SumOfPairs
 from pymsa import SubstitutionMatrix
 
+# Alignments with less cells (number of sequences x length), than this number, are scored by pyMSA directly
+NUMPY_MIN_CELLS = 1000
+
 
 class CustomMatrix(SubstitutionMatrix):
     """
@@ -22,7 +26,30 @@ class CustomMatrix(SubstitutionMatrix):
         :return:                distance matrix - dictionary, where keys are 2-element tuple of symbols, and values are scores of their alignment
         """
         super(CustomMatrix, self).__init__(gap_penalty, gap_character)
-        self.distance_matrix = self.read_matrix_from_file(path)
+        stat = os.stat(path)
+        self._cache_key = (path, stat.st_mtime_ns, stat.st_size)
+        self.distance_matrix = _read_matrix_cached(*self._cache_key)
+
+    def get_byte_score_table(self):
+        """
+        Returns scores of the distance matrix as a dense table, indexed by the codes of symbols up to 0xFF,
+        i.e. the symbols of MAFFT output in text mode. The table is built only once for the file, and must not be modified
+
+        :return:                tuple of table of scores and table of flags, whether the pair of symbols is in the matrix
+        """
+        return _byte_score_table_cached(*self._cache_key)
+
+    @staticmethod
+    def get_cached_matrix(path_to_matrix: str) -> dict:
+        """
+        Returns distance matrix of the file, which is parsed only once until the file is modified.
+        The dictionary is shared by all the callers, so it must not be modified
+
+        :param path_to_matrix:  path to the custom substitution matrix
+        :return:                distance matrix
+        """
+        stat = os.stat(path_to_matrix)
+        return _read_matrix_cached(path_to_matrix, stat.st_mtime_ns, stat.st_size)
 
     @staticmethod
     def read_matrix_from_file(path_to_matrix: str) -> dict:
@@ -33,26 +60,77 @@ class CustomMatrix(SubstitutionMatrix):
         :return:                distance matrix
         """
         distance_matrix = {}
+        # Symbols of hexadecimal codes. There are few distinct codes, so every one is decoded only once
+        symbols = {}
 
-        with open(path_to_matrix) as csv_file:
-            reader = csv.reader(csv_file)
-            for row in reader:
-                tokens = re.split(r'\s+', row[0])
+        # The file is read as bytes, as only hexadecimal codes and scores are needed, and comments are not decoded
+        with open(path_to_matrix, "rb") as matrix_file:
+            for line in matrix_file:
+                # The line is "code1 code2 score   # comment", split() collapses the whitespace
+                tokens = line.split(maxsplit=3)
+                if len(tokens) < 3:
+                    continue
 
                 # Decoding of characters uses the same approach, as get_unicode_char() method of AlignUtils
-                symb1 = chr(int(tokens[0], 16))
-                symb2 = chr(int(tokens[1], 16))
+                symb1 = symbols.get(tokens[0])
+                if symb1 is None:
+                    symb1 = symbols[tokens[0]] = chr(int(tokens[0], 16))
+                symb2 = symbols.get(tokens[1])
+                if symb2 is None:
+                    symb2 = symbols[tokens[1]] = chr(int(tokens[1], 16))
 
                 """
                 As substitution matrix is square it contains redundant information,
-                so the following condition checks, that distance matrix will only contain unique pairs of symbols
+                so the following condition checks, that distance matrix will only contain unique pairs of symbols.
+                The first score of a pair is kept
                 """
-                if (symb1, symb2) not in distance_matrix and (symb2, symb1) not in distance_matrix:
-                    distance_matrix.update({(symb1, symb2): int(tokens[2])})
+                if (symb2, symb1) not in distance_matrix:
+                    distance_matrix.setdefault((symb1, symb2), int(tokens[2]))
 
         return distance_matrix
 
 
+@functools.lru_cache(maxsize=16)
+def _read_matrix_cached(path_to_matrix, mtime_ns, size):  # pylint: disable=unused-argument
+    """
+    Cached read_matrix_from_file(). Modification time and size of the file are the part of the cache key
+
+    :param path_to_matrix:  path to the custom substitution matrix
+    :param mtime_ns:        modification time of the file in nanoseconds
+    :param size:            size of the file
+    :return:                distance matrix
+    """
+    return CustomMatrix.read_matrix_from_file(path_to_matrix)
+
+
+@functools.lru_cache(maxsize=16)
+def _byte_score_table_cached(path_to_matrix, mtime_ns, size):
+    """
+    Dense tables of the distance matrix for CustomMatrix.get_byte_score_table(), cached the same way as the matrix
+
+    :param path_to_matrix:  path to the custom substitution matrix
+    :param mtime_ns:        modification time of the file in nanoseconds
+    :param size:            size of the file
+    :return:                tuple of table of scores and table of flags, whether the pair of symbols is in the matrix
+    """
+    distance_matrix = _read_matrix_cached(path_to_matrix, mtime_ns, size)
+    pairs = [(ord(a), ord(b), score) for (a, b), score in distance_matrix.items()
+             if len(a) == 1 and len(b) == 1 and ord(a) < 256 and ord(b) < 256]
+    rows, columns, scores = np.array(pairs, dtype=np.int64).reshape(-1, 3).T
+
+    table = np.zeros((256, 256), dtype=np.int64)
+    known = np.zeros((256, 256), dtype=bool)
+    # As in pyMSA, the score of a pair is looked up in reversed order, only if the pair itself is missing
+    table[columns, rows] = scores
+    known[columns, rows] = True
+    table[rows, columns] = scores
+    known[rows, columns] = True
+
+    table.setflags(write=False)
+    known.setflags(write=False)
+    return table, known
+
+
 class Scoring:
     """
     Methods for data manipulation and calculation of scores
@@ -67,10 +145,19 @@ class Scoring:
         :param mafft_output:    output of MAFFT program
         :return:                MSA object of aligned sequences
         """
-        mafft_lines = mafft_output.splitlines()
-
-        headers = [line for line in mafft_lines if line.startswith(">")]
-        sequences = ["".join(sequence.split("\n")[1:]) for sequence in mafft_output.split(">") if sequence]
+        headers, sequences, lines = [], [], []
+
+        # Single pass over the lines. Encoded sequences can contain symbols, which str.splitlines() treats as breaks
+        for line in mafft_output.split("\n"):
+            if line.startswith(">"):
+                if headers:
+                    sequences.append("".join(lines))
+                    lines = []
+                headers.append(line)
+            elif headers:
+                lines.append(line)
+        if headers:
+            sequences.append("".join(lines))
         return MSA(sequences, headers)
 
     @staticmethod
@@ -83,5 +170,75 @@ class Scoring:
         :return:                scoring of alignment
         """
         matrix = CustomMatrix(path_to_matrix)
+
+        # Big alignments are scored with NumPy. pyMSA is used for small alignments and the cases NumPy can't handle
+        if msa.number_of_sequences * len(msa) >= NUMPY_MIN_CELLS:
+            score = Scoring._sum_of_pairs_numpy(msa, matrix)
+            if score is not None:
+                return score
+
         score = SumOfPairs(msa, matrix).compute()
         return score
+
+    @staticmethod
+    def _sum_of_pairs_numpy(msa, matrix):
+        """
+        Calculates alignment score using sum of pairs method, vectorized with NumPy.
+        The score is the same as the score of SumOfPairs from pyMSA package.
+
+        Instead of iterating over all pairs of sequences, each column is represented by the counts of its symbols,
+        then the score of the column is (counts x matrix x counts - counts x diagonal of matrix) / 2
+
+        :param msa:             MSA object of aligned sequences
+        :param matrix:          substitution matrix
+        :return:                scoring of alignment, or None if the alignment can't be scored this way
+                                (e.g. some pair of symbols is missing in the matrix, and pyMSA should raise the exception)
+        """
+        sequences = msa.sequences
+        length = len(sequences[0])
+        if any(len(seq) != length for seq in sequences):
+            return None
+
+        # Symbols of MAFFT output in text mode are single bytes
+        try:
+            encoded = np.frombuffer("".join(sequences).encode("latin-1"), dtype=np.uint8)
+        except UnicodeEncodeError:
+            return None
+        encoded = encoded.reshape(len(sequences), length)
+
+        # Compact alphabet of the symbols in the alignment
+        symbols, indices = np.unique(encoded, return_inverse=True)
+        indices = indices.reshape(encoded.shape)
+        size = len(symbols)
+
+        # Scores of all pairs of symbols, taken from the table of the matrix. The pairs missing in it are marked as unknown
+        byte_table, byte_known = matrix.get_byte_score_table()
+        table = byte_table[np.ix_(symbols, symbols)]
+        known = byte_known[np.ix_(symbols, symbols)]
+
+        # Gaps are scored before the matrix is looked up
+        gap = np.flatnonzero([chr(symbol) == matrix.gap_character for symbol in symbols])
+        table[gap, :] = int(matrix.gap_penalty)
+        table[:, gap] = int(matrix.gap_penalty)
+        table[gap, gap] = 1
+        known[gap, :] = True
+        known[:, gap] = True
+
+        # Counting formula gives the score of ordered pairs only for symmetric matrices
+        if not np.array_equal(table, table.T):
+            return None
+
+        # Counts of the symbols in every column
+        positions = np.arange(length) * size + indices
+        counts = np.bincount(positions.ravel(), minlength=length * size).reshape(length, size)
+
+        # Check that none of the unknown pairs is present in the same column
+        if not known.all():
+            present = (counts > 0).astype(np.int64)
+            together = present.T @ present
+            np.fill_diagonal(together, (counts >= 2).sum(axis=0))
+            if together[~known].any():
+                return None
+
+        score = (((counts @ table) * counts).sum() - (counts * np.diag(table)).sum()) // 2
+        return int(score)
@@ -0,0 +1,56 @@
+import os
+import json
+import functools
+import pytest
+from concurrent.futures import ProcessPoolExecutor
+
+# Use orjson to parse test resources, if it is available
+try:
+    import orjson
+
+    def _loads(data):
+        return orjson.loads(data)
+except ImportError:
+    def _loads(data):
+        return json.loads(data)
+
+
+@functools.lru_cache(maxsize=None)
+def _load_json(path):
+    with open(path, "rb") as file:
+        return _loads(file.read())
+
+
+# Pytest fixtures shared by the test modules
+@pytest.fixture(scope="session")
+def read_json():
+    """Returns function, which parses JSON resource file. Every file is read only once for the session,
+    so the tests share the parsed object and must not modify it"""
+
+    return _load_json
+
+
+@pytest.fixture(scope="session", autouse=True)
+def mafft_cache_dir(tmp_path_factory):
+    """Stores MAFFT results cached by the tests in a temporary directory instead of the home directory.
+    The variable is set before the worker processes are started, so they use the same directory"""
+
+    cache_dir = str(tmp_path_factory.mktemp("pepsea_cache"))
+    previous = os.environ.get("PEPSEA_CACHE_DIR")
+    os.environ["PEPSEA_CACHE_DIR"] = cache_dir
+    yield cache_dir
+
+    if previous is None:
+        del os.environ["PEPSEA_CACHE_DIR"]
+    else:
+        os.environ["PEPSEA_CACHE_DIR"] = previous
+
+
+@pytest.fixture(scope="session")
+def mafft_pool():
+    """Returns pool of worker processes, which run MAFFT for the tests. The pool is created once per session,
+    so the alignments submitted by the fixtures run in parallel. Two workers are enough for the fixtures,
+    and pytest-xdist workers don't multiply it by the number of CPU cores"""
+
+    with ProcessPoolExecutor(max_workers=2) as executor:
+        yield executor
@@ -1,221 +1,363 @@
 import os
+import shutil
 import json
-import glob
+import functools
+import collections
+import itertools
+import uuid
+import dataclasses
 import pytest
-from datetime import datetime
+from pathlib import Path
 
-from alignment.AlignSubPeptides import align_sub_peptides, split_sub_peptides, extract_sub_peptide, \
-    helm2fasta, fasta2helm, convert2helm, get_common_subpeptides, get_aligned_sequences, get_alignment_score, \
-    cleanup
+from alignment.AlignSubPeptides import align_sub_peptides, split_sub_peptides, split_sub_peptides_from_list, \
+    extract_sub_peptide, helm2fasta, helm2fasta_many, fasta2helm, convert2helm, get_common_subpeptides, get_aligned_sequences, get_alignment_score, \
+    cleanup, _mafft_version, _read_mafft_cache, _write_mafft_cache
 
 
-# Pytest fixtures
-@pytest.fixture
-def path_to_data():
-    # Return path to data folder
+# Paths to the test data, shared by the fixtures and the tests
+RESOURCES = Path(__file__).resolve().parent / "resources" / "test_AlignSubPeptides"
+SUBST_MATRIX = RESOURCES / "ROCS"
+MONOMER_TABLE = RESOURCES / "monomers_map.txt"
+ALIGN_INPUT = RESOURCES / "align_input.txt"
+ALIGN_OUTPUT = RESOURCES / "align_output.json"
+REALIGN_NEW_SEQUENCES = RESOURCES / "new_sequences.txt"
+REALIGN_OUTPUT = RESOURCES / "realign_output.json"
+SCORING_DATA = RESOURCES / "for_scoring.txt"
+SCORING_MATRIX = RESOURCES / "PEPTIDE1_SCORE_matrix.txt"
+
+# Folder with the data of test_split_sub_peptides(), and prefixes of files with raw HELM sequences in it
+SPLIT_SUB_PEPTIDES_DIR = RESOURCES / "test_split_sub_peptides"
+HELM_SEQUENCES = ('example_', 'for_alignment1_', 'for_alignment2_', 'for_alignment3_', 'for_alignment_without_nh2_',
+                  'helmtest_', 'input_data_', 'multi_chain_peps_', 'multi_pep_chem_', "test_data_")
+
+
+@dataclasses.dataclass(frozen=True)
+class AlignCfg:
+    """Arguments of align_sub_peptides(), which are the same in all the alignment tests"""
+    gap_opening_penalty: int = 1
+    gap_extension_penalty: int = 0
+    path_to_mafft: str = "ginsi"
+    path_to_subst_matrix: str = str(SUBST_MATRIX)
+    path_to_monomer_table: str = str(MONOMER_TABLE)
+
+
+# Built once and passed to align_sub_peptides() as **vars(ALIGN_CFG)
+ALIGN_CFG = AlignCfg()
+
+# Tests of align_sub_peptides() run MAFFT, they are skipped if ginsi is not installed
+requires_ginsi = pytest.mark.skipif(shutil.which("ginsi") is None, reason="ginsi not installed")
+
+
+@functools.lru_cache(maxsize=None)
+def index_split_files(directory):
+    """
+    Returns the files of test_split_sub_peptides(), grouped by their prefix. The folder is listed once
+        - Input is stored in 'prefix_input.txt'
+        - Output with all subpeptides is stored in 'prefix_all_peptides_output.json'
+        - Output with a single subpeptide is stored in 'prefix_SUBPEPTIDE_only_output.json'
+    """
+    index = collections.defaultdict(lambda: {"input": None, "all": None, "subs": {}})
+
+    for name in sorted(entry.name for entry in os.scandir(directory)):
+        path = os.path.join(directory, name)
+        if name.endswith("_input.txt"):
+            index[name[:-len("input.txt")]]["input"] = path
+        elif name.endswith("_all_peptides_output.json"):
+            index[name[:-len("all_peptides_output.json")]]["all"] = path
+        elif name.endswith("_only_output.json"):
+            prefix, _, peptide = name[:-len("_only_output.json")].rpartition("_")
+            index[prefix + "_"]["subs"][peptide] = path
+
+    return dict(index)
 
-    path = "tests/unit_tests/resources/test_AlignSubPeptides/"
-    return path
 
+def collect_split_cases(directory, prefixes):
+    """Returns test cases of split_sub_peptides(), one for every output file, see index_split_files()"""
+    cases = []
+    index = index_split_files(directory)
 
+    for prefix in prefixes:
+        files = index[prefix]
+
+        # None is passed to the function to check the output file, which contains all the peptides
+        cases.append(pytest.param(files["input"], None, files["all"], id=prefix + "all"))
+        for peptide, path_out in files["subs"].items():
+            cases.append(pytest.param(files["input"], peptide, path_out, id=prefix + peptide))
+
+    return cases
+
+
+# Subpeptide used by the conversion tests, in HELM and FASTA notation
+PEPTIDE1_HELM = "H.[dS].Q.G.T.F.T.S.E.Y.S.K.Y.L.D.E.R.A.A.K.D.F.V.Q.W.L.L.N.K.[NH2]"
+PEPTIDE1_FASTA = "H[dS]QGTFTSEYSKYLDERAAKDFVQWLLNK[NH2]"
+
+
+# Pytest fixtures
 @pytest.fixture
-def helm_sequences():
-    """Returns prefixes of files with raw HELM sequences"""
+def align_cwd(tmp_path, monkeypatch):
+    """Runs the test in a temporary working directory, which is removed with all the files created by the test"""
 
-    return ['example_', 'for_alignment1_', 'for_alignment2_', 'for_alignment3_', 'for_alignment_without_nh2_',
-            'helmtest_', 'input_data_', 'multi_chain_peps_', 'multi_chem_pep_', "test_data_"]
+    monkeypatch.chdir(tmp_path)
+    yield tmp_path
 
 
 @pytest.fixture
 def non_empty_dict():
-    """Returns non-empty HELM dictionary"""
+    """Returns non-empty HELM dictionary. The scope is function, as extract_sub_peptide() updates the dictionary"""
 
     return {"PEPTIDE1": "PEPTIDE1{[c3amCb1c].[d1Nal].R.K.[Nle].Y.[Nle].[NMeF]}$$$$"}
 
 
-@pytest.fixture
-def data_for_alignment(path_to_data):
+@pytest.fixture(scope="session")
+def data_for_alignment(read_json):
     """
     Return data, needed to test the correct alignment
-      - input data, expected output (alignment and score), matrix and monomers table"""
-    input_path = path_to_data + "align_input.txt"
-    output_path = path_to_data + "align_output.json"
+      - input data, expected output (alignment and score)"""
+    with open(ALIGN_INPUT) as inp_file:
+        data = inp_file.read()
 
-    matrix = path_to_data + "ROCS"
-    monomers = path_to_data + "monomers_map.txt"
+    # Expected output is generated with the help of ginsi method
+    expected_alignment = read_json(ALIGN_OUTPUT)
+    expected_score = {"PEPTIDE1": -1.1537037037037037, "CHEM1": -19.375, "PEPTIDE2": -7.532608695652174,
+                      "CHEM2": 0.0, "CHEM3": None}
 
-    with open(input_path)as inp_file, open(output_path) as out_file:
-        input_data = inp_file.readlines()
-        data = ""
-        for line in input_data:
-            data += line
+    return data, expected_alignment, expected_score
 
-        # Expected output is generated with the help of ginsi method
-        expected_alignment = json.load(out_file)
-        expected_score = {"PEPTIDE1": -1.1537037037037037, "CHEM1": -19.375, "PEPTIDE2": -7.532608695652174,
-                          "CHEM2": 0.0, "CHEM3": None}
 
-        return data, expected_alignment, expected_score, matrix, monomers
+@pytest.fixture(scope="session")
+def data_for_realignment(read_json):
+    """Return data, needed to test the correct realignment
+    - input data, expected output (alignment and score)"""
 
+    aligned_data = "\n".join(seq.rstrip("\n") for seq in read_json(ALIGN_OUTPUT).values())
 
-@pytest.fixture
-def data_for_realignment(path_to_data):
-    """Return data, needed to test the correct realignment
-    - input data, expected output (alignment and score), matrix and monomers table"""
+    with open(REALIGN_NEW_SEQUENCES) as new_file:
+        new_data = new_file.read()
 
-    aligned_path = path_to_data + "align_output.json"
-    new_seqs = path_to_data + "new_sequences.txt"
-    realign_path = path_to_data + "realign_output.json"
+    # Expected output is generated with the help of ginsi method
+    expected_alignment = read_json(REALIGN_OUTPUT)
+    expected_score = {"PEPTIDE1": 216.61280193236715,
+                      "PEPTIDE2": 276.5110946745562}
 
-    matrix = path_to_data + "ROCS"
-    monomers = path_to_data + "monomers_map.txt"
+    return aligned_data, new_data, expected_alignment, expected_score
 
-    with open(aligned_path)as align, open(realign_path) as realign, open(new_seqs) as new_file:
-        aligned_seqs = json.load(align)
-        aligned_data = ""
-        for key in aligned_seqs:
-            aligned_data += aligned_seqs[key]
 
-        new_sequences = new_file.readlines()
-        new_data = ""
-        for line in new_sequences:
-            new_data += line
+@pytest.fixture(scope="session")
+def mafft_runs(mafft_pool, data_for_alignment, data_for_realignment):
+    """Submits the alignment and the realignment of all the polymers to the pool at once, see conftest.py.
+    MAFFT is run once for all the tests, and both runs proceed in parallel"""
 
-        # Expected output is generated with the help of ginsi method
-        expected_alignment = json.load(realign)
-        expected_score = {"PEPTIDE1": 216.61280193236715,
-                          "PEPTIDE2": 276.5110946745562}
+    data, _, _ = data_for_alignment
+    aligned_data, new_data, _, _ = data_for_realignment
 
-        return aligned_data.strip("\n"), new_data, expected_alignment, expected_score, matrix, monomers
+    align = mafft_pool.submit(align_sub_peptides, data, polymer_to_align=None, **vars(ALIGN_CFG))
+    realign = mafft_pool.submit(align_sub_peptides, aligned_data, new_data, polymer_to_align=None,
+                                realign_method="add", **vars(ALIGN_CFG))
 
+    return align, realign
 
-"""
-Below are test for align_sub_peptides() function
-"""
 
+@pytest.fixture(scope="session")
+def aligned_once(mafft_runs):
+    """Returns the output of align_sub_peptides() for all the polymers.
+    MAFFT results are cached, so the tests aligning a single polymer reuse them too"""
 
-def test_align_sub_peptides(path_to_data, data_for_alignment):
-    """Test the correct alignment"""
+    return mafft_runs[0].result()
 
-    data, expected_alignment, expected_score, matrix, monomers = data_for_alignment
 
-    output, err, score = align_sub_peptides(data, gap_opening_penalty=1, gap_extension_penalty=0, polymer_to_align=None, path_to_mafft="ginsi",
-                                            path_to_subst_matrix=matrix, path_to_monomer_table=monomers)
+@pytest.fixture(scope="session")
+def realigned_once(mafft_runs):
+    """Returns the output of align_sub_peptides() realigning all the polymers"""
 
-    # Remove temporary files
-    files_to_remove = []
-    for key in output:
-        files = glob.glob(f'*{key}*')
-        files_to_remove.extend(files)
+    return mafft_runs[1].result()
 
-    for file in files_to_remove:
-        os.remove(file)
 
-    # Assert the correctness of the output
-    for key in output:
-        assert output[key] == expected_alignment[key]
-        assert score[key] == expected_score[key]
+"""
+Below are test for align_sub_peptides() function
+"""
 
 
-def test_align_sub_peptides_single_polymer(data_for_alignment):
+@requires_ginsi
+def test_align_sub_peptides(data_for_alignment, aligned_once):
     """Test the correct alignment"""
 
-    data, expected_alignment, expected_score, matrix, monomers = data_for_alignment
+    data, expected_alignment, expected_score = data_for_alignment
+    output, err, score = aligned_once
 
-    # Call align_sub_peptides() and specify polymer_to_align, which is not present in the input data
-    output, err, score = align_sub_peptides(data, gap_opening_penalty=1, gap_extension_penalty=0, polymer_to_align="PEPTIDE1", path_to_mafft="ginsi",
-                                            path_to_subst_matrix=matrix, path_to_monomer_table=monomers)
+    # Assert the correctness of the output
+    assert output == {key: expected_alignment[key] for key in output}
+    assert score == {key: expected_score[key] for key in output}
+
+
+@requires_ginsi
+def test_align_sub_peptides_single_polymer(data_for_alignment, aligned_once, align_cwd):
+    """Test the correct alignment of a single polymer, which is the same as in the alignment of all the polymers.
+    MAFFT results of aligned_once are reused from the cache"""
 
-    # Remove temporary files
-    files_to_remove = glob.glob(f'*{"PEPTIDE1"}*')
+    data, expected_alignment, expected_score = data_for_alignment
 
-    for file in files_to_remove:
-        os.remove(file)
+    # Call align_sub_peptides() and specify polymer_to_align, which is present in the input data
+    output, err, score = align_sub_peptides(data, polymer_to_align="PEPTIDE1", **vars(ALIGN_CFG))
 
     assert len(output) == 1
     assert len(score) == 1
-    assert output["PEPTIDE1"] == expected_alignment["PEPTIDE1"]
+    assert output["PEPTIDE1"] == expected_alignment["PEPTIDE1"] == aligned_once[0]["PEPTIDE1"]
     assert score["PEPTIDE1"] == expected_score["PEPTIDE1"]
 
 
+@requires_ginsi
+def test_align_sub_peptides_chunks(data_for_alignment, align_cwd):
+    """Test the alignment of sequences split into chunks"""
+
+    data, expected_alignment, expected_score = data_for_alignment
+
+    output, err, score = align_sub_peptides(data, polymer_to_align="PEPTIDE1", chunk_size=3, **vars(ALIGN_CFG))
+
+    # All the sequences are aligned, so they have the same number of monomers and gaps
+    aligned_sequences = output["PEPTIDE1"].split("\n")[1::2]
+    assert len(aligned_sequences) == expected_alignment["PEPTIDE1"].count(">")
+    assert len(set(len(fasta2helm(seq).split(".")) for seq in aligned_sequences)) == 1
+    assert score["PEPTIDE1"] is not None
+
+
+@requires_ginsi
+def test_align_sub_peptides_cache(data_for_alignment, tmp_path, monkeypatch, align_cwd):
+    """Test that MAFFT results are cached and reused"""
+
+    data, expected_alignment, expected_score = data_for_alignment
+    cache_dir = tmp_path / "cache"
+    monkeypatch.setenv("PEPSEA_CACHE_DIR", str(cache_dir))
+
+    outputs = []
+    for _ in range(2):
+        outputs.append(align_sub_peptides(data, polymer_to_align="PEPTIDE1", **vars(ALIGN_CFG)))
+
+    assert len(os.listdir(cache_dir)) == 1
+    assert outputs[0] == outputs[1]
+    assert outputs[1][0]["PEPTIDE1"] == expected_alignment["PEPTIDE1"]
+
+
+@requires_ginsi
+def test_align_sub_peptides_cache_off(data_for_alignment, tmp_path, monkeypatch, align_cwd):
+    """Test that MAFFT results are not written, if the size of the cache is 0"""
+
+    data, expected_alignment, expected_score = data_for_alignment
+    cache_dir = tmp_path / "cache"
+    monkeypatch.setenv("PEPSEA_CACHE_DIR", str(cache_dir))
+    monkeypatch.setattr("alignment.AlignSubPeptides._MAFFT_CACHE_SIZE", 0)
+
+    aligned_sub_peptides, _, _ = align_sub_peptides(data, polymer_to_align="PEPTIDE1", **vars(ALIGN_CFG))
+
+    assert not cache_dir.exists()
+    assert aligned_sub_peptides["PEPTIDE1"] == expected_alignment["PEPTIDE1"]
+
+
+def test_mafft_cache_round_trip(tmp_path, monkeypatch):
+    """Test that MAFFT results are stored as JSON, and other files in the cache directory are ignored"""
+
+    monkeypatch.setenv("PEPSEA_CACHE_DIR", str(tmp_path))
+    _write_mafft_cache("key", (">seq\nA\x85-\n", "progress"))
+
+    assert json.loads((tmp_path / "key.json").read_text(encoding="utf-8")) == [">seq\nA\x85-\n", "progress"]
+    assert _read_mafft_cache("key") == (">seq\nA\x85-\n", "progress")
+    assert _read_mafft_cache("missing") is None
+
+    (tmp_path / "corrupted.json").write_text("{")
+    (tmp_path / "other.json").write_text('{"stdout": "A"}')
+    assert _read_mafft_cache("corrupted") is None
+    assert _read_mafft_cache("other") is None
+
+
+def test_mafft_cache_size(tmp_path, monkeypatch):
+    """Test that the least recently used results are removed, when the cache is full"""
+
+    monkeypatch.setenv("PEPSEA_CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr("alignment.AlignSubPeptides._MAFFT_CACHE_SIZE", 2)
+
+    _write_mafft_cache("first", ("1", ""))
+    _write_mafft_cache("second", ("2", ""))
+    os.utime(tmp_path / "first.json", (0, 0))
+    os.utime(tmp_path / "second.json", (1, 1))
+    _write_mafft_cache("third", ("3", ""))
+
+    assert sorted(os.listdir(tmp_path)) == ["second.json", "third.json"]
+
+
+def test_mafft_version_missing_program(tmp_path):
+    """Test that the version of a missing program is None, so its results are not cached"""
+
+    assert _mafft_version(str(tmp_path / "mafft") + " --auto") is None
+    assert _mafft_version((str(tmp_path / "ginsi"),)) is None
+
+
+@requires_ginsi
+def test_align_sub_peptides_without_scores(data_for_alignment):
+    """Test the alignment without calculation of scores"""
+
+    data, expected_alignment, expected_score = data_for_alignment
+
+    output, err, score = align_sub_peptides(data, polymer_to_align=None, compute_scores=False, **vars(ALIGN_CFG))
+
+    for key in output:
+        assert output[key] == expected_alignment[key]
+        assert score[key] is None
+
+
+@requires_ginsi
 def test_align_sub_peptides_missing_polymer(data_for_alignment):
     """Test the correct alignment"""
 
-    data, expected_alignment, expected_score, matrix, monomers = data_for_alignment
+    data, expected_alignment, expected_score = data_for_alignment
 
     # Call align_sub_peptides() and specify polymer_to_align, which is not present in the input data
-    output, err, score = align_sub_peptides(data, gap_opening_penalty=1, gap_extension_penalty=0, polymer_to_align="PEPTIDE3", path_to_mafft="ginsi",
-                                            path_to_subst_matrix=matrix, path_to_monomer_table=monomers)
+    output, err, score = align_sub_peptides(data, polymer_to_align="PEPTIDE3", **vars(ALIGN_CFG))
 
     assert output is None
     assert err is None
     assert score is None
 
 
-def test_align_sub_peptides_realignment(path_to_data, data_for_realignment):
+@requires_ginsi
+def test_align_sub_peptides_realignment(data_for_realignment, realigned_once):
     """Test the correct realignment"""
 
-    aligned_data, new_data, expected_alignment, expected_score, matrix, monomers = data_for_realignment
-    output, err, score = align_sub_peptides(aligned_data, new_data, gap_opening_penalty=1, gap_extension_penalty=0,
-                                            polymer_to_align=None, path_to_mafft="ginsi",
-                                            path_to_subst_matrix=matrix, realign_method="add",
-                                            path_to_monomer_table=monomers)
-
-    # Remove temporary files
-    files_to_remove = []
-    for key in output:
-        files = glob.glob(f'*{key}*')
-        files_to_remove.extend(files)
-
-    for file in files_to_remove:
-        os.remove(file)
+    aligned_data, new_data, expected_alignment, expected_score = data_for_realignment
+    output, err, score = realigned_once
 
     # Assert, that for a given output, 2 common polymers were aligned
     assert len(output) == 2
 
     # Assert the correctness of the output
-    for key in output:
-        assert output[key] == expected_alignment[key]
-        assert score[key] == expected_score[key]
+    assert output == {key: expected_alignment[key] for key in output}
+    assert score == {key: expected_score[key] for key in output}
 
 
-def test_align_sub_peptides_realignment_specified_polymer_exists(path_to_data, data_for_realignment):
-    """Test the correct realignment, with specified polymer"""
+@requires_ginsi
+def test_align_sub_peptides_realignment_specified_polymer_exists(data_for_realignment, realigned_once, align_cwd):
+    """Test the correct realignment, with specified polymer. MAFFT results of realigned_once are reused from the cache"""
 
     polymer_to_align = "PEPTIDE2"
-    aligned_data, new_data, expected_alignment, expected_score, matrix, monomers = data_for_realignment
-    output, err, score = align_sub_peptides(aligned_data, new_data, gap_opening_penalty=1, gap_extension_penalty=0,
-                                            polymer_to_align=polymer_to_align, path_to_mafft="ginsi",
-                                            path_to_subst_matrix=matrix, realign_method="add",
-                                            path_to_monomer_table=monomers)
-
-    # Remove temporary files
-    files_to_remove = []
-    for key in output:
-        files = glob.glob(f'*{key}*')
-        files_to_remove.extend(files)
-
-    for file in files_to_remove:
-        os.remove(file)
+    aligned_data, new_data, expected_alignment, expected_score = data_for_realignment
+    output, err, score = align_sub_peptides(aligned_data, new_data, polymer_to_align=polymer_to_align,
+                                            realign_method="add", **vars(ALIGN_CFG))
 
     # Assert, that for a given output, 2 common polymers were aligned
     assert len(output) == 1
 
     # Assert the correctness of the output
-    assert output[polymer_to_align] == expected_alignment[polymer_to_align]
+    assert output[polymer_to_align] == expected_alignment[polymer_to_align] == realigned_once[0][polymer_to_align]
     assert score[polymer_to_align] == expected_score[polymer_to_align]
 
 
-def test_align_sub_peptides_realignment_specified_polymer_missing(path_to_data, data_for_realignment):
+@requires_ginsi
+def test_align_sub_peptides_realignment_specified_polymer_missing(data_for_realignment):
     """Test that no alignment is performed, if the specified polymer is missing"""
 
     # PEPTIDE3 is not present in either input data
     polymer_to_align = "PEPTIDE3"
-    aligned_data, new_data, expected_alignment, expected_score, matrix, monomers = data_for_realignment
-    output, err, score = align_sub_peptides(aligned_data, new_data, gap_opening_penalty=1, gap_extension_penalty=0,
-                                            polymer_to_align=polymer_to_align, path_to_mafft="ginsi",
-                                            path_to_subst_matrix=matrix, realign_method="add",
-                                            path_to_monomer_table=monomers)
+    aligned_data, new_data, expected_alignment, expected_score = data_for_realignment
+    output, err, score = align_sub_peptides(aligned_data, new_data, polymer_to_align=polymer_to_align,
+                                            realign_method="add", **vars(ALIGN_CFG))
 
     assert output is None
     assert err is None
@@ -227,69 +369,39 @@ Below are tests for function split_sub_peptides()
 """
 
 
-def test_split_sub_peptides(helm_sequences, path_to_data):
-
-    """This function goes through different test input files.
-       Path to folder with data is stored in dir variable, files prefixes are stored in helm_sequences() fixture
-            - Input is stored in 'prefix_input.txt'
-            - Output is stored in 'prefix_*.json', where * regexp specifies the type os subpeptide used for splitting
-    """
-
-    dir = path_to_data + "test_split_sub_peptides"
-
-    # List of files in directory
-    files = os.listdir(dir)
-
-    # This loop iterates over prefixes of input files
-    for prefix in helm_sequences:
+@pytest.mark.parametrize("path_in, peptide, path_out", collect_split_cases(SPLIT_SUB_PEPTIDES_DIR, HELM_SEQUENCES))
+def test_split_sub_peptides(path_in, peptide, path_out, read_json):
+    """Test splitting of the input file into subpeptides, see collect_split_cases() for the files"""
 
-        # List of files output files
-        output_files = []
+    with open(path_in) as input_lines:
+        result = split_sub_peptides(input_lines.read(), peptide)
 
-        # List of respective subpeptides
-        subpeptides = []
+    assert result == read_json(path_out)
 
-        for file in files:
-            if prefix + "input" in file:
 
-                # Input file
-                input_file = file
-            elif prefix + "all" in file:
+def test_split_sub_peptides_parsed_cache():
+    """Test that parsed sub-peptides are stored in the cache and give the same FASTA"""
 
-                # Output file with all subpeptides
-                output_with_all_subpeptides = file
-            elif prefix in file:
+    helm = "PEPTIDE1{[Ac].A.[dS].[NH2]}|CHEM1{[SMCC]}$$$$\nPEPTIDE1{A.C}$$$$"
+    parsed_cache = {}
+    result = split_sub_peptides(helm, None, parsed_cache)
 
-                # Extract peptides
-                peptide = file.split(prefix)[1].split("_")[0]
-                subpeptides.append(peptide)
+    assert result == split_sub_peptides(helm, None)
+    assert parsed_cache.keys() == result.keys()
+    for key in result:
+        lines = result[key].split("\n")
+        assert list(parsed_cache[key].keys()) == lines
+        for line in lines:
+            assert helm2fasta(line, parsed_cache[key][line]) == helm2fasta(line)
 
-                output_files.append(file)
 
-        # Add None, to the list of peptides, to check the output with None parameter on output file, which contains all the peptides
-        subpeptides = [None, *subpeptides]
-        path_in = dir + "/" + input_file
-        with open(path_in) as input_lines:
-            input = ""
-            for line in input_lines:
-                input += line
+def test_split_sub_peptides_from_list():
+    """Test splitting of the list of HELM strings"""
 
-            ind = 0
-            for peptide in subpeptides:
+    helm_lines = ["PEPTIDE1{[Ac].A.[dS].[NH2]}|CHEM1{[SMCC]}$$$$", "PEPTIDE1{A.C}$$$$"]
 
-                # If None, then pass to the function input data and None, and check on output file, which contains all the peptides
-                if peptide is None:
-                    result = split_sub_peptides(input, None)
-                    file = output_with_all_subpeptides
-                else:
-                    result = split_sub_peptides(input, peptide)
-                    file = output_files[ind]
-                    ind += 1
-                path_out = dir + "/" + file
-
-                with open(path_out) as output:
-                    expected_output = json.load(output)
-                    assert result == expected_output
+    assert split_sub_peptides_from_list(helm_lines, None) == split_sub_peptides("\n".join(helm_lines), None)
+    assert split_sub_peptides_from_list(helm_lines, "CHEM1") == {"CHEM1": "CHEM1{[SMCC]}$$$$"}
 
 
 @pytest.mark.xfail
@@ -353,10 +465,10 @@ def test_helm2fasta():
     """Converts sequence from HELM format into FASTA"""
 
     # Input HELM string
-    helm = "PEPTIDE1{H.[dS].Q.G.T.F.T.S.E.Y.S.K.Y.L.D.E.R.A.A.K.D.F.V.Q.W.L.L.N.K.[NH2]}|PEPTIDE2{[C18diacid].[gE].[AEEA].[AEEA]}$PEPTIDE1,PEPTIDE2,12:R3-4:R2|PEPTIDE1,PEPTIDE1,16:R3-20:R3$$$V2.0"
+    helm = f"PEPTIDE1{{{PEPTIDE1_HELM}}}|PEPTIDE2{{[C18diacid].[gE].[AEEA].[AEEA]}}$PEPTIDE1,PEPTIDE2,12:R3-4:R2|PEPTIDE1,PEPTIDE1,16:R3-20:R3$$$V2.0"
 
     # Supposed output
-    result = "> PEPTIDE1\nH[dS]QGTFTSEYSKYLDERAAKDFVQWLLNK[NH2]\n> PEPTIDE2\n[C18diacid][gE][AEEA][AEEA]\n"
+    result = f"> PEPTIDE1\n{PEPTIDE1_FASTA}\n> PEPTIDE2\n[C18diacid][gE][AEEA][AEEA]\n"
 
     fasta = helm2fasta(helm)
 
@@ -372,6 +484,23 @@ def test_helm2fasta_wrong_helm():
     assert str(excinfo.value) == "Invalid HELM notation"
 
 
+"""
+Below are tests for function helm2fasta_many()
+"""
+
+
+def test_helm2fasta_many():
+    """Converts a list of HELM strings into FASTA"""
+
+    helm_lines = ["PEPTIDE1{H.[dS].Q.G}$$$$", "PEPTIDE1{[Ac].A.A.[NH2]}|CHEM1{[SMCC]}$$$$"]
+
+    # Supposed output
+    result = ["> PEPTIDE1\nH[dS]QG\n", "> PEPTIDE1\n[Ac]AA[NH2]\n> CHEM1\n[SMCC]\n"]
+
+    assert helm2fasta_many(helm_lines) == result
+    assert helm2fasta_many(helm_lines) == [helm2fasta(helm) for helm in helm_lines]
+
+
 """
 Below are tests for function convert2helm()
 """
@@ -381,10 +510,10 @@ def test_convert2helm():
     """Tests transformation from FASTA format into HELM"""
 
     # Input FASTA data
-    fasta = '> PEPTIDE1\nH[dS]QGTFTSEYSKYLDERAAKDFVQWLLNK[NH2]\n> PEPTIDE1\n[2moPyr]FR[4Pal]LY[Nva][NMeF]'
+    fasta = f'> PEPTIDE1\n{PEPTIDE1_FASTA}\n> PEPTIDE1\n[2moPyr]FR[4Pal]LY[Nva][NMeF]'
 
     # Supposed output
-    result = ["PEPTIDE1{H.[dS].Q.G.T.F.T.S.E.Y.S.K.Y.L.D.E.R.A.A.K.D.F.V.Q.W.L.L.N.K.[NH2]}$$$$", "PEPTIDE1{[2moPyr].F.R.[4Pal].L.Y.[Nva].[NMeF]}$$$$"]
+    result = [f"PEPTIDE1{{{PEPTIDE1_HELM}}}$$$$", "PEPTIDE1{[2moPyr].F.R.[4Pal].L.Y.[Nva].[NMeF]}$$$$"]
     helm = convert2helm(fasta)
 
     assert helm == result
@@ -408,15 +537,24 @@ def test_fasta2helm():
     """Tests transformation of simple FASTA string into HELM string"""
 
     # HELM sequence in FASTA format
-    helm = "H[dS]QGTFTSEYSKYLDERAAKDFVQWLLNK[NH2]"
+    helm = PEPTIDE1_FASTA
 
     # HELM sequence which is supposed to be returned by fasta2helm() function
-    output = "H.[dS].Q.G.T.F.T.S.E.Y.S.K.Y.L.D.E.R.A.A.K.D.F.V.Q.W.L.L.N.K.[NH2]"
+    output = PEPTIDE1_HELM
     fasta = fasta2helm(helm)
 
     assert fasta == output
 
 
+def test_fasta2helm_round_trip():
+    """Tests that conversion of HELM string into FASTA and back returns the original sequence"""
+
+    fasta = helm2fasta(f"PEPTIDE1{{{PEPTIDE1_HELM}}}$$$$")
+
+    assert fasta == f"> PEPTIDE1\n{PEPTIDE1_FASTA}\n"
+    assert fasta2helm(fasta.split("\n")[1]) == PEPTIDE1_HELM
+
+
 def test_fasta2helm_corrupted_sequence():
     """Tests that corrupted sequence results in error"""
 
@@ -472,32 +610,25 @@ Below are tests for function cleanup()
 """
 
 
-def test_cleanup():
+def test_cleanup(tmp_path):
     """Test cleanup() function"""
 
-    # Create timestamp for file
-    timestamp = datetime.now().isoformat(timespec='milliseconds')
-
-    # Create files with timestamp
-    with open("test_cleanup_file_1_" + timestamp + "_.txt", 'w') as file1,\
-            open("test_cleanup_file_2_" + timestamp + "_.txt", 'w') as file2:
-        file1.write('Some text')
-        file2.write('Some other text')
-        pass
+    # Unique suffix of the directory and file names, it contains no characters like ":" which are invalid on some systems
+    suffix = uuid.uuid4().hex
+    work_dir = tmp_path / f"pepsea_{suffix}_"
+    work_dir.mkdir()
 
-    # Delete these files
-    cleanup(timestamp)
+    # Create files in the directory
+    path1 = work_dir / f"test_cleanup_file_1_{suffix}_.txt"
+    path2 = work_dir / f"test_cleanup_file_2_{suffix}_.txt"
+    path1.write_text('Some text')
+    path2.write_text('Some other text')
 
-    deleted = True
-    files = os.listdir()
+    # Delete the directory with these files
+    cleanup(str(work_dir))
 
-    # Iterate through the files in directory, and assign False to "deleted" variable, if file with the timestamp exists
-    for name in files:
-        if timestamp in name:
-            deleted = False
-            break
-
-    assert deleted is True
+    assert not path1.exists() and not path2.exists()
+    assert not work_dir.exists()
 
 
 """
@@ -505,30 +636,24 @@ Below are tests for function get_alignment_score()
 """
 
 
-def test_get_alignment_score(path_to_data):
+def test_get_alignment_score():
     """Test scoring of the alignment"""
 
-    path_to_test_data = path_to_data + "for_scoring.txt"
-    path_to_matrix = path_to_data + "PEPTIDE1_SCORE_matrix.txt"
-
-    with open(path_to_test_data) as data:
-        data = "".join(data.readlines())
+    with open(SCORING_DATA) as data:
+        data = data.read()
         expected_score = -1.1537037037037037
 
-        result = get_alignment_score(data, path_to_matrix)
+        result = get_alignment_score(data, str(SCORING_MATRIX))
 
         assert result == expected_score
 
 
-def test_get_alignment_score_empty(path_to_data):
+def test_get_alignment_score_empty():
     """Test that on attempt to score alignment, consisting of one sequence, the function returns None"""
 
-    path_to_test_data = path_to_data + "for_scoring.txt"
-    path_to_matrix = path_to_data + "PEPTIDE1_SCORE_matrix.txt"
-
-    with open(path_to_test_data) as data:
-        data = "".join(data.readlines()[:2])
+    with open(SCORING_DATA) as data:
+        data = "".join(itertools.islice(data, 2))
 
-        result = get_alignment_score(data, path_to_matrix)
+        result = get_alignment_score(data, str(SCORING_MATRIX))
 
         assert result is None
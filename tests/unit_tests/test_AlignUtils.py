@@ -1,16 +1,30 @@
 import os
 import re
-import json
+import shutil
+import threading
 import pytest
+from pathlib import Path
+from subprocess import CompletedProcess
 
 from alignment.AlignUtils import AlignUtils
 
 
+def read_bytes(path):
+    """Returns the content of the file as bytes"""
+    with open(path, "rb") as file:
+        return file.read()
+
+
+def assert_files_equal(path_a, path_b):
+    """Compares two files as a whole, byte by byte"""
+    assert read_bytes(path_a) == read_bytes(path_b)
+
+
 # Pytest fixtures
-@pytest.fixture
+@pytest.fixture(scope="session")
 def path_to_test_data():
-    """Returns path to the folder with test data"""
-    return "tests/unit_tests/resources/test_AlignUtils/"
+    """Returns path to the folder with test data, built once for the session"""
+    return Path(__file__).resolve().parent / "resources" / "test_AlignUtils"
 
 
 @pytest.fixture
@@ -19,25 +33,35 @@ def aligner():
 
 
 @pytest.fixture
-def input_in_fasta(path_to_test_data):
+def input_in_fasta(path_to_test_data, read_json):
     """Returns the input data, which contains set of sequences in FASTA format for PEPTIDE1 and CHEM1"""
 
-    with open(path_to_test_data + "input.json") as file:
-        input_dict = json.load(file)
+    input_dict = read_json(path_to_test_data / "input.json")
 
     return input_dict
 
 
-@pytest.fixture
+@pytest.fixture(scope="session")
 def path_to_matrices(path_to_test_data):
     """Returns paths to ROCS and monomers_map files"""
 
-    path_to_subst_matrix = path_to_test_data + "ROCS"
-    path_to_monomer_table = path_to_test_data + "monomers_map.txt"
+    path_to_subst_matrix = str(path_to_test_data / "ROCS")
+    path_to_monomer_table = str(path_to_test_data / "monomers_map.txt")
 
     return [path_to_subst_matrix, path_to_monomer_table]
 
 
+# Polymers of input.json, the tests are run for each of them separately
+POLYMER_KEYS = ["PEPTIDE1", "CHEM1"]
+
+# Artificial timestamp for the names of output files. Every test writes them to its own tmp_path
+STAMP = "TEST"
+
+# Tests running MAFFT are skipped, if ginsi is not installed
+requires_ginsi = pytest.mark.skipif(shutil.which("ginsi") is None, reason="ginsi not installed")
+requires_mafft = pytest.mark.skipif(shutil.which("mafft") is None, reason="mafft not installed")
+
+
 """
 Test the correct initiation of the AlignUtils class
 """
@@ -74,34 +98,32 @@ def test___repl(aligner):
     assert aligner._AlignUtils__d_dec == expected_d_dec
 
 
-def test___repl_no_more_letters(aligner, path_to_test_data):
+def test___repl_no_more_letters(aligner, path_to_test_data, read_json):
     """Test the raise of exception, when there is no more place for additional symbols"""
 
     # The file contains more monomers of nnAAs (most of which are generated artificially) that the capacity of the encoder
-    path_to_artificial_seqs = path_to_test_data + "artificial_seqs.json"
+    path_to_artificial_seqs = path_to_test_data / "artificial_seqs.json"
 
-    with open(path_to_artificial_seqs) as file:
+    # Read the file
+    artificial_seqs = read_json(path_to_artificial_seqs)
+    artificial_seqs = artificial_seqs["artificial_seqs"]
 
-        # Read the file
-        artificial_seqs = json.load(file)
-        artificial_seqs = artificial_seqs["artificial_seqs"]
-
-        with pytest.raises(Exception) as excinfo:
+    with pytest.raises(Exception) as excinfo:
 
-            # Iterate through the sequences
-            for entry in artificial_seqs:
+        # Iterate through the sequences
+        for entry in artificial_seqs:
 
-                # Remove dots from HELM seqs
-                entry = entry.replace(".", "")
+            # Remove dots from HELM seqs
+            entry = entry.replace(".", "")
 
-                # Find all the nnAA monomers in the sequence
-                findings = re.finditer(r'\[[^\]]*\]', entry)
+            # Find all the nnAA monomers in the sequence
+            findings = re.finditer(r'\[[^\]]*\]', entry)
 
-                # Encode the nnAA monomers
-                for acid in findings:
-                    aligner._AlignUtils__repl(acid)
+            # Encode the nnAA monomers
+            for acid in findings:
+                aligner._AlignUtils__repl(acid)
 
-        assert str(excinfo.value) == "There are no more letters in mapping array"
+    assert str(excinfo.value) == "There are no more letters in mapping array"
 
 
 """
@@ -109,64 +131,96 @@ Below are tests for encode_alignment_sequences() function
 """
 
 
-def test_encode_alignment_sequences(aligner, path_to_test_data, input_in_fasta):
+@pytest.mark.parametrize("key", POLYMER_KEYS)
+def test_encode_alignment_sequences(aligner, path_to_test_data, input_in_fasta, key, tmp_path):
     """ Test the correct encoding of the nnAAs """
 
-    for key in input_in_fasta:
-        data = input_in_fasta[key]
-        encoded_file = aligner.encode_alignment_sequences(data, key, 'TEST')
-        test_file = path_to_test_data + f"{key}_TEST_mafft.txt"
-        with open(encoded_file) as output_file, open(test_file) as expected_output:
-            output_file = output_file.readlines()
-            expected_output = expected_output.readlines()
-            i = 0
-            for output_line, expected_line in zip(output_file, expected_output):
-                i += 1
-                assert output_line == expected_line
+    data = input_in_fasta[key]
+    encoded_file = aligner.encode_alignment_sequences(data, key, STAMP, str(tmp_path))
+    test_file = path_to_test_data / f"{key}_TEST_mafft.txt"
+    assert_files_equal(encoded_file, test_file)
 
-        aligner.clear_symbols()
-        os.remove(encoded_file)
+
+@pytest.mark.parametrize("key", POLYMER_KEYS)
+def test_encode_alignment_sequences_to_bytes(aligner, path_to_test_data, input_in_fasta, key):
+    """ Test the correct encoding of the nnAAs in memory """
+
+    data = input_in_fasta[key]
+    encoded_data = aligner.encode_alignment_sequences_to_bytes(data, key)
+    test_file = path_to_test_data / f"{key}_TEST_mafft.txt"
+    with open(test_file, "rb") as expected_output:
+        assert encoded_data == expected_output.read()
+
+
+def test_encode_alignment_sequences_to_bytes_smiles(aligner):
+    """ Test that a nnAA defined by SMILES is encoded as a single character, even if it contains another nnAA """
+
+    data = [">seq1\nA[R1]G\n", ">seq2\nK[[R2]C(=O)N[R1]]G[R1]\n"]
+    encoded_lines = aligner.encode_alignment_sequences_to_bytes(data, "PEPTIDE1").decode("latin-1").split("\n")
+
+    assert len(encoded_lines[1]) == 3
+    assert len(encoded_lines[3]) == 4
+    assert encoded_lines[1][1] == encoded_lines[3][3]
+    assert encoded_lines[3][1] != encoded_lines[3][3]
+
+
+def test_encode_alignment_sequences_to_bytes_chem(aligner):
+    """ Test that a CHEM polymer is encoded as a single character, even if there are symbols after the monomer """
+
+    data = [">seq1\n[SMCC]\n", ">seq2\n[SMCC]x\n"]
+    encoded_lines = aligner.encode_alignment_sequences_to_bytes(data, "CHEM1").decode("latin-1").split("\n")
+
+    assert encoded_lines[1] == encoded_lines[3] == aligner._AlignUtils__d_enc["[SMCC]"]
 
 
 @pytest.mark.xfail
-def test_encode_alignment_sequences_fails_no_cleaning(aligner, path_to_test_data):
+def test_encode_alignment_sequences_fails_no_cleaning(aligner, path_to_test_data, read_json, tmp_path):
     """ Test the correct encoding of the nnAAs """
 
-    with open(path_to_test_data + "input.json") as file:
-        input_dict = json.load(file)
+    input_dict = read_json(path_to_test_data / "input.json")
 
     for key in input_dict:
         data = input_dict[key]
-        encoded_file = aligner.encode_alignment_sequences(data, key, 'TEST')
-        test_file = path_to_test_data + f"{key}_TEST_mafft.txt"
-        with open(encoded_file) as output_file, open(test_file) as expected_output:
-            output_file = output_file.readlines()
-            expected_output = expected_output.readlines()
+        encoded_file = aligner.encode_alignment_sequences(data, key, STAMP, str(tmp_path))
+        test_file = path_to_test_data / f"{key}_TEST_mafft.txt"
+        output_data = read_bytes(encoded_file)
 
-            # There will be AssertionError in this test, so we need to remove the encoded file beforehand
-            os.remove(encoded_file)
-
-            i = 0
-            for output_line, expected_line in zip(output_file, expected_output):
-                i += 1
-                assert output_line == expected_line
+        assert output_data == read_bytes(test_file)
 
         # Symbols are not cleared, so aligner will use another set of symbols, to encode nnAAs, which will result in AssertionError
 
 
-def test_encode_alignment_sequences_fails_encoder_overfilled(aligner, path_to_test_data):
+def test_encode_alignment_sequences_fails_encoder_overfilled(aligner, path_to_test_data, read_json, tmp_path):
     """Test that error is raised due to the lack of letters for encoding"""
 
-    path_to_artificial_seqs = path_to_test_data + "artificial_seqs.json"
+    path_to_artificial_seqs = path_to_test_data / "artificial_seqs.json"
 
-    with open(path_to_artificial_seqs) as file:
-        artificial_seqs = json.load(file)
-        artificial_seqs = artificial_seqs["artificial_seqs"]
+    artificial_seqs = read_json(path_to_artificial_seqs)
+    artificial_seqs = artificial_seqs["artificial_seqs"]
 
-        with pytest.raises(Exception) as excinfo:
-            aligner.encode_alignment_sequences(artificial_seqs, "PEPTIDE", "TEST")
+    with pytest.raises(Exception) as excinfo:
+        aligner.encode_alignment_sequences(artificial_seqs, "PEPTIDE", STAMP, str(tmp_path))
 
-        assert str(excinfo.value) == "There are no more letters in mapping array"
+    assert str(excinfo.value) == "There are no more letters in mapping array"
+
+
+"""
+Below are tests for build_symbol_tables() function
+"""
+
+
+@pytest.mark.parametrize("key", POLYMER_KEYS)
+def test_build_symbol_tables(aligner, input_in_fasta, key):
+    """Test that symbols are assigned like in encoding of the sequences, but the sequences are not encoded"""
+
+    aligner.build_symbol_tables(input_in_fasta[key], key)
+    d_enc = dict(aligner._AlignUtils__d_enc)
+    aligner.clear_symbols()
+
+    aligner.encode_alignment_sequences_to_bytes(input_in_fasta[key], key)
+
+    assert d_enc == aligner._AlignUtils__d_enc
+    assert d_enc
 
 
 """
@@ -174,68 +228,57 @@ Below are tests for decode_mafft() function
 """
 
 
-def test_decode_mafft(aligner, path_to_test_data):
+def test_decode_mafft(aligner, path_to_test_data, read_json, tmp_path):
     """
     encoded = ['> PEPTIDE1\n\x01--------------\x02RRRRCPLYIS\x03DPVCRRRR\x04\n', '> PEPTIDE1\n\x01-------------------\x05PLYISYDPV\x06----\x04\n', '> PEPTIDE1\n\x01--------------\x02RRRR\x07PLYISYDPV\x08RRRR\x04\n', '> PEPTIDE1\n\x06----------------RRRCPLYISYDPVCRRR\x06\x04\n', '> PEPTIDE1\n\x01RQIKIWFQNRRMKWKKG\x02\t\x0bPLYISYDPVC---R\x04\n', '> PEPTIDE1\n\x01--------------\x02RRRR\x0b\x0cLYISYDPVCRRRR\x04\n', '> PEPTIDE1\n\x01----------------\x02RR\x0bPLYISYDPV\x0e--RR\x04\n', '> PEPTIDE1\n\x0f------FSV-------\x10\x11RR\x12VA\x11S\x13CGG----K\x04\n', '> PEPTIDE1\n--------------------ACAKCA\t---------\n', '> PEPTIDE1\n\x01--------------K\x14\x14\x14\x14\x0b\x15LYI\x16YDPVC\x14\x14\x14\x14\x04\n', '> PEPTIDE1\nH--\x17QGTFTSEYSKYLDERAAKDFVQWLLN----K\x04\n', '> PEPTIDE1\n\x01-------------------\x0b\x18LFI\x05YDPVC---\x19\x04\n', '> PEPTIDE1\n\x1a------F------------R\x1bLY\x1c\x12----------\n', '> PEPTIDE1\n\x1d-------------------PKLY\x1e\x12--------\x1f\x04\n', '> PEPTIDE1\n\x1d-------------------PKLY\x1e\x12--------!\x04\n']
     expected_output = ['> PEPTIDE1\n[Ac]--------------[LysN3]RRRRCPLYIS[NMeY]DPVCRRRR[NH2]\n', '> PEPTIDE1\n[Ac]-------------------[dApe]PLYISYDPV[Ape]----[NH2]\n', '> PEPTIDE1\n[Ac]--------------[LysN3]RRRR[dE]PLYISYDPV[Dab]RRRR[NH2]\n', '> PEPTIDE1\n[Ape]----------------RRRCPLYISYDPVCRRR[Ape][NH2]\n', '> PEPTIDE1\n[Ac]RQIKIWFQNRRMKWKKG[LysN3][AEEA][dC]PLYISYDPVC---R[NH2]\n', '> PEPTIDE1\n[Ac]--------------[LysN3]RRRR[dC][Prot3OH]LYISYDPVCRRRR[NH2]\n', '> PEPTIDE1\n[Ac]----------------[LysN3]RR[dC]PLYISYDPV[Pen]--RR[NH2]\n', '> PEPTIDE1\n[ClAc]------FSV-------[Sar][Ahp]RR[NMeF]VA[Ahp]S[Bip]CGG----K[NH2]\n', '> PEPTIDE1\n--------------------ACAKCA[AEEA]---------\n', '> PEPTIDE1\n[Ac]--------------K[dR][dR][dR][dR][dC][dProt3Ph]LYI[aMeS]YDPVC[dR][dR][dR][dR][NH2]\n', '> PEPTIDE1\nH--[dS]QGTFTSEYSKYLDERAAKDFVQWLLN----K[NH2]\n', '> PEPTIDE1\n[Ac]-------------------[dC][Prot3Ph]LFI[dApe]YDPVC---[Hag][NH2]\n', '> PEPTIDE1\n[2moPyr]------F------------R[4Pal]LY[Nva][NMeF]----------\n', '> PEPTIDE1\n[dF]-------------------PKLY[Nle][NMeF]--------[hE][NH2]\n', '> PEPTIDE1\n[dF]-------------------PKLY[Nle][NMeF]--------[Apm][NH2]\n']
 
     # First, we need to create encoding/decoding dictionary. We'll use encode_alignment_sequences() function for this
-    encoded_file = aligner.encode_alignment_sequences(expected_output, 'PEPTIDE1', 'TEST')
-
-    # encode_alignment_sequences() creates file, so we need to rmove it
-    os.remove(encoded_file)
+    aligner.encode_alignment_sequences(expected_output, 'PEPTIDE1', STAMP, str(tmp_path))
 
     # Decode aligned sequences
     output = aligner.decode_mafft(encoded)
 
     assert output == expected_output
     """
-    path = path_to_test_data + "decode.json"
+    path = path_to_test_data / "decode.json"
 
-    with open(path, encoding="utf-8") as file:
-        data = json.load(file)
+    data = read_json(path)
 
-        for key in data:
-            encoded = data[key]["input"]
-            expected_output = data[key]["expected_output"]
+    for key in data:
+        encoded = data[key]["input"]
+        expected_output = data[key]["expected_output"]
 
-            # First, we need to create encoding/decoding dictionary. We'll use encode_alignment_sequences() function for this
-            encoded_file = aligner.encode_alignment_sequences(expected_output, key, 'TEST')
+        # First, we need to create encoding/decoding dictionary, no file is written for this
+        aligner.build_symbol_tables(expected_output, key)
 
-            # encode_alignment_sequences() creates file, so we need to remove it
-            os.remove(encoded_file)
-
-            # Decode aligned sequences
-            output = aligner.decode_mafft(encoded)
-            aligner.clear_symbols()
+        # Decode aligned sequences
+        output = aligner.decode_mafft(encoded)
+        aligner.clear_symbols()
 
-            assert output == expected_output
+        assert output == expected_output
 
 
 @pytest.mark.xfail
-def test_decode_mafft_fails_no_cleaning(aligner, path_to_test_data):
+def test_decode_mafft_fails_no_cleaning(aligner, path_to_test_data, read_json):
     """Test that aligner will use different decoding symbols, if they are not cleared"""
-    path = path_to_test_data + "decode.json"
+    path = path_to_test_data / "decode.json"
 
-    with open(path, encoding="utf-8") as file:
-        data = json.load(file)
+    data = read_json(path)
 
-        for key in data:
-            encoded = data[key]["input"]
-            expected_output = data[key]["expected_output"]
+    for key in data:
+        encoded = data[key]["input"]
+        expected_output = data[key]["expected_output"]
 
-            # First, we need to create encoding/decoding dictionary. We'll use encode_alignment_sequences() function for this
-            encoded_file = aligner.encode_alignment_sequences(expected_output, key, 'TEST')
+        # First, we need to create encoding/decoding dictionary, no file is written for this
+        aligner.build_symbol_tables(expected_output, key)
 
-            # encode_alignment_sequences() creates file, so we need to remove it
-            os.remove(encoded_file)
+        # Decode aligned sequences
+        output = aligner.decode_mafft(encoded)
 
-            # Decode aligned sequences
-            output = aligner.decode_mafft(encoded)
+        # Here we do not perform clearing of the symbols, which will result in assertion error
 
-            # Here we do not perform clearing of the symbols, which will result in assertion error
-
-            assert output == expected_output
+        assert output == expected_output
 
 
 """
@@ -292,49 +335,71 @@ def test_read_fasta(aligner):
         assert output == expected_output
 
 
+def test_read_fasta_lines(aligner):
+    """ Test reading of the FASTA input split into lines"""
+
+    input_lines = ["> PEPTIDE1", "[ClAc]FSV[Sar]", "[Ahp]RR", "", "> PEPTIDE1", "ACAKCA"]
+    expected_output = [("> PEPTIDE1", "[ClAc]FSV[Sar][Ahp]RR"), ("> PEPTIDE1", "ACAKCA")]
+
+    assert list(aligner.read_fasta_lines(input_lines)) == expected_output
+
+
 """
 Below are tests for create_substitution_matrix() function
 """
 
 
-def test_create_substitution_matrix(aligner, input_in_fasta, path_to_test_data, path_to_matrices):
+@pytest.mark.parametrize("key", POLYMER_KEYS)
+def test_create_substitution_matrix(aligner, input_in_fasta, path_to_test_data, path_to_matrices, key, tmp_path):
     """Test the creation of substitution matrix"""
 
     # Assign paths to the ROCS and monomers_map files
     path_to_subst_matrix, path_to_monomer_table = path_to_matrices
 
-    # Iterate through input data (for PEPTIDE1 and CHEM1)
-    for key in input_in_fasta:
+    # Read the data
+    data = input_in_fasta[key]
 
-        # Read the data
-        data = input_in_fasta[key]
+    # Encode the data
+    aligner.encode_alignment_sequences(data, key, STAMP, str(tmp_path))
 
-        # Artificial timestamp
-        stamp = "TEST"
+    # Create substitution matrix
+    subst_matrix_file = aligner.create_substitution_matrix(path_to_subst_matrix,
+                                                           path_to_monomer_table,
+                                                           key,
+                                                           STAMP,
+                                                           str(tmp_path))
+    # Name of the file for comparison of matrices
+    expected_file = f"{key}_EXPECTED_matrix.txt"
+    assert_files_equal(subst_matrix_file, path_to_test_data / expected_file)
 
-        # Encode the data
-        encoded_file = aligner.encode_alignment_sequences(data, key, stamp)
 
-        # Create substitution matrix
-        subst_matrix_file = aligner.create_substitution_matrix(path_to_subst_matrix,
-                                                               path_to_monomer_table,
-                                                               key,
-                                                               stamp)
-        # Name of the file for comparison of matrices
-        expected_file = f"{key}_EXPECTED_matrix.txt"
-        with open(subst_matrix_file) as output, open(path_to_test_data + expected_file) as expected_file:
-            output_data = output.readlines()
-            expected_data = expected_file.readlines()
+def test_read_matrix_index(aligner, path_to_matrices):
+    """Test that the offsets of ROCS file point to the rows of characters from the header"""
 
-            for output_line, expected_line in zip(output_data, expected_data):
-                assert output_line == expected_line
+    path_to_subst_matrix = path_to_matrices[0]
+    header_index, line_offsets = aligner._read_matrix_index(path_to_subst_matrix)
 
-        # Clear symbols of the aligner
-        aligner.clear_symbols()
+    with open(path_to_subst_matrix, "rb") as file:
+        rows = file.readlines()
+
+    assert len(line_offsets) == len(rows)
+    with open(path_to_subst_matrix, "rb") as file:
+        for char, index in list(header_index.items())[1:10]:
+            file.seek(line_offsets[index])
+            assert file.readline().split(b"\x20")[0] == char
 
-        # Remove file with encoded data and substitution matrix file
-        os.remove(encoded_file)
-        os.remove(subst_matrix_file)
+
+def test_read_monomers_map_modified(tmp_path):
+    """Test that Monomers Map is read again, after the file is modified"""
+
+    map_file = tmp_path / "monomers_map.txt"
+    map_file.write_text("symbol\tUnicode\nAib\t0100\n")
+    assert AlignUtils._read_monomers_map(str(map_file)) == (("Aib", "\u0100"),)
+    assert AlignUtils._read_monomers_map(str(map_file)) is AlignUtils._read_monomers_map(str(map_file))
+
+    map_file.write_text("symbol\tUnicode\nAib\t0101\n")
+    os.utime(map_file, (0, 0))
+    assert AlignUtils._read_monomers_map(str(map_file)) == (("Aib", "\u0101"),)
 
 
 """
@@ -342,7 +407,8 @@ Below are tests for run_mafft_utility() function
 """
 
 
-def test_run_mafft_utility(aligner, path_to_test_data, input_in_fasta, path_to_matrices):
+@requires_ginsi
+def test_run_mafft_utility(aligner, path_to_test_data, input_in_fasta, path_to_matrices, tmp_path):
     """Test running of the MAFFT program"""
 
     # Assign paths to the ROCS and monomers_map files
@@ -351,26 +417,58 @@ def test_run_mafft_utility(aligner, path_to_test_data, input_in_fasta, path_to_m
     # Change  to "alignment/mafft/bin/ginsi" for develop
     mafft_binary = "ginsi"
     key = "PEPTIDE1"
-    stamp = "TEST"
 
     data = input_in_fasta[key]
-    encoded_data = aligner.encode_alignment_sequences(data, key, stamp)
-    subst_matrix = aligner.create_substitution_matrix(path_to_subst_matrix, path_to_monomer_table, key, stamp)
+    encoded_data = aligner.encode_alignment_sequences(data, key, STAMP, str(tmp_path))
+    subst_matrix = aligner.create_substitution_matrix(path_to_subst_matrix, path_to_monomer_table, key, STAMP,
+                                                      work_dir=str(tmp_path))
 
     mafft_output, mafft_error = aligner.run_mafft_utility(encoded_data, mafft_binary=mafft_binary, matrix_file=subst_matrix, realign=False,
                                                           gap_opening_penalty=1, gap_extension_penalty=0)
 
-    mafft_output = mafft_output.split("\n")
+    assert mafft_output.encode("latin-1") == read_bytes(path_to_test_data / "PEPTIDE1_mafft_aligned.txt")
 
-    with open(path_to_test_data + "PEPTIDE1_mafft_aligned.txt") as expected_file:
-        expected_data = expected_file.readlines()
 
-        for output_line, expected_line in zip(mafft_output, expected_data):
-            expected_line = expected_line.rstrip("\n")
-            assert output_line == expected_line
+@requires_ginsi
+def test_run_mafft_utility_stdin(aligner, path_to_test_data, input_in_fasta, path_to_matrices, tmp_path):
+    """Test running of the MAFFT program with the input passed through the standard input"""
 
-    os.remove(encoded_data)
-    os.remove(subst_matrix)
+    # Assign paths to the ROCS and monomers_map files
+    path_to_subst_matrix, path_to_monomer_table = path_to_matrices
+
+    key = "PEPTIDE1"
+
+    data = input_in_fasta[key]
+    encoded_data = aligner.encode_alignment_sequences_to_bytes(data, key)
+    subst_matrix = aligner.create_substitution_matrix(path_to_subst_matrix, path_to_monomer_table, key, STAMP,
+                                                      work_dir=str(tmp_path))
+
+    mafft_output, mafft_error = aligner.run_mafft_utility("-", mafft_binary="ginsi", matrix_file=subst_matrix, realign=False,
+                                                          gap_opening_penalty=1, gap_extension_penalty=0, input_data=encoded_data)
+
+    assert mafft_output.encode("latin-1") == read_bytes(path_to_test_data / "PEPTIDE1_mafft_aligned.txt")
+
+
+@requires_mafft
+def test_run_mafft_utility_argv(aligner, path_to_test_data, input_in_fasta, path_to_matrices, tmp_path):
+    """Test running of the MAFFT program given as a tuple of arguments, the same as "ginsi" """
+
+    # Assign paths to the ROCS and monomers_map files
+    path_to_subst_matrix, path_to_monomer_table = path_to_matrices
+
+    key = "PEPTIDE1"
+
+    data = input_in_fasta[key]
+    encoded_data = aligner.encode_alignment_sequences_to_bytes(data, key)
+    subst_matrix = aligner.create_substitution_matrix(path_to_subst_matrix, path_to_monomer_table, key, STAMP,
+                                                      work_dir=str(tmp_path))
+
+    mafft_binary = ("mafft", "--globalpair", "--maxiterate", "1000")
+    mafft_output, mafft_error = aligner.run_mafft_utility("-", mafft_binary=mafft_binary, matrix_file=subst_matrix,
+                                                          realign=False, gap_opening_penalty=1, gap_extension_penalty=0,
+                                                          input_data=encoded_data)
+
+    assert mafft_output.encode("latin-1") == read_bytes(path_to_test_data / "PEPTIDE1_mafft_aligned.txt")
 
 
 """
@@ -411,6 +509,17 @@ def test_parse_naa_in_fasta_empty(aligner):
     assert expected_list == out_list
 
 
+def test_parse_naa_in_fasta_unpaired_closing(aligner):
+    """Test that closing bracket without the opening one is skipped"""
+
+    seq = "]A[Sar]KK[NH2]"
+    expected_list = ["[Sar]", "[NH2]"]
+
+    out_list = aligner.parse_naa_in_fasta(seq)
+
+    assert expected_list == out_list
+
+
 def test_parse_naa_in_fasta_fails(aligner):
     """Test the raising of the error, in case of invalid notation (inconsistent number of opening and closing brackets)"""
 
@@ -420,3 +529,59 @@ def test_parse_naa_in_fasta_fails(aligner):
         aligner.parse_naa_in_fasta(seq)
 
     assert str(excinfo.value) == f"Non-valid notation of non-natural amino acids in the following sequence {seq}"
+
+
+@requires_ginsi
+def test_run_mafft_utility_add_data(aligner, input_in_fasta, path_to_matrices, tmp_path):
+    """Test that realignment with new sequences passed through a pipe gives the same result, as with a file"""
+
+    # Assign paths to the ROCS and monomers_map files
+    path_to_subst_matrix, path_to_monomer_table = path_to_matrices
+
+    key = "PEPTIDE1"
+    data = input_in_fasta[key]
+    encoded_data = aligner.encode_alignment_sequences_to_bytes(data[:-2], key)
+    new_data = aligner.encode_alignment_sequences_to_bytes(data[-2:], key)
+    subst_matrix = aligner.create_substitution_matrix(path_to_subst_matrix, path_to_monomer_table, key, STAMP,
+                                                      work_dir=str(tmp_path))
+
+    mafft_args = {"mafft_binary": "ginsi", "matrix_file": subst_matrix, "gap_opening_penalty": 1,
+                  "gap_extension_penalty": 0}
+    aligned, _ = aligner.run_mafft_utility("-", realign=False, input_data=encoded_data, **mafft_args)
+
+    new_file = tmp_path / "new.txt"
+    new_file.write_bytes(new_data)
+    expected_output, _ = aligner.run_mafft_utility("-", str(new_file), realign=True, realign_method="add",
+                                                   input_data=aligned.encode("latin-1"), **mafft_args)
+    mafft_output, _ = aligner.run_mafft_utility("-", realign=True, realign_method="add",
+                                                input_data=aligned.encode("latin-1"), add_data=new_data, **mafft_args)
+
+    assert mafft_output == expected_output
+    assert mafft_output.count(">") == len(data)
+
+
+def test_run_mafft_utility_limit(monkeypatch):
+    """Test that MAFFT runs, while holding the shared limit of MAFFT processes"""
+
+    semaphore = threading.BoundedSemaphore(1)
+    monkeypatch.setattr("alignment.AlignUtils._MAFFT_SEMAPHORE", semaphore)
+
+    def fake_run(cmd, **kwargs):
+        # The only slot is taken by this run
+        assert not semaphore.acquire(blocking=False)
+        return CompletedProcess(cmd, 0, stdout=b">seq\nA\n", stderr=b"")
+
+    monkeypatch.setattr("alignment.AlignUtils.run", fake_run)
+    mafft_output, _ = AlignUtils.run_mafft_utility("-", mafft_binary="ginsi", matrix_file="matrix.txt", realign=False,
+                                                   gap_opening_penalty=1, gap_extension_penalty=0, input_data=b">seq\nA\n")
+
+    assert mafft_output == ">seq\nA\n"
+    assert semaphore.acquire(blocking=False)
+
+
+def test_run_mafft_utility_realign_without_new_sequences():
+    """Test that realignment fails clearly, if neither the file of new sequences, nor the data are given"""
+
+    with pytest.raises(ValueError, match="new sequences"):
+        AlignUtils.run_mafft_utility("-", mafft_binary="ginsi", matrix_file="matrix.txt", realign=True, realign_method="add",
+                                     gap_opening_penalty=1, gap_extension_penalty=0, input_data=b">seq\nA\n")
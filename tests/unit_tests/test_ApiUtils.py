@@ -1,8 +1,10 @@
 import json
 import pytest
+from pathlib import Path
 
 from alignment.ApiUtils import extract_helm_from_json, extract_subpeptide, extract_monomer, \
-    extract_aligned_sequences, json_output, escape_double_quotes_in_input
+    extract_aligned_sequences, json_output, dump_json
+from alignment.PyHELM_simple import NotationError
 
 
 # Pytest fixtures
@@ -12,11 +14,11 @@ def helm_seq():
     return "PEPTIDE1{[ClAc].F.S.V.[Sar].[Ahp].R.R.[NMeF].V.A.[Ahp].S.[Bip].C.G.G.K.[NH2]}|PEPTIDE2{[ClAc].F.S.V.[Sar].[Ahp].R.R.[NMeF].V.A.[Ahp].S.[Bip].C.G.G.K.[NH2]}|CHEM1{[PEG2diacid]}$PEPTIDE1,CHEM1,18:R3-1:R2|PEPTIDE2,CHEM1,18:R3-1:R1|PEPTIDE2,PEPTIDE2,1:R1-15:R3|PEPTIDE1,PEPTIDE1,1:R1-15:R3$$$V2.0"
 
 
-@pytest.fixture
+@pytest.fixture(scope="session")
 def path_to_data():
-    # Returns path to data
+    # Returns path to data, built once for the session
 
-    path = "tests/unit_tests/resources/test_ApiUtils/"
+    path = Path(__file__).resolve().parent / "resources" / "test_ApiUtils"
     return path
 
 
@@ -25,17 +27,15 @@ Below are tests for function extract_helm_from_json()
 """
 
 
-def test_extract_helm_from_json(path_to_data):
+def test_extract_helm_from_json(path_to_data, read_json):
     """Test extraction of HELM strings from JSON input"""
 
-    path = path_to_data + 'example.json'
-    with open(path) as file:
-        input_json = json.load(file)
-        output = extract_helm_from_json(input_json)
-        expected_output = "PEPTIDE1{F.C.R.C.A.C.C.D.M.K.L}|PEPTIDE2{F.C.R.C.A.C.C.D.M.K.a" \
-                          "MeL}$$$$\nPEPTIDE1{F.C.R.C.A.C.C.D.M.K.L}|PEPTIDE2{F.C.R.C.A.C.C.D.M.K.aMeL}$$$$"
+    input_json = read_json(path_to_data / 'example.json')
+    output = extract_helm_from_json(input_json)
+    expected_output = "PEPTIDE1{F.C.R.C.A.C.C.D.M.K.L}|PEPTIDE2{F.C.R.C.A.C.C.D.M.K.a" \
+                      "MeL}$$$$\nPEPTIDE1{F.C.R.C.A.C.C.D.M.K.L}|PEPTIDE2{F.C.R.C.A.C.C.D.M.K.aMeL}$$$$"
 
-        assert output == expected_output
+    assert output == expected_output
 
 
 @pytest.mark.xfail(raises=KeyError)
@@ -71,19 +71,38 @@ def test_extract_subpeptide_missing(helm_seq):
     assert output is None
 
 
+def test_extract_subpeptide_name_prefix():
+    """Test that the sub-peptide is found by its full name, not as a part of another name or a connection"""
+
+    helm = "PEPTIDE11{A.C}|XPEPTIDE1{G}|PEPTIDE1{[ClAc].F}$PEPTIDE1,PEPTIDE11,1:R1-2:R3$$$V2.0"
+
+    assert extract_subpeptide("PEPTIDE1", helm) == "[ClAc].F"
+    assert extract_subpeptide("PEPTIDE11", helm) == "A.C"
+    assert extract_subpeptide("EPTIDE1", helm) is None
+
+
+@pytest.mark.parametrize("helm", ["PEPTIDE1{A.B", "PEPTIDE1{A.B|PEPTIDE2{C}$$$$", "PEPTIDE1{A.B.C}"])
+def test_extract_subpeptide_invalid_helm(helm):
+    """Test that exception is raised, given the HELM string without closing bracket or sections"""
+
+    with pytest.raises(NotationError) as exception:
+        extract_subpeptide("PEPTIDE1", helm)
+
+    assert str(exception.value) == "Invalid HELM notation"
+
+
 """
 Below are tests for function extract_monomer()
 """
 
 
 def test_extract_monomer():
-    """Test the correct work of generator function extract_monomer()"""
+    """Test the correct work of function extract_monomer()"""
 
     aligned_seq = "[Ac]--------------[LysN3]RRRRCPLYIS[NMeY]DPVCRRRR[NH2]"
     monos = ['Ac', '-', '-', '-', '-', '-', '-', '-', '-', '-', '-', '-', '-', '-', '-', 'LysN3', 'R', 'R', 'R', 'R', 'C', 'P', 'L', 'Y', 'I', 'S', 'NMeY', 'D', 'P', 'V', 'C', 'R', 'R', 'R', 'R', 'NH2']
 
-    for extracted, mono in zip(extract_monomer(aligned_seq), monos):
-        assert extracted == mono
+    assert extract_monomer(aligned_seq) == monos
 
 
 def test_extract_monomer_corrupted_seq():
@@ -93,7 +112,7 @@ def test_extract_monomer_corrupted_seq():
     aligned_seq = "[Ac]----[LysN3RRCPLYISNMeYDPRNH2"
 
     with pytest.raises(Exception) as excinfo:
-        [el for el in extract_monomer(aligned_seq)]
+        extract_monomer(aligned_seq)
 
     expected_message = f"Non-valid notation of non-natural amino acids in the following sequence {aligned_seq}"
     assert str(excinfo.value) == expected_message
@@ -104,15 +123,13 @@ Below are tests for function extract_aligned_sequences()
 """
 
 
-def test_extract_aligned_sequences(path_to_data):
+def test_extract_aligned_sequences(path_to_data, read_json):
 
-    path = path_to_data + "aligned.json"
-    with open(path) as file:
-        input_json = json.load(file)
-        expected_output = "> PEPTIDE2\n[ClAc]-FYSW[Sar]NYWSYY[Sar]WC-[NH2]\n> PEPTIDE2\n[ClAc]-FYSW[Sar]NYWSYA[Sar]WCG[NH2]\n> PEPTIDE2\n[ClAc]-FYSW[Sar]NYWSYYAWCG[NH2]\n> PEPTIDE2\n[ClAc]-FYSW[Sar]NYWSYY[Sar]ACG[NH2]"
-        output = extract_aligned_sequences(input_json)
+    input_json = read_json(path_to_data / "aligned.json")
+    expected_output = "> PEPTIDE2\n[ClAc]-FYSW[Sar]NYWSYY[Sar]WC-[NH2]\n> PEPTIDE2\n[ClAc]-FYSW[Sar]NYWSYA[Sar]WCG[NH2]\n> PEPTIDE2\n[ClAc]-FYSW[Sar]NYWSYYAWCG[NH2]\n> PEPTIDE2\n[ClAc]-FYSW[Sar]NYWSYY[Sar]ACG[NH2]"
+    output = extract_aligned_sequences(input_json)
 
-        assert output == expected_output
+    assert output == expected_output
 
 
 """
@@ -120,47 +137,41 @@ Below are tests for json_output() method
 """
 
 
-def test_json_output(path_to_data):
+def test_json_output(path_to_data, read_json):
     """Test the correct creation of JSON output"""
 
-    aligned_path = path_to_data + "raw_output.json"
-    input_path = path_to_data + "raw_input.json"
-    expected_path = path_to_data + "json_output.json"
+    aligned_data = read_json(path_to_data / "raw_output.json")
+    input_data = read_json(path_to_data / "raw_input.json")
+    expected_output = read_json(path_to_data / "json_output.json")
 
-    with open(aligned_path) as aligned, open(input_path) as input_json, open(expected_path) as out:
-        aligned_data = json.load(aligned)
-        input_data = json.load(input_json)
-        expected_output = json.load(out)
+    output = json_output(aligned_data, input_data)
 
-        output = json_output(aligned_data, input_data)
+    assert output == expected_output
 
-        assert output == expected_output
 
+def test_json_output_double_quotes():
+    """Test that double quotes in HELM string are kept unchanged in JSON output"""
 
-"""
-Below are test for escape_double_quotes_in_input() method
-"""
+    helm = 'PEPTIDE1{[ClAc].F.S}$$${"chiral":"ena"}$V2.0'
+    aligned_data = {"PEPTIDE1": "> PEPTIDE1\n[ClAc]F-S\n"}
+    input_data = [{"ID": "ID1", "HELM": helm}]
+
+    output = json_output(aligned_data, input_data)
 
+    assert output == [{"PolymerID": "PEPTIDE1", "AlignedSubpeptide": "[ClAc].F.S", "HELM": helm, "ID": "ID1",
+                       "AlignedSeq": "[ClAc]F-S", "PEPTIDE1_1": "ClAc", "PEPTIDE1_2": "F", "PEPTIDE1_3": "-",
+                       "PEPTIDE1_4": "S"}]
 
-def test_escape_double_quotes_in_input():
-    """Test the correct addition of escape characters to the HELM string"""
 
-    input_data = [{'ID': 'L-006579559-000J001',
-                   'HELM': 'PEPTIDE1{[ClAc].[dF].[dV].[dApe].[dW].[dY].[dD].[dNMeF].G.[dL].[dApe].[dL].[dC].[NH2]}|CHEM1{[tRCM]}$PEPTIDE1,CHEM1,4:R3-1:R1|PEPTIDE1,CHEM1,11:R3-1:R2|PEPTIDE1,PEPTIDE1,1:R1-13:R3$${"chiral":"ena"}$V2.0'
-                   },
-                  {'ID': 'L-006579556-000H001',
-                   'HELM': 'PEPTIDE1{[ClAc].[dF].[dV].[dY].[rbaFW].[dY].[dD].[dNMeF].G.[dApe].[dD].[dL].[dC].[NH2]}|CHEM1{[cRCM]}$PEPTIDE1,PEPTIDE1,1:R1-13:R3|PEPTIDE1,CHEM1,5:R3-1:R1|PEPTIDE1,CHEM1,10:R3-1:R2$${"chiral":"mix"}$V2.0'
-                   }]
+"""
+Below are tests for dump_json() function
+"""
 
-    expected_output = [{'ID': 'L-006579559-000J001',
-                        'HELM': 'PEPTIDE1{[ClAc].[dF].[dV].[dApe].[dW].[dY].[dD].[dNMeF].G.[dL].[dApe].[dL].[dC].[NH2]}|CHEM1{[tRCM]}$PEPTIDE1,CHEM1,4:R3-1:R1|PEPTIDE1,CHEM1,11:R3-1:R2|PEPTIDE1,PEPTIDE1,1:R1-13:R3$${\\\"chiral\\\":\\\"ena\\\"}$V2.0'
-                        },
-                       {'ID': 'L-006579556-000H001',
-                       'HELM': 'PEPTIDE1{[ClAc].[dF].[dV].[dY].[rbaFW].[dY].[dD].[dNMeF].G.[dApe].[dD].[dL].[dC].[NH2]}|CHEM1{[cRCM]}$PEPTIDE1,PEPTIDE1,1:R1-13:R3|PEPTIDE1,CHEM1,5:R3-1:R1|PEPTIDE1,CHEM1,10:R3-1:R2$${\\\"chiral\\\":\\\"mix\\\"}$V2.0'
-                        }]
 
-    result = escape_double_quotes_in_input(input_data)
+def test_dump_json(path_to_data, read_json):
+    """Test that JSON output is serialized without loss, including double quotes in HELM string"""
 
-    for output, expected in zip(result, expected_output):
+    expected_output = read_json(path_to_data / "json_output.json")
+    output = {"Alignment": expected_output + [{"HELM": 'PEPTIDE1{A}$$${"chiral":"ena"}$V2.0'}], "AlignmentScore": 1.5}
 
-        assert output["HELM"] == expected["HELM"]
+    assert json.loads(dump_json(output)) == output
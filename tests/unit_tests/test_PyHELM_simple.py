@@ -1,6 +1,16 @@
 import pytest
 
-from alignment.PyHELM_simple import HelmObj, NotationError, Polymer, Connection
+from alignment.PyHELM_simple import HelmObj, NotationError, Polymer, Connection, _split_and_validate
+
+
+def polymer_fields(polymer):
+    """Returns the fields of the polymer as a tuple, so polymers can be compared at once"""
+    return polymer.type, polymer.data, polymer.name
+
+
+def connection_fields(connection):
+    """Returns the fields of the connection as a tuple, with the fields of its polymers"""
+    return [polymer_fields(poly) for poly in connection.polymers], connection.start, connection.stop
 
 
 # Pytest fixtures
@@ -10,7 +20,7 @@ def helm_obj():
     return HelmObj()
 
 
-@pytest.fixture
+@pytest.fixture(scope="session")
 def helm_string():
     helm_sequence = "PEPTIDE1{[Ac].[dApe].P.L.Y.I.S.Y.D.P.V.[Ape].[NH2]}|PEPTIDE2{[ClAc].F.S.V.[Sar].[Ahp].R.R.[NMeF].V.A.[Ahp].S.[Bip].C.G.G.K.[NH2]}|CHEM1{[PEG2diacid]}$PEPTIDE1,CHEM1,18:R3-1:R2|PEPTIDE2,CHEM1,18:R3-1:R1|PEPTIDE2,PEPTIDE2,1:R1-15:R3|PEPTIDE1,PEPTIDE1,1:R1-15:R3$$$V2.0"
 
@@ -123,6 +133,20 @@ def test_validate_helm_wrong_connections(helm_obj):
     assert validation is False
 
 
+def test_validate_helm_then_parse_helm(helm_obj, helm_string):
+    """Test that HELM string, which is validated and then parsed, is validated only once"""
+
+    # HELM string, which is not cached by other tests
+    helm_string = helm_string + " "
+    assert helm_obj.validate_helm(helm_string) is True
+
+    misses = _split_and_validate.cache_info().misses
+    helm_obj.parse_helm(helm_string)
+
+    assert _split_and_validate.cache_info().misses == misses
+    assert [poly.name for poly in helm_obj.polymers] == ["PEPTIDE1", "PEPTIDE2", "CHEM1"]
+
+
 """
 Below are tests for parse_helm() function
 """
@@ -150,30 +174,23 @@ def test_parse_helm(helm_obj, helm_string):
     # List of connections
     connections = [connection1, connection2, connection3, connection4]
 
-    # Iterate through parsed and manually defined polymers and compare them
-    for poly_parsed, poly_expected in zip(helm_obj.polymers, polymers):
-        # Compare the name, type and data of polymers
-
-        assert poly_parsed.type == poly_expected.type
-        assert poly_parsed.name == poly_expected.name
-        assert poly_parsed.data == poly_expected.data
+    # Compare the name, type and data of polymers, and the polymers, start and stop of connections
+    assert [polymer_fields(poly) for poly in helm_obj.polymers] == [polymer_fields(poly) for poly in polymers]
+    assert [connection_fields(conn) for conn in helm_obj.connections] == [connection_fields(conn) for conn in connections]
 
-    # Iterate through the parsed and manually defined connections and compare them
-    for i, conn in enumerate(zip(helm_obj.connections, connections)):
 
-        con_parsed, con_expected = conn
+def test_parse_helm_repeated(helm_string):
+    """Test that HELM string parsed again gives new objects with the same content"""
 
-        # Iterate through the polymers of parsed connections, and manually defined connections (which are accessed by index)
-        for poly_parsed, poly_expected in zip(con_parsed.polymers, connections[i].polymers):
-            # Compare the name, type and data of polymers
+    first, second = HelmObj(), HelmObj()
+    first.parse_helm(helm_string)
+    second.parse_helm(helm_string)
+    first.polymers[0].data = "A"
 
-            assert poly_parsed.name == poly_expected.name
-            assert poly_parsed.type == poly_expected.type
-            assert poly_parsed.data == poly_expected.data
-
-        # Compare start and stop variables of the connection
-        assert con_parsed.start == con_expected.start
-        assert con_parsed.stop == con_expected.stop
+    assert second.polymers[0].data == "[Ac].[dApe].P.L.Y.I.S.Y.D.P.V.[Ape].[NH2]"
+    assert [poly.name for poly in first.polymers] == [poly.name for poly in second.polymers]
+    assert [(conn.start, conn.stop) for conn in first.connections] == [(conn.start, conn.stop) for conn in second.connections]
+    assert second.connections[0].polymers[0] is second.polymers[0]
 
 
 def test_parse_helm_invalid_helm(helm_obj):
@@ -188,6 +205,16 @@ def test_parse_helm_invalid_helm(helm_obj):
     assert str(exception.value) == "Invalid HELM notation"
 
 
+@pytest.mark.parametrize("helm_string", ["PEPTIDE1A.B}$$$$", "PEPTIDE1{A.B}|CHEM1[X]}$$$$"])
+def test_parse_helm_missing_bracket(helm_obj, helm_string):
+    """Test that exception is raised, given the polymer without curly brackets around its data"""
+
+    with pytest.raises(Exception) as exception:
+        helm_obj.parse_helm(helm_string)
+
+    assert str(exception.value) == "Invalid HELM notation"
+
+
 """
 Below are tests for get_polymer_names_from_helm() method
 """
@@ -220,6 +247,15 @@ def test_get_polymers_from_helm(helm_obj, helm_string):
     assert polymers == expected_polymers
 
 
+def test_get_polymers_from_helm_repeated(helm_obj, helm_string):
+    # Test that the list of polymers can be modified by the caller, as the split of HELM string is cached
+
+    polymers = helm_obj.get_polymers_from_helm(helm_string)
+    polymers.clear()
+
+    assert len(helm_obj.get_polymers_from_helm(helm_string)) == 3
+
+
 """
 Below are tests for get_polymers_from_helm() method
 """
@@ -247,3 +283,13 @@ def test_get_distinct_monomers_from_polymer(helm_obj, helm_string):
     expected_monos = {'V', '[NH2]', '[dApe]', 'L', 'Y', 'D', '[Ape]', 'S', '[Ac]', 'I', 'P'}
 
     assert monos == expected_monos
+
+
+def test_get_distinct_monomers_from_polymer_cached(helm_obj, helm_string):
+    """Test that the repeated call returns the same immutable set"""
+
+    monos = helm_obj.get_distinct_monomers_from_polymer(helm_string, "PEPTIDE2")
+
+    assert isinstance(monos, frozenset)
+    assert monos is helm_obj.get_distinct_monomers_from_polymer(helm_string, "PEPTIDE2")
+    assert monos == set(helm_obj.get_monomers_from_polymer(helm_string, "PEPTIDE2"))
@@ -1,10 +1,11 @@
+import numpy as np
 import pytest
 
 from pymsa import MSA, SumOfPairs
 from alignment.scoring.ScoringUtils import CustomMatrix, Scoring
 
 
-@pytest.fixture
+@pytest.fixture(scope="session")
 def path_to_resources():
     # Return path to the test data
 
@@ -12,7 +13,7 @@ def path_to_resources():
     return path
 
 
-@pytest.fixture
+@pytest.fixture(scope="session")
 def path_to_matrix(path_to_resources):
     # Return path to the substitution matrix
 
@@ -20,7 +21,7 @@ def path_to_matrix(path_to_resources):
     return path
 
 
-@pytest.fixture
+@pytest.fixture(scope="session")
 def custom_matrix(path_to_matrix):
     # Return custom matrix
 
@@ -28,28 +29,25 @@ def custom_matrix(path_to_matrix):
     return matrix
 
 
-@pytest.fixture
+@pytest.fixture(scope="session")
 def expected_matrix(path_to_resources):
     # Return expected distance matrix
 
     path = path_to_resources + "expected_matrix.txt"
-    with open(path, encoding="utf-8") as file:
-        file = file.readlines()
-        matrix = dict()
-        for line in file:
-            k1, k2, value = line.split("\t")
-            matrix[(chr(int(k1)), chr(int(k2)))] = float(value)
-        return matrix
+    # Columns are codes of both symbols and the score
+    data = np.loadtxt(path, delimiter="\t", ndmin=2)
+    keys = zip(map(chr, data[:, 0].astype(int).tolist()), map(chr, data[:, 1].astype(int).tolist()))
+    return dict(zip(keys, data[:, 2].tolist()))
 
 
-@pytest.fixture
+@pytest.fixture(scope="session")
 def mafft_output(path_to_resources):
     # return aligned sequences
 
     path = path_to_resources + "aligned_seqs.txt"
 
     with open(path) as file:
-        aligned_seqs = "".join(file.readlines())
+        aligned_seqs = file.read()
         return aligned_seqs
 
 
@@ -77,6 +75,32 @@ def test_read_matrix_from_file(path_to_matrix, expected_matrix):
     assert matrix == expected_matrix
 
 
+def test_get_cached_matrix(path_to_matrix, expected_matrix, tmp_path):
+    """Test that the matrix is parsed once, and parsed again after the file is modified"""
+
+    assert CustomMatrix.get_cached_matrix(path_to_matrix) == expected_matrix
+    assert CustomMatrix.get_cached_matrix(path_to_matrix) is CustomMatrix.get_cached_matrix(path_to_matrix)
+
+    matrix_file = tmp_path / "matrix.txt"
+    matrix_file.write_text("0x41 0x41 5   # A x A\n")
+    assert CustomMatrix.get_cached_matrix(str(matrix_file)) == {("A", "A"): 5}
+
+    matrix_file.write_text("0x41 0x41 7   # A x A\n0x41 0x43 1   # A x C\n")
+    assert CustomMatrix.get_cached_matrix(str(matrix_file)) == {("A", "A"): 7, ("A", "C"): 1}
+
+
+def test_get_byte_score_table(custom_matrix, expected_matrix):
+    """Test that the dense table of scores contains all the pairs of the matrix in both orders"""
+
+    table, known = custom_matrix.get_byte_score_table()
+
+    assert known.sum() <= 2 * len(expected_matrix)
+    for (symb1, symb2), score in expected_matrix.items():
+        assert known[ord(symb1), ord(symb2)] and known[ord(symb2), ord(symb1)]
+        assert table[ord(symb1), ord(symb2)] == score
+    assert custom_matrix.get_byte_score_table()[0] is table
+
+
 """
 Below are tests for Scoring class
 """
@@ -89,11 +113,10 @@ def test_mafft_output_to_msa(mafft_output):
 
     assert msa.is_valid
 
-    aligned_seqs = mafft_output.strip().split("\n")
-    ids = [i for i in aligned_seqs[::2]]
-    seqs = [i for i in aligned_seqs[1::2]]
-
-    expected_msa = MSA(seqs, ids)
+    # Every sequence of the test file is on a single line, so ids and sequences alternate.
+    # Encoded sequences contain symbols, which str.splitlines() treats as line breaks
+    aligned_seqs = mafft_output.rstrip("\n").split("\n")
+    expected_msa = MSA(aligned_seqs[1::2], aligned_seqs[::2])
 
     for id_out, id_exp, seq_out, seq_exp in zip(msa.ids, expected_msa.ids, msa.sequences, expected_msa.sequences):
 
@@ -101,6 +124,16 @@ def test_mafft_output_to_msa(mafft_output):
         assert seq_out == seq_exp
 
 
+def test_mafft_output_to_msa_encoded():
+    """Test that sequences split into several lines and symbols treated as line breaks by str.splitlines() are kept"""
+
+    mafft_output = ">seq1\nA\x1cC\nD-\n>seq2\nA\x85-\nDE\n"
+    msa = Scoring.mafft_output_to_msa(mafft_output)
+
+    assert msa.ids == [">seq1", ">seq2"]
+    assert msa.sequences == ["A\x1cCD-", "A\x85-DE"]
+
+
 """
 Below are tests for sum_of_pairs() method
 """
@@ -116,3 +149,26 @@ def test_sum_of_pairs(path_to_matrix, mafft_output):
     expected_score = SumOfPairs(msa, matrix).compute()
 
     assert score == expected_score
+
+
+def test_sum_of_pairs_numpy(path_to_matrix, mafft_output):
+    """Test that the vectorized scoring gives the same result as pyMSA"""
+
+    matrix = CustomMatrix(path_to_matrix)
+
+    # Test both the original alignment and a bigger one, which is scored with NumPy by sum_of_pairs()
+    for repeats in [1, 10]:
+        msa = Scoring.mafft_output_to_msa(mafft_output * repeats)
+        expected_score = SumOfPairs(msa, matrix).compute()
+
+        assert Scoring._sum_of_pairs_numpy(msa, matrix) == expected_score
+        assert Scoring.sum_of_pairs(msa, path_to_matrix) == expected_score
+
+
+def test_sum_of_pairs_numpy_missing_pair(path_to_matrix):
+    """Test that alignment with the pair of symbols, which is missing in the matrix, is not scored with NumPy"""
+
+    matrix = CustomMatrix(path_to_matrix)
+    msa = MSA(["ZA-", "ZA-"], ["> PEPTIDE1", "> PEPTIDE1"])
+
+    assert Scoring._sum_of_pairs_numpy(msa, matrix) is None
@@ -1,10 +1,11 @@
 import pytest
+from pydantic import TypeAdapter
 
 from alignment.models import Peptide, AlignedPeptide, ApiStatus, \
-    MafftVersion, MafftMethods, RealignInput, RealignMethods
+    MafftVersion, MafftMethods, RealignInput, RealignMethods, PolymerID
 
 
-@pytest.fixture
+@pytest.fixture(scope="session")
 def peptide_to_align():
     peptide = {"ID": "L-000000010",
                "HELM": "PEPTIDE1{H.[dS].Q.G.T.F.T.S.E.Y.S.K.Y.L.D.E.R.A.A.K.D.F.V.Q.W.L.L.N.K.[NH2]}|PEPTIDE2{[C18diacid].[gE].[AEEA].[AEEA]}$PEPTIDE1,PEPTIDE2,12:R3-4:R2|PEPTIDE1,PEPTIDE1,16:R3-20:R3$$$V2.0"
@@ -13,7 +14,7 @@ def peptide_to_align():
     return peptide
 
 
-@pytest.fixture
+@pytest.fixture(scope="session")
 def aligned_peptide():
     peptide = {"PolymerID": "PEPTIDE1",
                "AlignedSubpeptide": "H.[dS].Q.G.T.F.T.S.E.Y.S.K.Y.L.D.E.R.A.A.K.D.F.V.Q.W.L.L.N.K.[NH2]",
@@ -160,8 +161,7 @@ def test_RealignInput(peptide_to_align, aligned_peptide):
 
     realign_input = RealignInput(aligned_sequences=[aligned_peptide], new_sequences=[peptide_to_align])
 
-    assert realign_input.aligned_sequences == [aligned_peptide]
-    assert realign_input.new_sequences == [peptide_to_align]
+    assert realign_input.model_dump() == {"aligned_sequences": [aligned_peptide], "new_sequences": [peptide_to_align]}
 
 
 def test_RealignInput_validation_error():
@@ -194,3 +194,17 @@ def test_RealignMethods_type_error():
         RealignMethods()
 
     assert exception.typename == "TypeError"
+
+
+"""
+Below are test for PolymerID type
+"""
+
+
+def test_PolymerID():
+    """Test that polymer ID is converted to upper case, and None is kept"""
+
+    adapter = TypeAdapter(PolymerID)
+
+    assert adapter.validate_python("peptide1") == "PEPTIDE1"
+    assert adapter.validate_python(None) is None